@@ -9,6 +9,8 @@ from sqlalchemy.ext.asyncio import AsyncEngine
 from src.db.db import Base
 from src.core.config import app_settings
 from src.models.urlmodel import UrlModel, UrlUsageModel
+from src.models.analytics import UsageRollupModel, UsageHostRollupModel, \
+    UsageReferrerRollupModel, RollupStateModel
 from alembic import context
 from dotenv import load_dotenv
 load_dotenv('./src/.env')
@@ -0,0 +1,24 @@
+"""02_usage-keyset-index
+
+Revision ID: 4b1e2a7c9d10
+Revises: cf3a9f4e9252
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '4b1e2a7c9d10'
+down_revision = 'cf3a9f4e9252'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_usage_url_id_used_at_id', 'usage',
+                    ['url_id', 'used_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_usage_url_id_used_at_id', table_name='usage')
@@ -0,0 +1,31 @@
+"""03_url-click-count
+
+Revision ID: 7d3f5c1a2b84
+Revises: 4b1e2a7c9d10
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d3f5c1a2b84'
+down_revision = '4b1e2a7c9d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('url', sa.Column('click_count', sa.BigInteger(),
+                                   server_default='0', nullable=False))
+    op.execute(
+        'UPDATE url SET click_count = counted.clicks '
+        'FROM (SELECT url_id, count(*) AS clicks FROM usage '
+        'GROUP BY url_id) AS counted '
+        'WHERE url.id = counted.url_id'
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('url', 'click_count')
@@ -0,0 +1,32 @@
+"""10_routable-codes
+
+Revision ID: a3e5c7b9d1f2
+Revises: f1c9a3d5e7b2
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3e5c7b9d1f2'
+down_revision = 'f1c9a3d5e7b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # All-digit paths resolve as url ids, so all-digit generated codes
+    # could never be followed. They get the prefix new codes get
+    # (src.services.shortcodes.NUMERIC_PREFIX).
+    op.execute("""
+        UPDATE url SET short_url = '_' || short_url
+        WHERE short_url ~ '^[0-9]+$' AND NOT EXISTS (
+            SELECT 1 FROM url taken WHERE taken.short_url = '_' || url.short_url)
+    """)
+
+
+def downgrade() -> None:
+    # prefixed codes can not be told apart from aliases, and resolve
+    # either way
+    pass
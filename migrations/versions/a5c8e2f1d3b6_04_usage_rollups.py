@@ -0,0 +1,58 @@
+"""04_usage-rollups
+
+Revision ID: a5c8e2f1d3b6
+Revises: 7d3f5c1a2b84
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a5c8e2f1d3b6'
+down_revision = '7d3f5c1a2b84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('usage', sa.Column('referrer', sa.String(length=2048),
+                                     nullable=True))
+    op.create_table('usage_rollup',
+    sa.Column('url_id', sa.Integer(), nullable=False),
+    sa.Column('granularity', sa.String(length=8), nullable=False),
+    sa.Column('bucket', sa.DateTime(), nullable=False),
+    sa.Column('clicks', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['url_id'], ['url.id'], ),
+    sa.PrimaryKeyConstraint('url_id', 'granularity', 'bucket')
+    )
+    op.create_table('usage_host_rollup',
+    sa.Column('url_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.DateTime(), nullable=False),
+    sa.Column('client_host', sa.String(length=2048), nullable=False),
+    sa.Column('clicks', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['url_id'], ['url.id'], ),
+    sa.PrimaryKeyConstraint('url_id', 'day', 'client_host')
+    )
+    op.create_table('usage_referrer_rollup',
+    sa.Column('url_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.DateTime(), nullable=False),
+    sa.Column('referrer', sa.String(length=2048), nullable=False),
+    sa.Column('clicks', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['url_id'], ['url.id'], ),
+    sa.PrimaryKeyConstraint('url_id', 'day', 'referrer')
+    )
+    op.create_table('usage_rollup_state',
+    sa.Column('name', sa.String(length=32), nullable=False),
+    sa.Column('last_usage_id', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('usage_rollup_state')
+    op.drop_table('usage_referrer_rollup')
+    op.drop_table('usage_host_rollup')
+    op.drop_table('usage_rollup')
+    op.drop_column('usage', 'referrer')
@@ -0,0 +1,33 @@
+"""11_url-digest-shared
+
+Revision ID: b4e8d2f6a9c1
+Revises: a3e5c7b9d1f2
+Create Date: 2026-10-20 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4e8d2f6a9c1'
+down_revision = 'a3e5c7b9d1f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # deleted, expiring and limited links are no longer handed to new
+    # callers, so only the shared ones stay unique per digest
+    op.create_index('ix_url_url_digest_shared', 'url', ['url_digest'],
+                    unique=True,
+                    postgresql_where=sa.text(
+                        'deleted IS NOT TRUE AND expires_at IS NULL '
+                        'AND max_clicks IS NULL'))
+    op.drop_constraint('url_url_digest_key', 'url', type_='unique')
+
+
+def downgrade() -> None:
+    # fails while a url is shortened more than once
+    op.create_unique_constraint('url_url_digest_key', 'url', ['url_digest'])
+    op.drop_index('ix_url_url_digest_shared', table_name='url')
@@ -0,0 +1,78 @@
+"""06_url-digest
+
+Revision ID: b9f1c6e3a7d2
+Revises: e2b7d4a9c1f3
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from src.services.canonical import canonicalize_url, url_digest
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9f1c6e3a7d2'
+down_revision = 'e2b7d4a9c1f3'
+branch_labels = None
+depends_on = None
+
+
+BATCH_SIZE = 10_000
+
+
+def canonicalize_rows() -> None:
+    """
+    Sets the digests to those of the canonical urls, which new urls are
+    looked up by; the stored urls, the redirect targets, are kept. When
+    several rows share a canonical url, the one stored canonically, else
+    the oldest, takes its digest; the others keep the digest of their
+    url, so they are no longer found when deduplicating. Urls that can
+    not be parsed keep theirs too.
+    """
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(sa.text(
+            "SELECT id, original_url FROM url WHERE id > :last_id "
+            "ORDER BY id LIMIT :limit"),
+            {"last_id": last_id, "limit": BATCH_SIZE}).all()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        updates, seen = [], set()
+        for id, url in rows:
+            try:
+                canonical = canonicalize_url(url)
+            except ValueError:
+                continue
+            if canonical != url and canonical not in seen:
+                seen.add(canonical)
+                updates.append({"id": id, "digest": url_digest(canonical)})
+        if updates:
+            # every row already has the digest of its stored url, so a
+            # canonical url that is taken is found through the unique index
+            bind.execute(sa.text(
+                "UPDATE url SET url_digest = :digest "
+                "WHERE id = :id AND NOT EXISTS ("
+                "SELECT 1 FROM url WHERE url_digest = :digest)"), updates)
+
+
+def upgrade() -> None:
+    op.add_column('url', sa.Column('url_digest', sa.LargeBinary(length=16),
+                                   nullable=True))
+    op.execute("UPDATE url SET url_digest = decode(md5(original_url), 'hex')")
+    op.alter_column('url', 'url_digest', nullable=False)
+    op.create_unique_constraint('url_url_digest_key', 'url', ['url_digest'])
+    canonicalize_rows()
+    op.drop_constraint('url_original_url_key', 'url', type_='unique')
+    op.drop_index('ix_url_original_url_hash', table_name='url')
+
+
+def downgrade() -> None:
+    op.create_index('ix_url_original_url_hash', 'url', ['original_url'],
+                    unique=False, postgresql_using='hash')
+    op.create_unique_constraint('url_original_url_key', 'url',
+                                ['original_url'])
+    op.drop_constraint('url_url_digest_key', 'url', type_='unique')
+    op.drop_column('url', 'url_digest')
@@ -0,0 +1,32 @@
+"""07_url-expiry
+
+Revision ID: c4a8e6f2b1d5
+Revises: b9f1c6e3a7d2
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a8e6f2b1d5'
+down_revision = 'b9f1c6e3a7d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('url', sa.Column('expires_at', sa.DateTime(),
+                                   nullable=True))
+    op.add_column('url', sa.Column('max_clicks', sa.BigInteger(),
+                                   nullable=True))
+    op.create_index('ix_url_expires_at', 'url', ['expires_at'], unique=False,
+                    postgresql_where=sa.text(
+                        'expires_at IS NOT NULL AND deleted IS NOT TRUE'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_url_expires_at', table_name='url')
+    op.drop_column('url', 'max_clicks')
+    op.drop_column('url', 'expires_at')
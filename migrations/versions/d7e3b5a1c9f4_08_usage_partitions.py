@@ -0,0 +1,103 @@
+"""08_usage-partitions
+
+Revision ID: d7e3b5a1c9f4
+Revises: c4a8e6f2b1d5
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from datetime import datetime, timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7e3b5a1c9f4'
+down_revision = 'c4a8e6f2b1d5'
+branch_labels = None
+depends_on = None
+
+PREMAKE_MONTHS = 3
+
+
+def next_month(start: datetime) -> datetime:
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def upgrade() -> None:
+    # The existing table is attached as the partition for everything up
+    # to the end of its last month, so no rows are copied. Monthly
+    # partitions follow; later ones are created by PartitionManager.
+    # Ids become bigint: every click takes one, and a partition's columns
+    # have to match the parent's, so the legacy table is rewritten once
+    # here rather than the partitioned table later.
+    op.execute("UPDATE usage SET used_at = 'epoch' WHERE used_at IS NULL")
+    op.execute("ALTER TABLE usage ALTER COLUMN used_at SET NOT NULL")
+    op.execute("ALTER TABLE usage RENAME TO usage_legacy")
+    # a partition's key has to match the parent's; one statement so the
+    # type change and the new key share a single rewrite
+    op.execute("ALTER TABLE usage_legacy DROP CONSTRAINT usage_pkey, "
+               "ALTER COLUMN id TYPE bigint, "
+               "ADD CONSTRAINT usage_legacy_pkey PRIMARY KEY (id, used_at)")
+    op.execute("ALTER SEQUENCE usage_id_seq AS bigint")
+    op.execute("ALTER TABLE usage_legacy "
+               "RENAME CONSTRAINT usage_url_id_fkey TO usage_legacy_url_id_fkey")
+    op.execute("ALTER INDEX ix_usage_url_id_used_at_id "
+               "RENAME TO usage_legacy_url_id_used_at_id_idx")
+
+    op.execute("""
+        CREATE TABLE usage (
+            id bigint NOT NULL DEFAULT nextval('usage_id_seq'),
+            url_id integer REFERENCES url (id),
+            used_at timestamp without time zone NOT NULL,
+            client_port integer,
+            client_host varchar(2048),
+            referrer varchar(2048),
+            CONSTRAINT usage_pkey PRIMARY KEY (id, used_at)
+        ) PARTITION BY RANGE (used_at)
+    """)
+    op.execute("ALTER SEQUENCE usage_id_seq OWNED BY usage.id")
+    op.create_index('ix_usage_url_id_used_at_id', 'usage',
+                    ['url_id', 'used_at', 'id'], unique=False)
+
+    now = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0,
+                                    microsecond=0)
+    last = op.get_bind().execute(
+        sa.text("SELECT max(used_at) FROM usage_legacy")).scalar()
+    start = next_month(last.replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0)) \
+        if last is not None else now
+    op.execute(f"ALTER TABLE usage ATTACH PARTITION usage_legacy "
+               f"FOR VALUES FROM (MINVALUE) TO ('{start}')")
+    end = now
+    for _ in range(PREMAKE_MONTHS + 1):
+        end = next_month(end)
+    while start < end:
+        op.execute(f"CREATE TABLE usage_p{start:%Y%m} PARTITION OF usage "
+                   f"FOR VALUES FROM ('{start}') TO ('{next_month(start)}')")
+        start = next_month(start)
+    op.execute("CREATE TABLE usage_default PARTITION OF usage DEFAULT")
+
+
+def downgrade() -> None:
+    op.execute("""
+        CREATE TABLE usage_plain (
+            id integer NOT NULL DEFAULT nextval('usage_id_seq'),
+            url_id integer,
+            used_at timestamp without time zone,
+            client_port integer,
+            client_host varchar(2048),
+            referrer varchar(2048)
+        )
+    """)
+    op.execute("INSERT INTO usage_plain SELECT id, url_id, used_at, "
+               "client_port, client_host, referrer FROM usage")
+    op.execute("ALTER SEQUENCE usage_id_seq AS integer "
+               "OWNED BY usage_plain.id")
+    op.execute("DROP TABLE usage")
+    op.execute("ALTER TABLE usage_plain RENAME TO usage")
+    op.create_primary_key('usage_pkey', 'usage', ['id'])
+    op.create_foreign_key('usage_url_id_fkey', 'usage', 'url',
+                          ['url_id'], ['id'])
+    op.create_index('ix_usage_url_id_used_at_id', 'usage',
+                    ['url_id', 'used_at', 'id'], unique=False)
@@ -0,0 +1,24 @@
+"""12_url-created-at-index
+
+Revision ID: d9a1f3c5e7b8
+Revises: b4e8d2f6a9c1
+Create Date: 2026-10-20 12:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9a1f3c5e7b8'
+down_revision = 'b4e8d2f6a9c1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_url_created_at', 'url', ['created_at'],
+                    unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_url_created_at', table_name='url')
@@ -0,0 +1,24 @@
+"""05_url-canonical-hash-index
+
+Revision ID: e2b7d4a9c1f3
+Revises: a5c8e2f1d3b6
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b7d4a9c1f3'
+down_revision = 'a5c8e2f1d3b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_url_original_url_hash', 'url', ['original_url'],
+                    unique=False, postgresql_using='hash')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_url_original_url_hash', table_name='url')
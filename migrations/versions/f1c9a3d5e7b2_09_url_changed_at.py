@@ -0,0 +1,29 @@
+"""09_url-changed-at
+
+Revision ID: f1c9a3d5e7b2
+Revises: d7e3b5a1c9f4
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c9a3d5e7b2'
+down_revision = 'd7e3b5a1c9f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('url', sa.Column('changed_at', sa.DateTime(),
+                                   nullable=True))
+    op.create_index('ix_url_changed_at', 'url', ['changed_at'],
+                    unique=False,
+                    postgresql_where=sa.text('changed_at IS NOT NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_url_changed_at', table_name='url')
+    op.drop_column('url', 'changed_at')
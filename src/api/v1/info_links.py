@@ -1,11 +1,13 @@
 import sys
 from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Any
 
-from src.db.db import get_session
+from src.db.db import engine, get_session, pool_status, read_engine
 from src.schemas import shorturl as shorturl_schema
-from src.services.urls import url_crud
+from src.services.urls import click_logger, read_router, request_metrics, \
+    url_crud
 
 info_router = APIRouter()
 
@@ -21,3 +23,31 @@ async def info_handler():
 @info_router.get('/ping', response_model=shorturl_schema.DBHealthModel)
 async def check_db_status(db: AsyncSession = Depends(get_session)) -> Any:
     return await url_crud.get_db_status(db=db)
+
+
+@info_router.get('/cache')
+async def cache_stats() -> Any:
+    return {'redirect': url_crud.cache_stats(),
+            'single_flight': url_crud.flight_stats(),
+            'aliases': url_crud.alias_stats(),
+            'snapshot': url_crud.snapshot_stats()}
+
+
+@info_router.get('/clicks')
+async def click_log_stats() -> Any:
+    return click_logger.stats()
+
+
+@info_router.get('/pool')
+async def pool_stats() -> Any:
+    return {
+        'primary': pool_status(engine.pool),
+        'replica': pool_status(read_engine.pool) if read_engine else None,
+        'routing': read_router.stats(),
+    }
+
+
+@info_router.get('/metrics', response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    return PlainTextResponse(request_metrics.render(),
+                             media_type='text/plain; version=0.0.4')
@@ -0,0 +1,99 @@
+import inspect
+import json
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator
+from urllib.parse import quote
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from src.api.v1.shortlinks import get_url, resolve_redirect
+from src.db.db import get_session
+
+# what RedirectResponse and the HTTPException handler would send
+LOCATION_SAFE = ":/%#?=@[]!$&'()*+,;"
+REDIRECT_HEADERS = [(b"content-length", b"0")]
+ERROR_CONTENT_TYPE = (b"content-type", b"application/json")
+
+
+def redirect_start(location: str) -> dict:
+    return {
+        "type": "http.response.start",
+        "status": 307,
+        "headers": REDIRECT_HEADERS + [
+            (b"location", quote(location, safe=LOCATION_SAFE).encode(
+                "latin-1"))],
+    }
+
+
+def error_body(detail: str) -> bytes:
+    return json.dumps({"detail": detail}, ensure_ascii=False,
+                      separators=(",", ":")).encode()
+
+
+class RedirectFastPath:
+    """
+    Serves `GET {prefix}/{url_id}` without routing, dependency injection
+    or response objects: the id is taken from the path, resolved by the
+    same `resolve_redirect` as `get_url` and answered with prebuilt
+    messages. Every other request goes on to `app`.
+
+    The session comes from `get_session`, or from its override on
+    `dependency_overrides_provider` as it would for `get_url`.
+    """
+
+    def __init__(self, app: ASGIApp, prefix: str,
+                 dependency_overrides_provider: Any = None):
+        self.app = app
+        self.prefix = prefix.rstrip("/") + "/"
+        self.provider = dependency_overrides_provider
+
+    def match(self, scope: Scope) -> str:
+        """The url id of a redirect request, an empty string otherwise."""
+        if scope["type"] != "http" or scope["method"] != "GET":
+            return ""
+        path: str = scope["path"]
+        if not path.startswith(self.prefix):
+            return ""
+        url_id = path[len(self.prefix):]
+        return "" if "/" in url_id else url_id
+
+    async def __call__(self, scope: Scope, receive: Receive,
+                       send: Send) -> None:
+        url_id = self.match(scope)
+        if not url_id:
+            return await self.app(scope, receive, send)
+        scope["endpoint"] = get_url
+        referrer = None
+        for name, value in scope["headers"]:
+            if name == b"referer":
+                referrer = value.decode("latin-1")
+                break
+        async with self.session() as db:
+            code, target = await resolve_redirect(
+                db, url_id, scope.get("client"), referrer)
+        if code == 307:
+            await send(redirect_start(target))
+            await send({"type": "http.response.body", "body": b""})
+            return
+        body = error_body(target)
+        await send({
+            "type": "http.response.start",
+            "status": code,
+            "headers": [(b"content-length", str(len(body)).encode()),
+                        ERROR_CONTENT_TYPE],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[AsyncSession]:
+        overrides = getattr(self.provider, "dependency_overrides", {})
+        dependency = overrides.get(get_session, get_session)
+        if not inspect.isasyncgenfunction(dependency):
+            yield dependency()
+            return
+        sessions = dependency()
+        try:
+            yield await sessions.__anext__()
+        finally:
+            await sessions.aclose()
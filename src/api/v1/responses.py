@@ -0,0 +1,40 @@
+from operator import attrgetter
+from typing import Any, Iterable
+
+import orjson
+from fastapi.responses import Response, StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+
+class RequestStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse for handlers that are still reading the request
+    body while the response is sent. The base class listens on `receive`
+    for a disconnect at the same time, which would steal body chunks.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive,
+                       send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+class RowsResponse(Response):
+    """
+    JSON array of objects built straight from result rows by orjson: one
+    object per row with the named attributes, no ORM instances, response
+    model validation or jsonable_encoder pass.
+    """
+    media_type = "application/json"
+
+    def __init__(self, fields: Iterable[str], rows: Iterable[Any],
+                 **kwargs: Any):
+        fields = tuple(fields)
+        values = attrgetter(*fields)
+        if len(fields) == 1:
+            super().__init__(orjson.dumps(
+                [{fields[0]: values(row)} for row in rows]), **kwargs)
+            return
+        super().__init__(orjson.dumps(
+            [dict(zip(fields, values(row))) for row in rows]), **kwargs)
@@ -1,15 +1,35 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request, \
     Response, Query
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import Optional
+from datetime import datetime, timedelta
+from typing import Any, Optional
 
+from src.api.v1.responses import RequestStreamingResponse, RowsResponse
+from src.core.config import app_settings
 from src.db.db import get_session
 from src.schemas import shorturl as shorturl_schema
-from src.services.urls import url_crud, usage_crud
+from src.schemas.shorturl import naive_utc
+from src.services.cursors import decode_cursor, encode_cursor
+from src.services.base import LIMIT_REACHED
+from src.services.export import MEDIA_TYPES
+from src.services.urls import analytics_crud, bulk_status, click_logger, \
+    url_crud, url_exporter, url_importer, usage_crud, usage_exporter
 
 router = APIRouter()
 
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+LISTING_FIELDS = tuple(shorturl_schema.ShortUrl.__fields__)
+USAGE_FIELDS = tuple(shorturl_schema.UrlUsageFull.__fields__)
+
+
+def parse_cursor(cursor: str, *types: type) -> list:
+    try:
+        return decode_cursor(cursor, *types)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=str(e))
+
 
 @router.get("/", response_model=list[shorturl_schema.ShortUrl])
 async def read_entities(
@@ -26,17 +46,53 @@ async def read_entities(
             ge=0,
             description='Query offset.'
         ),
-) -> list[shorturl_schema.ShortUrl]:
+        cursor: Optional[str] = Query(
+            default=None,
+            description=f'Keyset cursor from the {NEXT_CURSOR_HEADER} '
+                        f'header of the previous page, replaces offset.'
+        ),
+        response: Response,
+) -> list[shorturl_schema.ShortUrl] | Response:
     """
     Retrieve all records.
     """
-    return await url_crud.get_multi(db=db, skip=offset, limit=limit)
+    after_id = None
+    if cursor is not None:
+        after_id, = parse_cursor(cursor, int)
+        # past every id, the column is int4
+        after_id = min(after_id, shorturl_schema.MAX_ID)
+    if app_settings.RAW_LISTINGS_ENABLED:
+        records = await url_crud.get_multi_rows(
+            db=db, fields=LISTING_FIELDS, skip=offset, limit=limit,
+            after_id=after_id)
+        # returned as is, the injected response's headers are not applied
+        response = RowsResponse(LISTING_FIELDS, records)
+    else:
+        records = await url_crud.get_multi(db=db, skip=offset, limit=limit,
+                                           after_id=after_id)
+    if len(records) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(records[-1].id)
+    return response if app_settings.RAW_LISTINGS_ENABLED else records
+
+
+@router.get("/aliases/{alias}",
+            response_model=shorturl_schema.AliasAvailability,
+            description='Check whether a custom alias can be reserved')
+async def check_alias(
+        *,
+        alias: str,
+        db: AsyncSession = Depends(get_session),
+) -> shorturl_schema.AliasAvailability:
+    available = await url_crud.is_code_available(db=db, code=alias)
+    return shorturl_schema.AliasAvailability(alias=alias,
+                                             available=available)
 
 
 @router.get("/{url_id}", response_class=RedirectResponse,
             status_code=
             status.HTTP_307_TEMPORARY_REDIRECT | status.HTTP_410_GONE,
-            description='Redirect to original URL by short url id',
+            description='Redirect to original URL by short url id, '
+                        'short code or alias',
             responses={
                 404:
                     {
@@ -46,35 +102,58 @@ async def read_entities(
                 410:
                     {
                         "model": shorturl_schema.HTTPError,
-                        "description": "Url is marked as deleted",
+                        "description": "Url is marked as deleted, "
+                                       "expired or reached its click limit",
                     }
             }
             )
 async def get_url(
         *,
-        url_id: int,
+        url_id: str,
         request: Request,
         db: AsyncSession = Depends(get_session),
 ) -> RedirectResponse:
     """
-    Redirect to original url by ID.
+    Redirect to original url by ID, numeric paths are ids and anything
+    else is a short code or an alias.
+    """
+    code, target = await resolve_redirect(
+        db, url_id, request.client, request.headers.get('referer'))
+    if code != status.HTTP_307_TEMPORARY_REDIRECT:
+        raise HTTPException(status_code=code, detail=target)
+    return RedirectResponse(target)
+
+
+async def resolve_redirect(db: AsyncSession, url_id: str,
+                           client: Optional[tuple[str, int]],
+                           referrer: Optional[str]) -> tuple[int, str]:
+    """
+    Status code and location of the redirect for `url_id`, or the error
+    status and detail. A click is recorded for every redirect, links with
+    a click limit are counted before answering. Shared by `get_url` and
+    the fast path in `src.api.v1.redirects`.
     """
-    record = await url_crud.get(db=db, id=url_id)
+    if url_id.isascii() and url_id.isdigit():
+        record = await url_crud.get_target(db=db, id=int(url_id))
+    else:
+        record = await url_crud.get_target_by_code(db=db, code=url_id)
     if not record:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"URL with {url_id = } doesn't exist"
-        )
-    if record.deleted:
-        raise HTTPException(status_code=status.HTTP_410_GONE,
-                            detail=f"URL with {url_id = } marked as deleted")
+        return (status.HTTP_404_NOT_FOUND,
+                f"URL with {url_id = } doesn't exist")
+    gone = record.gone_reason(datetime.utcnow())
+    if not gone and record.max_clicks is not None and \
+            not await url_crud.claim_click(db=db, id=record.id):
+        gone = LIMIT_REACHED
+    if gone:
+        return status.HTTP_410_GONE, f"URL with {url_id = } {gone}"
     obj_in: shorturl_schema.UrlUsageCreate = shorturl_schema.UrlUsageCreate(
-        client_host=request.client.host,
-        client_port=request.client.port,
-        url_id=url_id
+        client_host=client[0],
+        client_port=client[1],
+        url_id=record.id,
+        referrer=(referrer or '')[:2048] or None,
     )
-    await usage_crud.create(db=db, obj_in=obj_in)
-    return RedirectResponse(record.original_url)
+    await click_logger.record(db=db, obj_in=obj_in)
+    return status.HTTP_307_TEMPORARY_REDIRECT, record.original_url
 
 
 @router.get("/{short_url_id}/status", description='Get URL usage status',
@@ -102,31 +181,100 @@ async def get_url_usage_status(
             ge=0,
             description='Query offset.'
         ),
+        cursor: Optional[str] = Query(
+            default=None,
+            description=f'Keyset cursor from the {NEXT_CURSOR_HEADER} '
+                        f'header of the previous page, replaces offset.'
+        ),
+        response: Response,
         db: AsyncSession = Depends(get_session),
-) -> int | list[shorturl_schema.UrlUsageFull]:
+) -> int | list[shorturl_schema.UrlUsageFull] | Response:
     """
     Get URL usage status.
     """
+    after = None
+    if cursor is not None:
+        used_at, usage_id = parse_cursor(cursor, str, int)
+        try:
+            after = (naive_utc(datetime.fromisoformat(used_at)), usage_id)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="Invalid cursor")
     count = await usage_crud.count(db=db, obj_id=short_url_id,
                                    max_result=max_result,
                                    offset=offset,
-                                   full_info=full_info)
+                                   full_info=full_info,
+                                   after=after)
     if not count:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Item not found"
         )
-    return count
+    raw = full_info and app_settings.RAW_LISTINGS_ENABLED
+    if raw:
+        response = RowsResponse(USAGE_FIELDS, count)
+    if full_info and len(count) == max_result:
+        last = count[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+            last.used_at.isoformat(), last.id)
+    return response if raw else count
+
+
+@router.get("/{short_url_id}/stats", description='Get URL usage time series',
+            response_model=shorturl_schema.UsageStats)
+async def get_url_usage_stats(
+        *,
+        short_url_id: int,
+        granularity: str = Query(
+            default='hour',
+            regex='^(minute|hour|day)$',
+            description='Bucket size.'
+        ),
+        start: Optional[datetime] = Query(
+            default=None,
+            alias='from',
+            description='Window start (UTC), 7 days ago by default.'
+        ),
+        end: Optional[datetime] = Query(
+            default=None,
+            alias='to',
+            description='Window end (UTC), now by default.'
+        ),
+        top: int = Query(
+            default=10,
+            ge=1,
+            le=100,
+            description='Number of top referrers.'
+        ),
+        db: AsyncSession = Depends(get_session),
+) -> shorturl_schema.UsageStats:
+    """
+    Get URL usage stats from the rollup tables. Clicks show up here once
+    the background aggregator has rolled them up.
+    """
+    end = naive_utc(end) or datetime.utcnow()
+    start = naive_utc(start) or end - timedelta(days=7)
+    if start >= end:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="'from' must be before 'to'")
+    return await analytics_crud.stats(db=db, url_id=short_url_id,
+                                      granularity=granularity,
+                                      start=start, end=end, top=top)
 
 
 @router.post(
     "/",
     response_model=shorturl_schema.ShortUrl | shorturl_schema.HTTPError,
     status_code=status.HTTP_201_CREATED,
-    description='Create a short URL',
+    description='Create a short URL, returns the existing one with 200 '
+                'when the canonical url is already shortened',
     responses={
+        200: {
+            "model": shorturl_schema.ShortUrl,
+            "description": "Url already exists in the system",
+        },
         400: {
             "model": shorturl_schema.HTTPError,
-            "description": "Url already exists in the system",
+            "description": "Url is invalid or could not be shortened",
         }
     }
 )
@@ -134,40 +282,164 @@ async def create_short_url(
     *,
     db: AsyncSession = Depends(get_session),
     url_in: shorturl_schema.ShortUrlCreate,
+    response: Response,
 ) -> shorturl_schema.ShortUrl:
     """
     Create new short url.
     """
-    url = await url_crud.create(db=db, obj_in=url_in)
+    url, created = await url_crud.get_or_create(db=db, obj_in=url_in)
     if hasattr(url, "detail"):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail=url.detail)
+    if not created:
+        response.status_code = status.HTTP_200_OK
     return url
 
 
 @router.post(
-    "/multi", response_model=list[shorturl_schema.ShortUrl],
+    "/multi", response_model=list[shorturl_schema.ShortUrlBulkResult],
+    response_model_exclude_none=True,
     status_code=status.HTTP_201_CREATED,
-    description='Create several short URLs',
-    responses={
-        400: {
-            "model": shorturl_schema.HTTPError,
-            "description": "Url already exists in the system",
-        }
-    }
+    description='Create several short URLs, '
+                'returns created / exists / invalid per item',
 )
 async def create_short_urls(
     *,
     db: AsyncSession = Depends(get_session),
     urls_in: list[shorturl_schema.ShortUrlCreate],
-) -> list[shorturl_schema.ShortUrl]:
+) -> list[shorturl_schema.ShortUrlBulkResult]:
     """
     Create new short urls.
     """
-    if url := await url_crud.create_multi(db=db, objs_in=urls_in):
-        return url
-    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                        detail="Url already exists in the system")
+    return await url_crud.create_multi(
+        db=db, objs_in=urls_in,
+        chunk_size=app_settings.BULK_CREATE_CHUNK_SIZE)
+
+
+@router.post(
+    "/import", response_class=RequestStreamingResponse,
+    description='Stream an NDJSON or CSV list of URLs, '
+                'returns an NDJSON result line per input line',
+)
+async def import_urls(
+    *,
+    request: Request,
+    db: AsyncSession = Depends(get_session),
+    fmt: Optional[str] = Query(
+        default=None,
+        alias='format',
+        regex='^(ndjson|csv)$',
+        description='Body format, taken from Content-Type by default.'
+    ),
+) -> RequestStreamingResponse:
+    """
+    Import short urls from a streamed body.
+    """
+    if fmt is None:
+        content_type = request.headers.get('content-type', '')
+        fmt = 'csv' if 'csv' in content_type else 'ndjson'
+    return RequestStreamingResponse(
+        url_importer.run(db=db, stream=request.stream(), fmt=fmt),
+        media_type='application/x-ndjson',
+    )
+
+
+@router.post(
+    "/bulk-status", response_model=shorturl_schema.BulkStatusResult,
+    description='Mark urls as Gone (or restore them) by id, '
+                'reports ids that were not found',
+)
+async def bulk_set_deleted(
+    *,
+    db: AsyncSession = Depends(get_session),
+    update_in: shorturl_schema.BulkStatusUpdate,
+) -> shorturl_schema.BulkStatusResult:
+    """
+    Soft-delete or restore a list of urls.
+    """
+    return await bulk_status.run(db=db, ids=update_in.ids,
+                                 deleted=update_in.deleted)
+
+
+@router.post(
+    "/bulk-status/file", response_model=shorturl_schema.BulkStatusResult,
+    description='Mark urls as Gone (or restore them) from a streamed '
+                'text body with one id per line',
+)
+async def bulk_set_deleted_file(
+    *,
+    request: Request,
+    db: AsyncSession = Depends(get_session),
+    deleted: bool = Query(default=True,
+                          description='False restores the urls.'),
+) -> shorturl_schema.BulkStatusResult:
+    """
+    Soft-delete or restore the urls of a streamed id file.
+    """
+    return await bulk_status.run_stream(db=db, stream=request.stream(),
+                                        deleted=deleted)
+
+
+EXPORT_FORMAT = Query(default='ndjson', alias='format',
+                      regex='^(ndjson|csv)$')
+
+
+def export_response(stream: Any, fmt: str, name: str) -> StreamingResponse:
+    return StreamingResponse(
+        stream, media_type=MEDIA_TYPES[fmt],
+        headers={'Content-Disposition':
+                 f'attachment; filename="{name}.{fmt}"'})
+
+
+@router.get("/export/urls", response_class=StreamingResponse,
+            description='Stream every url matching the filters as NDJSON '
+                        'or CSV, in id order')
+async def export_urls(
+        *,
+        db: AsyncSession = Depends(get_session),
+        fmt: str = EXPORT_FORMAT,
+        created_from: Optional[datetime] = Query(
+            default=None, alias='created-from', description='UTC.'),
+        created_to: Optional[datetime] = Query(
+            default=None, alias='created-to',
+            description='UTC, exclusive.'),
+        deleted: Optional[bool] = Query(default=None),
+        ids: Optional[list[shorturl_schema.UrlId]] = Query(default=None,
+                                                           alias='id'),
+) -> StreamingResponse:
+    """
+    Export urls from a server-side cursor. Filters are checked before the
+    response starts, errors can not be reported once it has.
+    """
+    return export_response(
+        url_exporter.run(db, fmt, created_from=naive_utc(created_from),
+                         created_to=naive_utc(created_to), deleted=deleted,
+                         ids=ids),
+        fmt, 'urls')
+
+
+@router.get("/export/clicks", response_class=StreamingResponse,
+            description='Stream every click (usage row) matching the '
+                        'filters as NDJSON or CSV, in id order')
+async def export_clicks(
+        *,
+        db: AsyncSession = Depends(get_session),
+        fmt: str = EXPORT_FORMAT,
+        used_from: Optional[datetime] = Query(
+            default=None, alias='used-from', description='UTC.'),
+        used_to: Optional[datetime] = Query(
+            default=None, alias='used-to', description='UTC, exclusive.'),
+        url_ids: Optional[list[shorturl_schema.UrlId]] = Query(
+            default=None, alias='url-id'),
+) -> StreamingResponse:
+    """
+    Export click history from a server-side cursor, filters are checked
+    as for the url export.
+    """
+    return export_response(
+        usage_exporter.run(db, fmt, used_from=naive_utc(used_from),
+                           used_to=naive_utc(used_to), url_ids=url_ids),
+        fmt, 'clicks')
 
 
 @router.delete("/", description='Mark url as Gone')
@@ -0,0 +1,210 @@
+"""
+Load generator for the HTTP API: redirect, create, multi-create and
+status scenarios with a fixed concurrency and a uniform or Zipf key
+distribution. Results are JSON documents that can be compared.
+"""
+import asyncio
+import itertools
+import random
+import string
+import sys
+import time
+import uuid
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+import httpx
+
+API_PREFIX = "/api/v1/tinyurl"
+SCENARIOS = ("redirect", "create", "multi", "status")
+DISTRIBUTIONS = ("uniform", "zipf")
+
+
+class KeySampler:
+    """Draws keys uniformly or with Zipf weights 1 / rank ** s."""
+
+    def __init__(self, keys: list[int], distribution: str = "uniform", *,
+                 zipf_s: float = 1.1, seed: int = 0):
+        self._keys = keys
+        self._random = random.Random(seed)
+        self._cum_weights = None
+        if distribution == "zipf":
+            self._cum_weights = list(itertools.accumulate(
+                1 / rank ** zipf_s for rank in range(1, len(keys) + 1)))
+
+    def __call__(self) -> int:
+        if self._cum_weights is None:
+            return self._random.choice(self._keys)
+        return self._random.choices(self._keys,
+                                    cum_weights=self._cum_weights)[0]
+
+
+def percentile(ordered: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    rank = max(1, round(fraction * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(latencies: list[float], statuses: Counter,
+              seconds: float) -> dict[str, Any]:
+    ordered = sorted(latencies)
+    errors = sum(count for code, count in statuses.items()
+                 if not isinstance(code, int) or code >= 500)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "rps": round(len(ordered) / seconds, 1) if seconds else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        "status": {str(code): count for code, count in statuses.items()},
+    }
+
+
+async def drive(request: Callable[[], Awaitable[httpx.Response]], *,
+                requests: int, concurrency: int) -> dict[str, Any]:
+    """Runs `requests` calls from `concurrency` workers."""
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+    remaining = itertools.count()
+
+    async def worker() -> None:
+        while next(remaining) < requests:
+            started = time.perf_counter()
+            try:
+                response = await request()
+                statuses[response.status_code] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+
+def random_url(run_id: str) -> str:
+    path = "".join(random.choices(string.ascii_lowercase, k=12))
+    return f"http://bench-{run_id}.example.com/{path}/{uuid.uuid4().hex}"
+
+
+async def seed_keys(client: httpx.AsyncClient, count: int,
+                    run_id: str, batch_size: int = 1000) -> list[int]:
+    """Creates `count` urls to redirect to and returns their ids."""
+    ids: list[int] = []
+    while len(ids) < count:
+        batch = [{"original_url": random_url(run_id)}
+                 for _ in range(min(batch_size, count - len(ids)))]
+        response = await client.post(f"{API_PREFIX}/multi", json=batch)
+        response.raise_for_status()
+        ids.extend(item["id"] for item in response.json() if "id" in item)
+    return ids
+
+
+def build_request(scenario: str, client: httpx.AsyncClient,
+                  sample: KeySampler, run_id: str,
+                  batch_size: int) -> Callable[[], Awaitable[httpx.Response]]:
+    if scenario == "redirect":
+        return lambda: client.get(f"{API_PREFIX}/{sample()}")
+    if scenario == "status":
+        return lambda: client.get(f"{API_PREFIX}/{sample()}/status")
+    if scenario == "create":
+        return lambda: client.post(
+            f"{API_PREFIX}/", json={"original_url": random_url(run_id)})
+    return lambda: client.post(
+        f"{API_PREFIX}/multi",
+        json=[{"original_url": random_url(run_id)}
+              for _ in range(batch_size)])
+
+
+@asynccontextmanager
+async def spawn_server(port: int,
+                       timeout: float = 30) -> AsyncIterator[str]:
+    """Runs the app under uvicorn on `port` until the block exits."""
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "uvicorn", "src.main:app",
+        "--port", str(port), "--log-level", "warning", "--no-access-log")
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    response = await client.get("/info/ping")
+                    if response.status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.monotonic() > deadline or \
+                        process.returncode is not None:
+                    raise RuntimeError("The app did not start")
+                await asyncio.sleep(0.2)
+        yield base_url
+    finally:
+        if process.returncode is None:
+            process.terminate()
+            await process.wait()
+
+
+async def run_benchmark(base_url: str, *,
+                        scenarios: tuple[str, ...] = SCENARIOS,
+                        requests: int = 2000, concurrency: int = 20,
+                        keys: int = 1000, distribution: str = "uniform",
+                        zipf_s: float = 1.1, batch_size: int = 100,
+                        warmup: int = 100, seed: int = 0) -> dict[str, Any]:
+    run_id = uuid.uuid4().hex[:8]
+    limits = httpx.Limits(max_connections=concurrency,
+                          max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits,
+                                 timeout=30) as client:
+        ids = await seed_keys(client, keys, run_id)
+        sample = KeySampler(ids, distribution, zipf_s=zipf_s, seed=seed)
+        results = {}
+        for scenario in scenarios:
+            request = build_request(scenario, client, sample, run_id,
+                                    batch_size)
+            if warmup:
+                await drive(request, requests=warmup,
+                            concurrency=concurrency)
+            results[scenario] = await drive(request, requests=requests,
+                                            concurrency=concurrency)
+    return {
+        "meta": {
+            "base_url": base_url,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "requests": requests,
+            "concurrency": concurrency,
+            "keys": keys,
+            "distribution": distribution,
+            "zipf_s": zipf_s if distribution == "zipf" else None,
+            "batch_size": batch_size,
+        },
+        "scenarios": results,
+    }
+
+
+def compare_runs(baseline: dict, candidate: dict,
+                 metrics: tuple[str, ...] = ("rps", "p50_ms", "p95_ms",
+                                             "p99_ms")) -> dict[str, Any]:
+    """Per scenario and metric: both values and the relative change."""
+    comparison = {}
+    for scenario, before in baseline["scenarios"].items():
+        after: Optional[dict] = candidate["scenarios"].get(scenario)
+        if after is None:
+            continue
+        comparison[scenario] = {
+            metric: {
+                "baseline": before[metric],
+                "candidate": after[metric],
+                "change_pct": round(
+                    (after[metric] - before[metric]) / before[metric] * 100,
+                    1) if before[metric] else None,
+            }
+            for metric in metrics
+        }
+    return comparison
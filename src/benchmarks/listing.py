@@ -0,0 +1,85 @@
+"""
+CPU cost of a listing page and a full-info status page served from ORM
+instances and response models, and from column tuples serialized by
+orjson (RAW_LISTINGS_ENABLED). Both go through the url router in
+process, against the configured database.
+"""
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Iterator
+from urllib.parse import urlencode
+
+import httpx
+from starlette.types import ASGIApp
+
+from src.benchmarks.http import API_PREFIX, seed_keys
+from src.benchmarks.redirect import build_apps, call, get_scope
+from src.core.config import app_settings
+from src.db.db import async_session
+from src.services.urls import usage_crud
+
+
+@contextmanager
+def raw_listings(enabled: bool) -> Iterator[None]:
+    previous = app_settings.RAW_LISTINGS_ENABLED
+    app_settings.RAW_LISTINGS_ENABLED = enabled
+    try:
+        yield
+    finally:
+        app_settings.RAW_LISTINGS_ENABLED = previous
+
+
+async def seed_clicks(url_id: int, count: int) -> None:
+    now = datetime.utcnow()
+    async with async_session() as db:
+        await usage_crud.create_many(db=db, objs_in=[
+            {"url_id": url_id, "used_at": now, "client_host": "127.0.0.1",
+             "client_port": port, "referrer": None}
+            for port in range(count)])
+
+
+async def measure(app: ASGIApp, scope: dict, requests: int) -> dict:
+    cpu, wall = time.process_time(), time.perf_counter()
+    for _ in range(requests):
+        status = await call(app, dict(scope))
+        if status != 200:
+            raise RuntimeError(f"{scope['path']} answered {status}")
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    return {
+        "requests": requests,
+        "cpu_ms": round(cpu / requests * 1000, 3),
+        "wall_ms": round(wall / requests * 1000, 3),
+    }
+
+
+async def bench_listing(*, page_size: int = 1000, requests: int = 50,
+                        rounds: int = 3) -> dict[str, Any]:
+    app, _ = build_apps()
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        ids = await seed_keys(client, page_size, uuid.uuid4().hex[:8])
+    await seed_clicks(ids[0], page_size)
+    scopes = {
+        "listing": get_scope(f"{API_PREFIX}/", urlencode(
+            {"max-size": page_size}).encode()),
+        "status": get_scope(f"{API_PREFIX}/{ids[0]}/status", urlencode(
+            {"max-size": page_size, "full-info": "true"}).encode()),
+    }
+    results = {}
+    for name, scope in scopes.items():
+        runs: dict[str, list] = {"orm": [], "raw": []}
+        for _ in range(rounds):
+            for variant, enabled in (("orm", False), ("raw", True)):
+                with raw_listings(enabled):
+                    runs[variant].append(await measure(app, scope, requests))
+        best = {variant: min(measured, key=lambda run: run["cpu_ms"])
+                for variant, measured in runs.items()}
+        before, after = best["orm"]["cpu_ms"], best["raw"]["cpu_ms"]
+        results[name] = {
+            "page_size": page_size,
+            **best,
+            "cpu_saving_pct": round((before - after) / before * 100, 1)
+            if before else None,
+        }
+    return results
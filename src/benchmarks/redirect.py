@@ -0,0 +1,102 @@
+"""
+CPU cost of one redirect through FastAPI routing (`get_url`) and through
+the fast path, measured in process by calling the ASGI apps directly.
+Lookups are served from the redirect cache after the warmup, so the
+difference is the per-request framework overhead.
+"""
+import time
+import uuid
+from typing import Any, Callable, Optional
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from starlette.types import ASGIApp, Message
+
+from src.api.v1 import shortlinks
+from src.api.v1.redirects import RedirectFastPath
+from src.benchmarks.http import API_PREFIX, KeySampler, seed_keys
+from src.services.urls import click_logger
+
+
+def build_apps(overrides: Optional[dict[Callable, Callable]] = None
+               ) -> tuple[FastAPI, RedirectFastPath]:
+    """The url router alone, and the same router behind the fast path."""
+    baseline = FastAPI(default_response_class=ORJSONResponse)
+    baseline.include_router(shortlinks.router, prefix=API_PREFIX)
+    baseline.dependency_overrides.update(overrides or {})
+    return baseline, RedirectFastPath(baseline, API_PREFIX,
+                                      dependency_overrides_provider=baseline)
+
+
+def get_scope(path: str, query_string: bytes = b"") -> dict:
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path,
+        "raw_path": path.encode(), "root_path": "",
+        "query_string": query_string,
+        "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 50000),
+        "server": ("bench", 80),
+    }
+
+
+async def call(app: ASGIApp, scope: dict) -> int:
+    status = 0
+
+    async def receive() -> Message:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: Message) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+async def measure(app: ASGIApp, sample: KeySampler,
+                  requests: int) -> dict[str, Any]:
+    scopes = [get_scope(f"{API_PREFIX}/{sample()}")
+              for _ in range(requests)]
+    errors = 0
+    cpu, wall = time.process_time(), time.perf_counter()
+    for scope in scopes:
+        if await call(app, scope) != 307:
+            errors += 1
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    return {
+        "requests": requests,
+        "errors": errors,
+        "cpu_us": round(cpu / requests * 1e6, 1),
+        "wall_us": round(wall / requests * 1e6, 1),
+    }
+
+
+async def bench_redirect(*, requests: int = 20_000, keys: int = 1000,
+                         rounds: int = 3) -> dict[str, Any]:
+    baseline, fast = build_apps()
+    async with httpx.AsyncClient(app=baseline,
+                                 base_url="http://bench") as client:
+        ids = await seed_keys(client, keys, uuid.uuid4().hex[:8])
+    sample = KeySampler(ids)
+    await click_logger.start()
+    try:
+        for app in (baseline, fast):
+            await measure(app, sample, len(ids))
+        results: dict[str, list] = {"fastapi": [], "fast_path": []}
+        for _ in range(rounds):
+            results["fastapi"].append(
+                await measure(baseline, sample, requests))
+            results["fast_path"].append(await measure(fast, sample, requests))
+    finally:
+        await click_logger.stop()
+    best = {name: min(runs, key=lambda run: run["cpu_us"])
+            for name, runs in results.items()}
+    before, after = best["fastapi"]["cpu_us"], best["fast_path"]["cpu_us"]
+    return {
+        **best,
+        "cpu_saving_us": round(before - after, 1),
+        "cpu_saving_pct": round((before - after) / before * 100, 1)
+        if before else None,
+    }
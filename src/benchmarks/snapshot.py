@@ -0,0 +1,70 @@
+"""
+Redirect snapshot cost: compile time and size for `rows` synthetic urls,
+the time to map the file (a worker's startup cost) and the CPU per id and
+per code lookup. No database is involved.
+"""
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator
+
+from src.services.snapshot import RedirectSnapshot, SnapshotFile, \
+    write_snapshot
+
+CHUNK = 10_000
+
+
+def code_for(id: int) -> str:
+    return f"c{id:09x}"
+
+
+async def synthetic_rows(rows: int) -> AsyncIterator[list]:
+    expires_at = datetime.utcnow() + timedelta(days=30)
+    for start in range(1, rows + 1, CHUNK):
+        yield [(id, f"https://example.com/articles/{id}?ref=snapshot",
+                id % 50 == 0, expires_at if id % 7 == 0 else None, None)
+               for id in range(start, min(start + CHUNK, rows + 1))]
+
+
+async def synthetic_codes(rows: int) -> AsyncIterator[list]:
+    # fixed-width hex sorts bytewise in id order
+    for start in range(1, rows + 1, CHUNK):
+        yield [(code_for(id), id)
+               for id in range(start, min(start + CHUNK, rows + 1))]
+
+
+async def bench_snapshot(*, rows: int = 1_000_000, lookups: int = 200_000
+                         ) -> dict[str, Any]:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "urls.snapshot")
+        wall = time.perf_counter()
+        await write_snapshot(path, synthetic_rows(rows),
+                             synthetic_codes(rows))
+        compile_s = time.perf_counter() - wall
+
+        wall = time.perf_counter()
+        SnapshotFile(path).close()
+        open_ms = (time.perf_counter() - wall) * 1000
+
+        snapshot = RedirectSnapshot(path, reload_interval=3600)
+        ids = [random.randint(1, rows) for _ in range(lookups)]
+        codes = [code_for(id) for id in ids]
+        cpu = time.process_time()
+        for id in ids:
+            snapshot.get(id)
+        target_us = (time.process_time() - cpu) / lookups * 1e6
+        cpu = time.process_time()
+        for code in codes:
+            snapshot.code_id(code)
+        code_us = (time.process_time() - cpu) / lookups * 1e6
+        return {
+            "rows": rows,
+            "file_mb": round(os.path.getsize(path) / 1024 / 1024, 1),
+            "compile_s": round(compile_s, 2),
+            "open_ms": round(open_ms, 3),
+            "lookups": lookups,
+            "target_us": round(target_us, 2),
+            "code_us": round(code_us, 2),
+        }
@@ -0,0 +1,93 @@
+"""
+Insert throughput and index size of the url dedup index: a unique B-tree
+over the full original_url against one over its 16-byte digest.
+"""
+import random
+import string
+import time
+from typing import Any
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.services.canonical import url_digest
+
+VARIANTS = {
+    "original_url": (
+        "CREATE TEMP TABLE bench_url_original_url ("
+        "id serial PRIMARY KEY, "
+        "original_url varchar(2048) NOT NULL UNIQUE)",
+        "INSERT INTO bench_url_original_url (original_url) "
+        "SELECT unnest(CAST(:urls AS varchar[]))",
+    ),
+    "url_digest": (
+        "CREATE TEMP TABLE bench_url_url_digest ("
+        "id serial PRIMARY KEY, "
+        "original_url varchar(2048) NOT NULL, "
+        "url_digest bytea NOT NULL UNIQUE)",
+        "INSERT INTO bench_url_url_digest (original_url, url_digest) "
+        "SELECT unnest(CAST(:urls AS varchar[])), "
+        "unnest(CAST(:digests AS bytea[]))",
+    ),
+}
+
+
+def random_urls(count: int, seed: int = 0) -> list[str]:
+    """Unique urls with realistic lengths, mostly 40-200 characters."""
+    generator = random.Random(seed)
+    alphabet = string.ascii_lowercase + string.digits
+    urls = []
+    for number in range(count):
+        host = "".join(generator.choices(string.ascii_lowercase,
+                                         k=generator.randint(5, 15)))
+        path = "/".join(
+            "".join(generator.choices(alphabet, k=generator.randint(3, 20)))
+            for _ in range(generator.randint(1, 6)))
+        urls.append(f"https://www.{host}.com/{path}/?utm_id={number}")
+    return urls
+
+
+async def run_variant(engine: AsyncEngine, name: str, urls: list[str],
+                      batch_size: int) -> dict[str, Any]:
+    create, insert = VARIANTS[name]
+    table = f"bench_url_{name}"
+    async with engine.connect() as connection:
+        await connection.execute(text(create))
+        started = time.perf_counter()
+        for start in range(0, len(urls), batch_size):
+            batch = urls[start:start + batch_size]
+            params = {"urls": batch}
+            if name == "url_digest":
+                params["digests"] = [url_digest(url) for url in batch]
+            await connection.execute(text(insert), params)
+        elapsed = time.perf_counter() - started
+        results = await connection.execute(text(
+            "SELECT pg_relation_size(indexrelid) FROM pg_index "
+            "WHERE indrelid = CAST(:table AS regclass) AND NOT indisprimary"),
+            {"table": table})
+        index_bytes = results.scalar_one()
+        results = await connection.execute(text(
+            "SELECT pg_total_relation_size(CAST(:table AS regclass))"),
+            {"table": table})
+        total_bytes = results.scalar_one()
+        await connection.rollback()
+    return {
+        "rows": len(urls),
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(len(urls) / elapsed),
+        "dedup_index_bytes": index_bytes,
+        "total_bytes": total_bytes,
+    }
+
+
+async def bench_url_index(engine: AsyncEngine, *, rows: int = 100_000,
+                          batch_size: int = 5000,
+                          seed: int = 0) -> dict[str, Any]:
+    """
+    Inserts the same urls into a temporary table per variant and reports
+    throughput and sizes. Nothing is left behind, tables are temporary and
+    the transaction is rolled back.
+    """
+    urls = random_urls(rows, seed)
+    return {name: await run_variant(engine, name, urls, batch_size)
+            for name in VARIANTS}
@@ -0,0 +1,258 @@
+"""
+Maintenance commands, run as `python -m src.cli <command>`.
+"""
+import argparse
+import asyncio
+import logging.config
+import sys
+from datetime import datetime
+
+import orjson
+
+from src.benchmarks.http import DISTRIBUTIONS, SCENARIOS, compare_runs, \
+    run_benchmark, spawn_server
+from src.benchmarks.listing import bench_listing
+from src.benchmarks.redirect import bench_redirect
+from src.benchmarks.snapshot import bench_snapshot
+from src.benchmarks.url_index import bench_url_index
+from src.core.config import app_settings
+from src.core.logger import LOGGING
+from src.db.db import async_session, dispose_engines, engine
+from src.services.export import FORMATS
+from src.services.snapshot import write_snapshot
+from src.services.urls import analytics_crud, link_reaper, url_crud, \
+    url_exporter, usage_aggregator, usage_crud, usage_exporter, \
+    usage_partitions
+
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger(__name__)
+
+
+async def reconcile_clicks(args: argparse.Namespace) -> None:
+    async with async_session() as db:
+        low, high = await usage_crud.id_range(db)
+        watermark = await analytics_crud.watermark(db)
+        fixed = 0
+        for start in range(low, high + 1, args.batch_size):
+            fixed += await usage_crud.reconcile_counts(
+                db, start_id=start, end_id=start + args.batch_size,
+                after_usage_id=watermark,
+                rolled_up=analytics_crud.rolled_up_clicks)
+    logger.info(f"Reconciled click counts for ids {low}..{high}, "
+                f"{fixed} rows corrected")
+
+
+async def rollup_usage(args: argparse.Namespace) -> None:
+    rolled, pruned = await usage_aggregator.run_once()
+    logger.info(f"Rolled up {rolled} usage rows, pruned {pruned} rows")
+
+
+async def manage_partitions(args: argparse.Namespace) -> None:
+    created, dropped = await usage_partitions.run_once()
+    logger.info(f"Created partitions {created}, dropped {dropped}")
+
+
+async def reap_expired(args: argparse.Namespace) -> None:
+    reaped = await link_reaper.run_once()
+    logger.info(f"Soft-deleted {reaped} expired links")
+
+
+async def export(args: argparse.Namespace) -> None:
+    if args.table == "urls":
+        exporter = url_exporter
+        filters = dict(created_from=args.since, created_to=args.until,
+                       deleted=args.deleted, ids=args.id)
+    else:
+        exporter = usage_exporter
+        filters = dict(used_from=args.since, used_to=args.until,
+                       url_ids=args.id)
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        async with async_session() as db:
+            async for block in exporter.run(db, args.format, **filters):
+                output.write(block)
+    finally:
+        if args.output:
+            output.close()
+
+
+async def compile_snapshot(args: argparse.Namespace) -> None:
+    output = args.output or app_settings.REDIRECT_SNAPSHOT_PATH
+    if not output:
+        sys.exit("--output or REDIRECT_SNAPSHOT_PATH is required")
+    async with async_session() as db:
+        rows, codes = url_crud.snapshot_sources(
+            db, chunk_size=args.chunk_size)
+        count = await write_snapshot(output, rows, codes)
+    logger.info(f"Compiled {count} urls into {output}")
+
+
+async def bench_index(args: argparse.Namespace) -> None:
+    results = await bench_url_index(engine, rows=args.rows,
+                                    batch_size=args.batch_size)
+    print(orjson.dumps(results, option=orjson.OPT_INDENT_2).decode())
+
+
+async def bench_http(args: argparse.Namespace) -> None:
+    options = dict(
+        scenarios=tuple(args.scenario or SCENARIOS),
+        requests=args.requests, concurrency=args.concurrency,
+        keys=args.keys, distribution=args.distribution, zipf_s=args.zipf_s,
+        batch_size=args.batch_size, warmup=args.warmup)
+    if args.base_url:
+        results = await run_benchmark(args.base_url, **options)
+    else:
+        async with spawn_server(args.port) as base_url:
+            results = await run_benchmark(base_url, **options)
+    output = orjson.dumps(results, option=orjson.OPT_INDENT_2)
+    if args.output:
+        with open(args.output, "wb") as file:
+            file.write(output)
+    print(output.decode())
+
+
+async def bench_redirects(args: argparse.Namespace) -> None:
+    results = await bench_redirect(requests=args.requests, keys=args.keys,
+                                   rounds=args.rounds)
+    print(orjson.dumps(results, option=orjson.OPT_INDENT_2).decode())
+
+
+async def bench_listings(args: argparse.Namespace) -> None:
+    results = await bench_listing(page_size=args.page_size,
+                                  requests=args.requests, rounds=args.rounds)
+    print(orjson.dumps(results, option=orjson.OPT_INDENT_2).decode())
+
+
+async def bench_snapshots(args: argparse.Namespace) -> None:
+    results = await bench_snapshot(rows=args.rows, lookups=args.lookups)
+    print(orjson.dumps(results, option=orjson.OPT_INDENT_2).decode())
+
+
+async def bench_compare(args: argparse.Namespace) -> None:
+    with open(args.baseline, "rb") as file:
+        baseline = orjson.loads(file.read())
+    with open(args.candidate, "rb") as file:
+        candidate = orjson.loads(file.read())
+    print(orjson.dumps(compare_runs(baseline, candidate),
+                       option=orjson.OPT_INDENT_2).decode())
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m src.cli")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    reconcile = commands.add_parser(
+        "reconcile-clicks",
+        help="Backfill url.click_count from the usage table")
+    reconcile.add_argument("--batch-size", type=int, default=10_000)
+    reconcile.set_defaults(handler=reconcile_clicks)
+
+    rollup = commands.add_parser(
+        "rollup-usage",
+        help="Roll usage rows up into the analytics tables and prune them")
+    rollup.set_defaults(handler=rollup_usage)
+
+    partitions = commands.add_parser(
+        "usage-partitions",
+        help="Create upcoming usage partitions and drop expired ones")
+    partitions.set_defaults(handler=manage_partitions)
+
+    reap = commands.add_parser(
+        "reap-expired", help="Soft-delete links past their expiry")
+    reap.set_defaults(handler=reap_expired)
+
+    dump = commands.add_parser(
+        "export", help="Stream urls or clicks as NDJSON / CSV")
+    dump.add_argument("table", choices=("urls", "clicks"))
+    dump.add_argument("--format", choices=FORMATS, default="ndjson")
+    dump.add_argument("--output", help="File to write, stdout if unset")
+    dump.add_argument("--since", type=datetime.fromisoformat,
+                      help="created_at / used_at lower bound (UTC)")
+    dump.add_argument("--until", type=datetime.fromisoformat,
+                      help="created_at / used_at upper bound, exclusive")
+    dump.add_argument("--deleted", action=argparse.BooleanOptionalAction,
+                      help="Only deleted (or not deleted) urls")
+    dump.add_argument("--id", type=int, action="append",
+                      help="Url id, repeatable (url_id for clicks)")
+    dump.set_defaults(handler=export)
+
+    snapshot = commands.add_parser(
+        "compile-snapshot",
+        help="Compile the url table into a redirect snapshot file")
+    snapshot.add_argument("--output",
+                          help="File to write, REDIRECT_SNAPSHOT_PATH if "
+                               "unset; replaced atomically")
+    snapshot.add_argument("--chunk-size", type=int, default=10_000)
+    snapshot.set_defaults(handler=compile_snapshot)
+
+    bench = commands.add_parser(
+        "bench-url-index",
+        help="Compare the full-url and digest dedup indexes")
+    bench.add_argument("--rows", type=int, default=100_000)
+    bench.add_argument("--batch-size", type=int, default=5000)
+    bench.set_defaults(handler=bench_index)
+
+    http = commands.add_parser(
+        "bench-http",
+        help="Load test the HTTP API and print latency / rps as JSON")
+    http.add_argument("--base-url",
+                      help="Running app to test, started on --port if unset")
+    http.add_argument("--port", type=int, default=8099)
+    http.add_argument("--scenario", action="append", choices=SCENARIOS)
+    http.add_argument("--requests", type=int, default=2000)
+    http.add_argument("--concurrency", type=int, default=20)
+    http.add_argument("--keys", type=int, default=1000)
+    http.add_argument("--distribution", choices=DISTRIBUTIONS,
+                      default="uniform")
+    http.add_argument("--zipf-s", type=float, default=1.1)
+    http.add_argument("--batch-size", type=int, default=100,
+                      help="Urls per multi-create request")
+    http.add_argument("--warmup", type=int, default=100)
+    http.add_argument("--output", help="Also write the results here")
+    http.set_defaults(handler=bench_http)
+
+    redirect = commands.add_parser(
+        "bench-redirect",
+        help="CPU per redirect through FastAPI routing and the fast path")
+    redirect.add_argument("--requests", type=int, default=20_000)
+    redirect.add_argument("--keys", type=int, default=1000)
+    redirect.add_argument("--rounds", type=int, default=3)
+    redirect.set_defaults(handler=bench_redirects)
+
+    listing = commands.add_parser(
+        "bench-listing",
+        help="CPU per listing / status page, ORM and raw serialization")
+    listing.add_argument("--page-size", type=int, default=1000)
+    listing.add_argument("--requests", type=int, default=50)
+    listing.add_argument("--rounds", type=int, default=3)
+    listing.set_defaults(handler=bench_listings)
+
+    mapped = commands.add_parser(
+        "bench-snapshot",
+        help="Open time and lookup CPU of a synthetic redirect snapshot")
+    mapped.add_argument("--rows", type=int, default=1_000_000)
+    mapped.add_argument("--lookups", type=int, default=200_000)
+    mapped.set_defaults(handler=bench_snapshots)
+
+    compare = commands.add_parser(
+        "bench-compare", help="Compare two bench-http result files")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+    compare.set_defaults(handler=bench_compare)
+    return parser
+
+
+async def run(args: argparse.Namespace) -> None:
+    try:
+        await args.handler(args)
+    finally:
+        await dispose_engines()
+
+
+def main() -> None:
+    args = build_parser().parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
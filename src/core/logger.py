@@ -43,6 +43,9 @@ LOGGING = {
         'uvicorn.error': {
             'level': 'INFO',
         },
+        'sqlalchemy': {
+            'level': 'WARNING',
+        },
         'uvicorn.access': {
             'handlers': ['access'],
             'level': 'INFO',
@@ -1,7 +1,10 @@
-import sys
+import time
+from typing import Optional
 from src.core.config import app_settings
 from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, \
+    AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import logging.config
 
 from src.core.logger import LOGGING
@@ -13,12 +16,108 @@ Base = declarative_base()
 
 database_dsn = app_settings.database_dsn
 
-engine = create_async_engine(database_dsn, echo=True, future=True)
+# upper bounds, in seconds, of the checkout wait histogram buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5,
+                float("inf"))
+
+
+class PoolStats:
+    def __init__(self):
+        self.waiters = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_sum = 0.0
+        self.wait_buckets = [0] * len(WAIT_BUCKETS)
+
+    def observe(self, seconds: float) -> None:
+        self.checkouts += 1
+        self.wait_sum += seconds
+        for index, bound in enumerate(WAIT_BUCKETS):
+            if seconds <= bound:
+                self.wait_buckets[index] += 1
+                break
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long checkouts wait for a connection."""
+    stats = PoolStats()
+
+    def connect(self):
+        stats = self.stats
+        stats.waiters += 1
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except Exception:
+            stats.timeouts += 1
+            raise
+        finally:
+            stats.waiters -= 1
+        stats.observe(time.perf_counter() - start)
+        return connection
+
+
+def pool_status(pool: InstrumentedPool) -> dict:
+    stats = pool.stats
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "waiters": stats.waiters,
+        "checkouts": stats.checkouts,
+        "timeouts": stats.timeouts,
+        "wait_seconds": {
+            "sum": stats.wait_sum,
+            "buckets": {
+                str(bound): count for bound, count
+                in zip(WAIT_BUCKETS, stats.wait_buckets)
+            },
+        },
+    }
+
+
+def build_engine(dsn: str, name: str) -> AsyncEngine:
+    # a pool class per engine so that each one keeps its own stats
+    poolclass = type(f"{name}Pool", (InstrumentedPool, ),
+                     {"stats": PoolStats()})
+    return create_async_engine(
+        dsn,
+        echo=app_settings.DB_ECHO,
+        future=True,
+        poolclass=poolclass,
+        pool_size=app_settings.DB_POOL_SIZE,
+        max_overflow=app_settings.DB_MAX_OVERFLOW,
+        pool_timeout=app_settings.DB_POOL_TIMEOUT,
+        pool_recycle=app_settings.DB_POOL_RECYCLE,
+        pool_pre_ping=app_settings.DB_POOL_PRE_PING,
+        connect_args={
+            "prepared_statement_cache_size":
+                app_settings.DB_STATEMENT_CACHE_SIZE,
+        },
+    )
+
+
+engine = build_engine(database_dsn, "Primary")
+# read-only replica pool, None when every query goes to the primary
+read_engine: Optional[AsyncEngine] = build_engine(
+    app_settings.database_replica_dsn, "Replica"
+) if app_settings.database_replica_dsn else None
 async_session = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
 
 
 async def get_session() -> AsyncSession:
+    """
+    Session bound to the primary. Repositories send their lookups to
+    `read_engine` through bind_arguments when a replica is configured.
+    """
     async with async_session() as session:
         yield session
+
+
+async def dispose_engines() -> None:
+    await engine.dispose()
+    if read_engine is not None:
+        await read_engine.dispose()
@@ -1,16 +1,39 @@
 import uvicorn
 from fastapi import FastAPI
 from fastapi.responses import ORJSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
 
 from src.api.v1 import shortlinks, info_links
+from src.api.v1.redirects import RedirectFastPath
 from src.core.config import app_settings
 from src.middleware.black_list import BlackListMiddleware
+from src.middleware.metrics import MetricsMiddleware
+from src.services.urls import alias_registry, click_logger, \
+    link_reaper, redirect_cache, redirect_snapshot, request_metrics, \
+    usage_aggregator, usage_partitions
+
+
+API_PREFIX = "/api/v1/tinyurl"
 
 
 def init_middlewares(fast_api_app: FastAPI) -> None:
-    my_middleware = BlackListMiddleware(app_settings.blacklist)
-    fast_api_app.add_middleware(BaseHTTPMiddleware, dispatch=my_middleware)
+    if app_settings.FAST_REDIRECT_ENABLED:
+        # innermost, so that the blacklist and metrics still apply
+        fast_api_app.add_middleware(
+            RedirectFastPath,
+            prefix=API_PREFIX,
+            dependency_overrides_provider=fast_api_app,
+        )
+    fast_api_app.add_middleware(
+        BlackListMiddleware,
+        black_list=app_settings.blacklist,
+        trusted_proxies=app_settings.BLACKLIST_TRUSTED_PROXIES,
+        path=app_settings.BLACKLIST_FILE,
+        reload_interval=app_settings.BLACKLIST_RELOAD_INTERVAL,
+    )
+    if app_settings.METRICS_ENABLED:
+        # added last, so it is outermost and times the blacklist as well
+        fast_api_app.add_middleware(MetricsMiddleware,
+                                    metrics=request_metrics)
 
 
 app = FastAPI(
@@ -20,10 +43,90 @@ app = FastAPI(
     default_response_class=ORJSONResponse,
 )
 init_middlewares(app)
-app.include_router(shortlinks.router, prefix="/api/v1/tinyurl",
+app.include_router(shortlinks.router, prefix=API_PREFIX,
                    tags=["short url"])
 app.include_router(info_links.info_router, prefix="/info", tags=["info"])
 
+
+@app.on_event("startup")
+async def start_click_logger() -> None:
+    if app_settings.CLICK_LOG_ASYNC:
+        await click_logger.start()
+
+
+@app.on_event("startup")
+async def start_usage_aggregator() -> None:
+    if app_settings.ANALYTICS_ENABLED:
+        await usage_aggregator.start()
+
+
+@app.on_event("startup")
+async def start_cache_invalidation() -> None:
+    if redirect_cache is not None:
+        await redirect_cache.start()
+
+
+@app.on_event("startup")
+async def start_redirect_snapshot() -> None:
+    if redirect_snapshot is not None:
+        await redirect_snapshot.start()
+
+
+@app.on_event("startup")
+async def start_alias_registry() -> None:
+    if alias_registry is not None:
+        await alias_registry.start()
+
+
+@app.on_event("startup")
+async def start_link_reaper() -> None:
+    if app_settings.REAPER_ENABLED:
+        await link_reaper.start()
+
+
+@app.on_event("startup")
+async def start_usage_partitions() -> None:
+    if app_settings.USAGE_PARTITIONS_ENABLED:
+        await usage_partitions.start()
+
+
+@app.on_event("shutdown")
+async def stop_click_logger() -> None:
+    await click_logger.stop()
+
+
+@app.on_event("shutdown")
+async def stop_usage_aggregator() -> None:
+    await usage_aggregator.stop()
+
+
+@app.on_event("shutdown")
+async def stop_cache_invalidation() -> None:
+    if redirect_cache is not None:
+        await redirect_cache.stop()
+
+
+@app.on_event("shutdown")
+async def stop_redirect_snapshot() -> None:
+    if redirect_snapshot is not None:
+        await redirect_snapshot.stop()
+
+
+@app.on_event("shutdown")
+async def stop_alias_registry() -> None:
+    if alias_registry is not None:
+        await alias_registry.stop()
+
+
+@app.on_event("shutdown")
+async def stop_link_reaper() -> None:
+    await link_reaper.stop()
+
+
+@app.on_event("shutdown")
+async def stop_usage_partitions() -> None:
+    await usage_partitions.stop()
+
 if __name__ == '__main__':
     uvicorn.run(
         'main:app',
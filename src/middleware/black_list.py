@@ -1,19 +1,195 @@
-from fastapi import Request
+import asyncio
+import ipaddress
+import logging.config
+import os
+import time
+from bisect import bisect_right
+from typing import Iterable, Optional
+
+import orjson
 from fastapi import status
-from fastapi.responses import ORJSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from src.core.logger import LOGGING
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger(__name__)
+
+IPAddress = ipaddress.IPv4Address | ipaddress.IPv6Address
+
+
+def parse_ip(value: str) -> Optional[IPAddress]:
+    """Address from a header value: bare, bracketed IPv6 or with a port."""
+    value = value.strip().strip('"')
+    if value.startswith('['):
+        value = value[1:value.find(']')]
+    elif value.count(':') == 1:
+        value = value.split(':')[0]
+    try:
+        return ipaddress.ip_address(value)
+    except ValueError:
+        return None
+
+
+class IPRangeIndex:
+    """
+    IPv4/IPv6 networks merged into sorted, non-overlapping integer
+    intervals, one list per address family. Lookups are a bisect, so
+    O(log n) however many ranges are blocked.
+    """
+
+    def __init__(self, networks: Iterable[ipaddress._BaseNetwork] = ()):
+        ranges: dict[int, list[tuple[int, int]]] = {4: [], 6: []}
+        for network in networks:
+            ranges[network.version].append(
+                (int(network.network_address),
+                 int(network.broadcast_address)))
+        self._starts: dict[int, list[int]] = {}
+        self._ends: dict[int, list[int]] = {}
+        for version, intervals in ranges.items():
+            merged: list[list[int]] = []
+            for start, end in sorted(intervals):
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            self._starts[version] = [start for start, _ in merged]
+            self._ends[version] = [end for _, end in merged]
+
+    def __len__(self) -> int:
+        return sum(len(starts) for starts in self._starts.values())
+
+    def __contains__(self, address: IPAddress) -> bool:
+        starts = self._starts[address.version]
+        value = int(address)
+        position = bisect_right(starts, value) - 1
+        return position >= 0 and value <= self._ends[address.version][position]
+
+
+class BlackList:
+    """Blocked networks plus blocked host names (matched on Host)."""
+
+    def __init__(self, entries: Iterable[str]):
+        networks = []
+        self.hosts: set[str] = set()
+        for entry in entries:
+            entry = entry.split('#')[0].strip()
+            if not entry:
+                continue
+            try:
+                networks.append(ipaddress.ip_network(entry, strict=False))
+            except ValueError:
+                self.hosts.add(entry.lower())
+        self.networks = IPRangeIndex(networks)
 
 
 class BlackListMiddleware:
-    def __init__(self, black_list: set):
-        self.black_list = black_list
-
-    async def __call__(self, request: Request, call_next):
-        client_ip = request.headers.get('X-Forwarded-For')
-        host = request.headers.get('host', '').split(':')[0]
-        # "Если по какой-то причине  не будет заголовка host, тут свалится IndexError"
-        # почему - get('host', '') -> ''?
-        if host in self.black_list or client_ip in self.black_list:
-            return ORJSONResponse(status_code=status.HTTP_403_FORBIDDEN,
-                                  content=f"client {client_ip} "
-                                          f"{host} is in blacklist")
-        return await call_next(request)
+    """
+    Pure ASGI middleware that answers 403 to blacklisted clients.
+
+    The client address is the connection peer, followed back through
+    X-Forwarded-For for as long as the hop that added the entry is one of
+    `trusted_proxies`. Every address on that path and the Host header are
+    checked. When `path` is set the list is re-read from that file once
+    it changes, checked at most every `reload_interval` seconds.
+    """
+
+    def __init__(self, app: ASGIApp, black_list: Iterable[str] = (),
+                 trusted_proxies: Iterable[str] = (),
+                 path: Optional[str] = None, reload_interval: float = 5):
+        self.app = app
+        self._entries = list(black_list)
+        self._trusted = IPRangeIndex(
+            ipaddress.ip_network(proxy, strict=False)
+            for proxy in trusted_proxies)
+        self._path = path
+        self._reload_interval = reload_interval
+        self._mtime: Optional[float] = None
+        self._next_check = 0.0
+        self._reloading = False
+        self.black_list = BlackList(self._entries)
+        if path:
+            self._check_file(load=self._load)
+
+    def _load(self) -> None:
+        with open(self._path) as file:
+            entries = self._entries + file.read().splitlines()
+        self.black_list = BlackList(entries)
+        logger.info(f"Loaded blacklist from {self._path}: "
+                    f"{len(self.black_list.networks)} ranges")
+
+    def _check_file(self, load) -> None:
+        try:
+            mtime = os.stat(self._path).st_mtime
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self._mtime = mtime
+            load()
+
+    async def _reload(self) -> None:
+        try:
+            await asyncio.to_thread(self._load)
+        except Exception:
+            logger.exception(f"Failed to reload blacklist {self._path}")
+        finally:
+            self._reloading = False
+
+    def _schedule_reload(self) -> None:
+        self._reloading = True
+        asyncio.get_running_loop().create_task(self._reload())
+
+    def client_addresses(self, scope: Scope) -> list[IPAddress]:
+        addresses = []
+        client = scope.get('client')
+        peer = parse_ip(client[0]) if client else None
+        if peer is None:
+            return addresses
+        addresses.append(peer)
+        forwarded = []
+        for name, value in scope['headers']:
+            if name == b'x-forwarded-for':
+                forwarded.extend(value.decode('latin-1').split(','))
+        hop = peer
+        for entry in reversed(forwarded):
+            if hop not in self._trusted:
+                break
+            hop = parse_ip(entry)
+            if hop is None:
+                break
+            addresses.append(hop)
+        return addresses
+
+    def blocked(self, scope: Scope) -> Optional[str]:
+        black_list = self.black_list
+        if black_list.hosts:
+            for name, value in scope['headers']:
+                if name == b'host':
+                    host = value.decode('latin-1').rsplit(':', 1)[0]
+                    if host.lower() in black_list.hosts:
+                        return host
+                    break
+        for address in self.client_addresses(scope):
+            if address in black_list.networks:
+                return str(address)
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive,
+                       send: Send) -> None:
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        if self._path and not self._reloading:
+            now = time.monotonic()
+            if now >= self._next_check:
+                self._next_check = now + self._reload_interval
+                self._check_file(load=self._schedule_reload)
+        blocked = self.blocked(scope)
+        if blocked is None:
+            return await self.app(scope, receive, send)
+        body = orjson.dumps(f"client {blocked} is in blacklist")
+        await send({
+            'type': 'http.response.start',
+            'status': status.HTTP_403_FORBIDDEN,
+            'headers': [(b'content-type', b'application/json'),
+                        (b'content-length', str(len(body)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,43 @@
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.services.metrics import RequestMetrics, request_queries
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware timing every HTTP request. The handler label is
+    the name of the endpoint the router matched, so that path parameters
+    do not multiply the series; unmatched requests are "unmatched".
+    """
+
+    def __init__(self, app: ASGIApp, metrics: RequestMetrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: Scope, receive: Receive,
+                       send: Send) -> None:
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        status = 500
+        queries = [0, 0.0]
+        token = request_queries.set(queries)
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            request_queries.reset(token)
+            endpoint = scope.get('endpoint')
+            self.metrics.observe_request(
+                scope['method'],
+                endpoint.__name__ if endpoint else 'unmatched',
+                status, elapsed, queries)
@@ -0,0 +1,38 @@
+from sqlalchemy import Column, Integer, String, DateTime, BigInteger, \
+    ForeignKey
+
+from src.db.db import Base
+
+
+class UsageRollupModel(Base):
+    """Clicks per url per minute / hour / day bucket."""
+    __tablename__ = "usage_rollup"
+    url_id = Column(Integer, ForeignKey('url.id'), primary_key=True)
+    granularity = Column(String(8), primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    clicks = Column(BigInteger, nullable=False, default=0)
+
+
+class UsageHostRollupModel(Base):
+    """Clicks per url per client host per day, for unique host counts."""
+    __tablename__ = "usage_host_rollup"
+    url_id = Column(Integer, ForeignKey('url.id'), primary_key=True)
+    day = Column(DateTime, primary_key=True)
+    client_host = Column(String(2048), primary_key=True)
+    clicks = Column(BigInteger, nullable=False, default=0)
+
+
+class UsageReferrerRollupModel(Base):
+    """Clicks per url per referrer per day, '' when there was none."""
+    __tablename__ = "usage_referrer_rollup"
+    url_id = Column(Integer, ForeignKey('url.id'), primary_key=True)
+    day = Column(DateTime, primary_key=True)
+    referrer = Column(String(2048), primary_key=True)
+    clicks = Column(BigInteger, nullable=False, default=0)
+
+
+class RollupStateModel(Base):
+    """Id of the last usage row that has been rolled up."""
+    __tablename__ = "usage_rollup_state"
+    name = Column(String(32), primary_key=True)
+    last_usage_id = Column(BigInteger, nullable=False, default=0)
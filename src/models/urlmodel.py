@@ -1,5 +1,6 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, \
+    DDL, Index, BigInteger, LargeBinary, event, text
 from sqlalchemy.orm import relationship
 
 from src.db.db import Base
@@ -9,22 +10,65 @@ from src.core.config import app_settings
 class UrlModel(Base):
     __tablename__ = "url"
     id = Column(Integer, primary_key=True)
-    original_url = Column(String(2048), unique=True, nullable=False)
+    original_url = Column(String(2048), nullable=False)
+    # md5 of the canonical original_url, deduplicated through a unique
+    # index of fixed 16-byte keys instead of one over the full urls
+    url_digest = Column(LargeBinary(16), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     short_url = Column(String(app_settings.SHORT_URL_MAX_LEN), unique=True, nullable=False)
     deleted = Column(Boolean, default=False)
+    click_count = Column(BigInteger, nullable=False, default=0,
+                         server_default="0")
+    expires_at = Column(DateTime)
+    max_clicks = Column(BigInteger)
+    # last soft-delete / restore, read by redirect snapshots to skip ids
+    # changed since they were compiled (click counts do not set it)
+    changed_at = Column(DateTime)
     url_usages = relationship("UrlUsageModel")
 
+    __table_args__ = (
+        # only links that may be handed to every caller shortening the url
+        Index("ix_url_url_digest_shared", "url_digest", unique=True,
+              postgresql_where=text(
+                  "deleted IS NOT TRUE AND expires_at IS NULL "
+                  "AND max_clicks IS NULL")),
+        # alias filters catch up with new codes by creation time
+        Index("ix_url_created_at", "created_at"),
+        # only live links with an expiry, the reaper's work queue
+        Index("ix_url_expires_at", "expires_at",
+              postgresql_where=text(
+                  "expires_at IS NOT NULL AND deleted IS NOT TRUE")),
+        Index("ix_url_changed_at", "changed_at",
+              postgresql_where=text("changed_at IS NOT NULL")),
+    )
+
     def __repr__(self):
         return (f"URL(original url: '{self.original_url}', "
                 f"short='{self.short_url}', use: {self.url_usages}")
 
 
 class UrlUsageModel(Base):
+    """
+    Range-partitioned on used_at (monthly partitions plus a default one),
+    so the key has to include it. Partitions are managed by
+    `src.services.partitions.PartitionManager`.
+    """
     __tablename__ = "usage"
-    id = Column(Integer, primary_key=True)
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
     url_id = Column(Integer, ForeignKey('url.id'))
 
-    used_at = Column(DateTime, default=datetime.utcnow)
+    used_at = Column(DateTime, primary_key=True, default=datetime.utcnow)
     client_port = Column(Integer)
     client_host = Column(String(2048))
+    referrer = Column(String(2048))
+
+    __table_args__ = (
+        Index("ix_usage_url_id_used_at_id", "url_id", "used_at", "id"),
+        {"postgresql_partition_by": "RANGE (used_at)"},
+    )
+
+
+# rows no other partition takes land here, so a table created from the
+# models (tests, fresh databases) accepts inserts right away
+event.listen(UrlUsageModel.__table__, "after_create",
+             DDL("CREATE TABLE usage_default PARTITION OF usage DEFAULT"))
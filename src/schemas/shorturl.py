@@ -1,6 +1,23 @@
-from datetime import datetime
+from datetime import datetime, timezone
+from typing import Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, conint, constr, validator
+
+from src.core.config import app_settings
+
+# letters, digits, "-" and "_", at least one of them not a digit: numeric
+# paths are url ids
+ALIAS_REGEX = r'^[A-Za-z0-9_-]*[A-Za-z_-][A-Za-z0-9_-]*$'
+# url ids are int4
+MAX_ID = 2 ** 31 - 1
+UrlId = conint(ge=1, le=MAX_ID)
+
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Timestamps are stored as naive UTC, like created_at."""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
 
 
 class HTTPError(BaseModel):
@@ -26,7 +43,23 @@ class ShortUrlBase(BaseModel):
 
 
 class ShortUrlCreate(ShortUrlBase):
-    pass
+    alias: Optional[constr(regex=ALIAS_REGEX, min_length=3,
+                           max_length=app_settings.SHORT_URL_MAX_LEN)] = None
+    expires_at: Optional[datetime] = None
+    max_clicks: Optional[conint(ge=1)] = None
+
+    _naive_utc = validator('expires_at', allow_reuse=True)(naive_utc)
+
+    @validator('expires_at')
+    def not_expired(cls, value: Optional[datetime]) -> Optional[datetime]:
+        if value is not None and value <= datetime.utcnow():
+            raise ValueError("expires_at is in the past")
+        return value
+
+
+class AliasAvailability(BaseModel):
+    alias: str
+    available: bool
 
 
 class ShortUrl(ORMBase):
@@ -34,6 +67,30 @@ class ShortUrl(ORMBase):
     original_url: str
     short_url: str
     created_at: datetime
+    expires_at: Optional[datetime] = None
+    max_clicks: Optional[int] = None
+
+
+class ShortUrlBulkResult(BaseModel):
+    status: str
+    original_url: str
+    id: Optional[int] = None
+    short_url: Optional[str] = None
+    created_at: Optional[datetime] = None
+    detail: Optional[str] = None
+
+
+class BulkStatusUpdate(BaseModel):
+    ids: list[UrlId]
+    deleted: bool = True
+
+
+class BulkStatusResult(BaseModel):
+    deleted: bool
+    requested: int
+    updated: int
+    not_found: list[int]
+    invalid_lines: list[int]
 
 
 class UrlUsageBase(BaseModel):
@@ -43,6 +100,7 @@ class UrlUsageBase(BaseModel):
 class UrlUsageCreate(UrlUsageBase):
     client_host: str
     client_port: int
+    referrer: Optional[str] = None
 
 
 class UrlUsage(ORMBase):
@@ -56,3 +114,25 @@ class UrlUsageFull(UrlUsageBase):
     used_at: datetime
     client_host: str
     client_port: int
+    referrer: Optional[str] = None
+
+
+class UsageBucket(BaseModel):
+    bucket: datetime
+    clicks: int
+
+
+class ReferrerStat(BaseModel):
+    referrer: str
+    clicks: int
+
+
+class UsageStats(BaseModel):
+    url_id: int
+    granularity: str
+    start: datetime
+    end: datetime
+    total: int
+    unique_hosts: int
+    buckets: list[UsageBucket]
+    top_referrers: list[ReferrerStat]
@@ -0,0 +1,160 @@
+import asyncio
+import logging.config
+import math
+import time
+from datetime import datetime, timedelta
+from typing import Any, Optional
+
+from sqlalchemy import exists, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core.logger import LOGGING
+from src.services.bloom import BloomFilter
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger(__name__)
+
+
+class AliasRegistry:
+    """
+    Answers "is this short code taken?" for alias reservation.
+
+    A Bloom filter built from the short code column in the background
+    rules out most free codes without a query; codes it may contain are
+    checked in the database. Codes created by this worker are added as
+    they are created, those of other workers every `refresh_interval`
+    seconds from the rows whose `created_at` is past the last refresh
+    (less `clock_skew`, for clocks and inserts still in flight). A code
+    missing from the filter is only taken as free while the last refresh
+    is at most `max_staleness` seconds old, the database answers
+    otherwise.
+
+    The filter is sized for the rows at build time times `headroom`, at
+    least `capacity`, and rebuilt once it holds more codes than that.
+    """
+
+    def __init__(self, column: Any, session_factory: Any, *,
+                 created_at: Any, capacity: int = 1_000_000,
+                 error_rate: float = 0.01, batch_size: int = 10_000,
+                 headroom: float = 2, refresh_interval: float = 5,
+                 max_staleness: Optional[float] = None,
+                 clock_skew: float = 60):
+        self._column = column
+        self._created_at = created_at
+        self._session_factory = session_factory
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._batch_size = batch_size
+        self._headroom = headroom
+        self._refresh_interval = refresh_interval
+        self._max_staleness = max_staleness if max_staleness is not None \
+            else 3 * refresh_interval
+        self._clock_skew = timedelta(seconds=clock_skew)
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._building: Optional[BloomFilter] = None
+        self._limit = capacity
+        self._synced_from: Optional[datetime] = None
+        self._synced_at = -math.inf
+        self._task: Optional[asyncio.Task] = None
+        self.ready = False
+        self.filtered = 0
+        self.queried = 0
+
+    def add(self, code: str) -> None:
+        for bloom in (self._bloom, self._building):
+            if bloom is not None and code not in bloom:
+                bloom.add(code)
+
+    def fresh(self) -> bool:
+        return self.ready and \
+            time.monotonic() - self._synced_at <= self._max_staleness
+
+    async def is_available(self, db: AsyncSession, code: str) -> bool:
+        if self.fresh() and code not in self._bloom:
+            self.filtered += 1
+            return True
+        self.queried += 1
+        results = await db.execute(select(exists().where(
+            self._column == code)))
+        return not results.scalar()
+
+    async def warm(self) -> int:
+        """
+        Builds a new filter from every code, sized for the table, and
+        swaps it in; the current one answers until then.
+        """
+        started = datetime.utcnow()
+        statement = select(self._column).execution_options(
+            yield_per=self._batch_size)
+        try:
+            async with self._session_factory() as db:
+                results = await db.execute(
+                    select(func.count()).select_from(self._column.table))
+                capacity = max(self._capacity, math.ceil(
+                    results.scalar_one() * self._headroom))
+                self._building = BloomFilter(capacity, self._error_rate)
+                results = await db.stream(statement)
+                async for partition in results.scalars().partitions():
+                    for code in partition:
+                        self._building.add(code)
+            self._bloom, self._limit = self._building, capacity
+        finally:
+            self._building = None
+        if self._synced_from is None or started < self._synced_from:
+            self._synced_from = started
+        self.ready = True
+        await self.refresh()
+        return self._bloom.count
+
+    async def refresh(self) -> int:
+        """Adds the codes created since the last refresh."""
+        started = datetime.utcnow()
+        statement = select(self._column).where(
+            self._created_at >= self._synced_from - self._clock_skew)
+        async with self._session_factory() as db:
+            results = await db.execute(statement)
+            codes = results.scalars().all()
+        for code in codes:
+            self.add(code)
+        self._synced_from = started
+        self._synced_at = time.monotonic()
+        return len(codes)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if not self.ready or self._bloom.count > self._limit:
+                    count = await self.warm()
+                    logger.info(f"Alias filter built with {count} codes")
+                else:
+                    await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Alias filter refresh failed")
+            await asyncio.sleep(self._refresh_interval)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "fresh": self.fresh(),
+            "codes": self._bloom.count,
+            "capacity": self._limit,
+            "bits": self._bloom.size,
+            "hashes": self._bloom.hashes,
+            "filtered": self.filtered,
+            "queried": self.queried,
+        }
@@ -0,0 +1,290 @@
+import asyncio
+import logging.config
+from datetime import datetime, timedelta
+from typing import Any, Optional
+
+from sqlalchemy import delete, exc, func, literal_column, select, text, \
+    update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core.logger import LOGGING
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ("minute", "hour", "day")
+STATE_NAME = "usage"
+# advisory lock usage writers hold shared, see RepositoryAnalytics
+USAGE_WRITE_LOCK = 0x75736167
+
+
+class RepositoryAnalytics:
+    """
+    Rolls raw usage rows up into per-url time buckets and answers stats
+    queries from those rollups.
+
+    Usage rows are consumed in id order after a watermark kept in the
+    state table, and every batch updates the rollups and the watermark in
+    one transaction. The state row is locked with SKIP LOCKED so that only
+    one worker aggregates at a time.
+
+    Ids are handed out when a row is inserted, and writers commit out of
+    order, so the watermark never passes ids that may still be in flight:
+    writers hold `write_lock` shared until they commit, and the rollup
+    reads the id sequence while holding it exclusively (waiting at most
+    `lock_timeout` seconds), which gives an id up to which every row is
+    committed.
+    """
+
+    def __init__(self, usage: Any, rollup: Any, host_rollup: Any,
+                 referrer_rollup: Any, state: Any, *,
+                 write_lock: int = USAGE_WRITE_LOCK,
+                 lock_timeout: float = 5):
+        self._usage = usage
+        self._rollup = rollup
+        self._host_rollup = host_rollup
+        self._referrer_rollup = referrer_rollup
+        self._state = state
+        self._write_lock = write_lock
+        self._lock_timeout = lock_timeout
+        self._sequence = f"{usage.__tablename__}_id_seq"
+
+    async def lock_watermark(self, db: AsyncSession) -> Optional[int]:
+        """Last rolled up usage id, None when another worker holds it."""
+        await db.execute(pg_insert(self._state).values(
+            name=STATE_NAME, last_usage_id=0).on_conflict_do_nothing())
+        statement = select(self._state.last_usage_id).where(
+            self._state.name == STATE_NAME).with_for_update(skip_locked=True)
+        results = await db.execute(statement=statement)
+        return results.scalar_one_or_none()
+
+    async def watermark(self, db: AsyncSession) -> int:
+        statement = select(self._state.last_usage_id).where(
+            self._state.name == STATE_NAME)
+        results = await db.execute(statement=statement)
+        return results.scalar_one_or_none() or 0
+
+    async def committed_id(self, db: AsyncSession) -> Optional[int]:
+        """
+        Highest usage id below which no insert is in flight, None when
+        the writers did not let go within the lock timeout.
+        """
+        try:
+            await db.execute(text(
+                f"SET LOCAL lock_timeout = {int(self._lock_timeout * 1000)}"))
+            await db.execute(select(
+                func.pg_advisory_xact_lock(self._write_lock)))
+            results = await db.execute(text(
+                f"SELECT CASE WHEN is_called THEN last_value "
+                f"ELSE last_value - 1 END FROM {self._sequence}"))
+            high = results.scalar_one()
+        except exc.DBAPIError:
+            logger.warning("Usage writers held the rollup fence, retrying "
+                           "on the next run")
+            await db.rollback()
+            return None
+        await db.commit()
+        return high
+
+    def upsert_statement(self, model: Any, columns: list[str],
+                         source: Any) -> Any:
+        statement = pg_insert(model).from_select(columns, source)
+        return statement.on_conflict_do_update(
+            index_elements=columns[:-1],
+            set_={"clicks": model.clicks + statement.excluded.clicks})
+
+    async def rollup(self, db: AsyncSession, *, batch_size: int = 50_000,
+                     lag: float = 30) -> int:
+        """
+        Rolls up the next batch of committed usage rows. The batch ends
+        before the first row newer than `lag` seconds, rows are never
+        skipped. Returns how many rows were consumed.
+        """
+        usage = self._usage
+        fence = await self.committed_id(db)
+        if fence is None:
+            return 0
+        low = await self.lock_watermark(db)
+        if low is None:
+            await db.rollback()
+            return 0
+        cutoff = datetime.utcnow() - timedelta(seconds=lag)
+        recent = select(func.min(usage.id)).where(
+            usage.id > low, usage.id <= fence, usage.used_at >= cutoff,
+        ).scalar_subquery()
+        ids = select(usage.id).where(
+            usage.id > low, usage.id <= fence,
+            usage.id < func.coalesce(recent, fence + 1),
+        ).order_by(usage.id).limit(batch_size).subquery()
+        results = await db.execute(select(func.max(ids.c.id), func.count()))
+        high, consumed = results.one()
+        if high is None:
+            await db.rollback()
+            return 0
+
+        in_batch = (usage.id > low, usage.id <= high,
+                    usage.url_id.isnot(None), usage.used_at.isnot(None))
+        for granularity in GRANULARITIES:
+            bucket = func.date_trunc(
+                literal_column(f"'{granularity}'"), usage.used_at)
+            source = select(usage.url_id,
+                            literal_column(f"'{granularity}'"),
+                            bucket, func.count()).where(
+                *in_batch).group_by(usage.url_id, bucket)
+            await db.execute(self.upsert_statement(
+                self._rollup, ["url_id", "granularity", "bucket", "clicks"],
+                source))
+        day = func.date_trunc(literal_column("'day'"), usage.used_at)
+        for model, column, value in (
+                (self._host_rollup, "client_host", usage.client_host),
+                (self._referrer_rollup, "referrer", usage.referrer)):
+            value = func.coalesce(value, literal_column("''"))
+            source = select(usage.url_id, day, value, func.count()).where(
+                *in_batch).group_by(usage.url_id, day, value)
+            await db.execute(self.upsert_statement(
+                model, ["url_id", "day", column, "clicks"], source))
+
+        await db.execute(update(self._state).where(
+            self._state.name == STATE_NAME).values(last_usage_id=high))
+        await db.commit()
+        return consumed
+
+    async def prune(self, db: AsyncSession, *, raw_days: Optional[float],
+                    minute_days: float, hour_days: float,
+                    batch_size: int = 50_000) -> int:
+        """
+        Deletes rolled up raw usage rows and expired minute / hour
+        buckets. Raw rows past the watermark are never deleted. With
+        `raw_days` None raw rows are left to partition maintenance.
+        """
+        now = datetime.utcnow()
+        deleted = 0
+        if raw_days is not None:
+            watermark = await self.watermark(db)
+            usage = self._usage
+            ids = select(usage.id).where(
+                usage.id <= watermark,
+                usage.used_at < now - timedelta(days=raw_days),
+            ).limit(batch_size).scalar_subquery()
+            results = await db.execute(
+                delete(usage).where(usage.id.in_(ids)).execution_options(
+                    synchronize_session=False))
+            deleted = results.rowcount
+        for granularity, days in (("minute", minute_days),
+                                  ("hour", hour_days)):
+            results = await db.execute(delete(self._rollup).where(
+                self._rollup.granularity == granularity,
+                self._rollup.bucket < now - timedelta(days=days),
+            ).execution_options(synchronize_session=False))
+            deleted += results.rowcount
+        await db.commit()
+        return deleted
+
+    def rolled_up_clicks(self, url_id: Any) -> Any:
+        """Correlated sum of rolled up clicks for the url id column."""
+        return func.coalesce(
+            select(func.sum(self._rollup.clicks)).where(
+                self._rollup.url_id == url_id,
+                self._rollup.granularity == "day",
+            ).scalar_subquery(), 0)
+
+    async def stats(self, db: AsyncSession, *, url_id: int,
+                    granularity: str, start: datetime, end: datetime,
+                    top: int = 10) -> dict:
+        rollup = self._rollup
+        statement = select(rollup.bucket, rollup.clicks).where(
+            rollup.url_id == url_id, rollup.granularity == granularity,
+            rollup.bucket >= start, rollup.bucket < end,
+        ).order_by(rollup.bucket)
+        results = await db.execute(statement=statement)
+        buckets = [{"bucket": bucket, "clicks": clicks}
+                   for bucket, clicks in results.all()]
+
+        day_start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        hosts = self._host_rollup
+        statement = select(func.count(func.distinct(hosts.client_host))) \
+            .where(hosts.url_id == url_id, hosts.day >= day_start,
+                   hosts.day < end)
+        results = await db.execute(statement=statement)
+        unique_hosts = results.scalar_one()
+
+        referrers = self._referrer_rollup
+        clicks = func.sum(referrers.clicks).label("clicks")
+        statement = select(referrers.referrer, clicks).where(
+            referrers.url_id == url_id, referrers.day >= day_start,
+            referrers.day < end, referrers.referrer != "",
+        ).group_by(referrers.referrer).order_by(clicks.desc()).limit(top)
+        results = await db.execute(statement=statement)
+        top_referrers = [{"referrer": referrer, "clicks": count}
+                         for referrer, count in results.all()]
+        return {
+            "url_id": url_id,
+            "granularity": granularity,
+            "start": start,
+            "end": end,
+            "total": sum(bucket["clicks"] for bucket in buckets),
+            "unique_hosts": unique_hosts,
+            "buckets": buckets,
+            "top_referrers": top_referrers,
+        }
+
+
+class UsageAggregator:
+    """
+    Background task that keeps the rollups up to date and prunes raw
+    usage rows and fine-grained buckets past their retention.
+    """
+
+    def __init__(self, repository: RepositoryAnalytics,
+                 session_factory: Any, *, interval: float = 60,
+                 batch_size: int = 50_000, lag: float = 30,
+                 raw_days: Optional[float] = 30, minute_days: float = 7,
+                 hour_days: float = 180):
+        self._repository = repository
+        self._session_factory = session_factory
+        self._interval = interval
+        self._batch_size = batch_size
+        self._lag = lag
+        self._retention = {"raw_days": raw_days, "minute_days": minute_days,
+                           "hour_days": hour_days}
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self) -> tuple[int, int]:
+        rolled = pruned = 0
+        async with self._session_factory() as db:
+            while True:
+                count = await self._repository.rollup(
+                    db, batch_size=self._batch_size, lag=self._lag)
+                rolled += count
+                if count < self._batch_size:
+                    break
+            pruned = await self._repository.prune(
+                db, batch_size=self._batch_size, **self._retention)
+        return rolled, pruned
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                rolled, pruned = await self.run_once()
+                if rolled or pruned:
+                    logger.info(f"Rolled up {rolled} usage rows, "
+                                f"pruned {pruned} rows")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Usage aggregation failed")
+            await asyncio.sleep(self._interval)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
@@ -1,23 +1,85 @@
 import logging.config
-import pyshorteners
+from datetime import datetime
+from urllib.parse import urlsplit
 
-from typing import Any, Generic, Optional, Type, TypeVar
+from typing import TYPE_CHECKING, Any, AsyncIterator, Generic, Iterable, \
+    NamedTuple, Optional, Type, TypeVar
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
-from sqlalchemy import func, update
+from sqlalchemy.engine import Row
+from sqlalchemy.future import Select, select
+from sqlalchemy import Integer, LargeBinary, and_, any_, bindparam, exists, \
+    func, insert, literal, or_, tuple_, update
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
 from src.db.db import Base
 from sqlalchemy import exc
 
 
 from src.core.logger import LOGGING
+from src.services.aliases import AliasRegistry
+from src.services.cache import MISSING, LRUCache, TieredCache
+from src.services.canonical import canonicalize_url, url_digest, \
+    with_scheme
+from src.services.routing import ReadRouter
+from src.services.singleflight import SingleFlight
+from src.services.shortcodes import CodeGenerator, SequenceBlockGenerator, \
+    ShortCodeError
+if TYPE_CHECKING:
+    from src.services.snapshot import RedirectSnapshot
 logging.config.dictConfig(LOGGING)
 logger = logging.getLogger(__name__)
 
-type_tiny = pyshorteners.Shortener()
-
 
 class Repository:
+    _reads: Optional[ReadRouter] = None
+
+    def bind_arguments(self, key: Any = None, *,
+                       listing: bool = False) -> dict[str, Any]:
+        if self._reads is None:
+            return {}
+        return self._reads.bind_arguments(key, listing=listing)
+
+    async def read_one(self, db: AsyncSession, statement: Any,
+                       key: Any = None) -> Any:
+        """
+        Single row lookup on the replica. A miss is retried on the primary,
+        the row may have been written through another worker.
+        """
+        bind_arguments = self.bind_arguments(key)
+        results = await db.execute(statement=statement,
+                                   bind_arguments=bind_arguments)
+        row = results.one_or_none()
+        if row is None and bind_arguments:
+            results = await db.execute(statement=statement)
+            row = results.one_or_none()
+        return row
+
+    async def stream_rows(self, db: AsyncSession, statement: Any, *,
+                          chunk_size: int = 10_000
+                          ) -> AsyncIterator[list[Row]]:
+        """
+        Rows of `statement` from a server-side cursor, `chunk_size` rows at
+        a time, so that memory does not grow with the result.
+        """
+        connection = await db.connection(
+            bind_arguments=self.bind_arguments(listing=True))
+        # Core execution, the ORM would post-process every row
+        results = await connection.stream(
+            statement.execution_options(yield_per=chunk_size))
+        async for partition in results.partitions():
+            yield partition
+
+    @staticmethod
+    def filter_range(statement: Any, column: Any, start: Optional[datetime],
+                     end: Optional[datetime]) -> Any:
+        """`start <= column < end`, either bound may be left open."""
+        if start is not None:
+            statement = statement.where(column >= start)
+        if end is not None:
+            statement = statement.where(column < end)
+        return statement
+
     def get(self, *args, **kwargs):
         raise NotImplementedError
 
@@ -42,14 +104,84 @@ HealthModelType = TypeVar("HealthModelType", bound=Base)
 ErrorModelType = TypeVar("ErrorModelType", bound=Base)
 
 
+LIMIT_REACHED = "reached its click limit"
+
+
+class UrlTarget(NamedTuple):
+    id: int
+    original_url: str
+    deleted: bool
+    expires_at: Optional[datetime] = None
+    max_clicks: Optional[int] = None
+    click_count: int = 0
+
+    def gone_reason(self, now: datetime) -> Optional[str]:
+        """Why the link no longer redirects, None while it does."""
+        if self.deleted:
+            return "marked as deleted"
+        if self.expires_at is not None and self.expires_at <= now:
+            return "expired"
+        if self.max_clicks is not None and \
+                self.click_count >= self.max_clicks:
+            return LIMIT_REACHED
+        return None
+
+    @staticmethod
+    def cacheable(target: Optional['UrlTarget']) -> bool:
+        """Targets with a click limit carry a live counter."""
+        return target is None or target.max_clicks is None
+
+    def encode(self) -> list:
+        expires_at = self.expires_at.isoformat() if self.expires_at \
+            else None
+        return [*self[:3], expires_at, *self[4:]]
+
+    @classmethod
+    def decode(cls, value: list) -> 'UrlTarget':
+        if value[3] is not None:
+            value[3] = datetime.fromisoformat(value[3])
+        return cls(*value)
+
+
+class BulkItem(NamedTuple):
+    """
+    A url of a bulk create. Items with an expiry or a click limit are
+    never deduplicated, `index` (their input position) keeps them apart.
+    """
+    url: str
+    digest: bytes
+    expires_at: Optional[datetime] = None
+    max_clicks: Optional[int] = None
+    index: Optional[int] = None
+
+    @property
+    def limited(self) -> bool:
+        return self.expires_at is not None or self.max_clicks is not None
+
+
 class RepositoryDB(Repository, Generic[ModelType, CreateSchemaType,
                    HealthModelType, ErrorModelType]):
 
     def __init__(self, model: Type[ModelType], health: Type[HealthModelType],
-                 error: Type[ErrorModelType]):
+                 error: Type[ErrorModelType],
+                 codes: Optional[CodeGenerator] = None,
+                 cache: Optional[TieredCache] = None,
+                 reads: Optional[ReadRouter] = None,
+                 flight: Optional[SingleFlight] = None,
+                 aliases: Optional[AliasRegistry] = None,
+                 code_cache: Optional[LRUCache] = None,
+                 snapshot: Optional['RedirectSnapshot'] = None):
         self._model = model
         self._health = health
         self._error = error
+        self._cache = cache
+        self._flight = flight
+        self._aliases = aliases
+        self._code_cache = code_cache
+        self._snapshot = snapshot
+        self._reads = reads
+        self._codes = codes or SequenceBlockGenerator(
+            f"{model.__tablename__}_id_seq")
 
     async def get_db_status(self, db: AsyncSession) -> HealthModelType:
         self._health.db_status = "Unhealthy"
@@ -63,71 +195,592 @@ class RepositoryDB(Repository, Generic[ModelType, CreateSchemaType,
 
     async def get(self, db: AsyncSession, id: Any) -> Optional[ModelType]:
         statement = select(self._model).where(self._model.id == id)
-        results = await db.execute(statement=statement)
-        return results.scalar_one_or_none()
+        row = await self.read_one(db, statement, id)
+        return row[0] if row else None
+
+    async def load_targets(self, db: AsyncSession,
+                           ids: list[Any]) -> dict[Any, UrlTarget]:
+        model = self._model
+        columns = (model.id, model.original_url, model.deleted,
+                   model.expires_at, model.max_clicks, model.click_count)
+        if len(ids) == 1:
+            row = await self.read_one(
+                db, select(*columns).where(model.id == ids[0]), ids[0])
+            rows = [row] if row else []
+        else:
+            results = await db.execute(
+                select(*columns).where(model.id.in_(ids)))
+            rows = results.all()
+        return {row.id: UrlTarget(row.id, row.original_url, bool(row.deleted),
+                                  row.expires_at, row.max_clicks,
+                                  row.click_count) for row in rows}
+
+    async def get_target(self, db: AsyncSession,
+                         id: Any) -> Optional[UrlTarget]:
+        """
+        Redirect lookup, served from the snapshot or the cache when they
+        are configured. Unknown ids are cached too, as None. Concurrent
+        lookups of the same id share one query when single-flight is
+        configured; with a cache, the cache coalesces its misses through
+        the same flight.
+        """
+        if self._snapshot is not None:
+            target = self._snapshot.get(id)
+            if target is not None:
+                return target
+
+        async def query() -> Optional[UrlTarget]:
+            return (await self.load_targets(db, [id])).get(id)
+
+        if self._cache is not None:
+            return await self._cache.get_or_load(id, query)
+        if self._flight is not None:
+            return await self._flight.do(id, query)
+        return await query()
+
+    async def get_target_by_code(self, db: AsyncSession,
+                                 code: str) -> Optional[UrlTarget]:
+        """
+        Redirect lookup by short code or alias. Codes never move to
+        another row, so code -> id is cached for the full TTL and the rest
+        is the lookup by id.
+        """
+        url_id = MISSING
+        if self._snapshot is not None:
+            found = self._snapshot.code_id(code)
+            if found is not None:
+                url_id = found
+        if url_id is MISSING and self._code_cache is not None:
+            url_id = self._code_cache.get(code)
+        if url_id is MISSING:
+            statement = select(self._model.id).where(
+                self._model.short_url == code)
+            row = await self.read_one(db, statement)
+            url_id = row.id if row else None
+            if self._code_cache is not None:
+                self._code_cache.set(code, url_id)
+        if url_id is None:
+            return None
+        return await self.get_target(db, url_id)
+
+    async def get_targets(self, db: AsyncSession,
+                          ids: list[Any]) -> dict[Any, Optional[UrlTarget]]:
+        """Batch redirect lookup, one cache round trip and one query."""
+        if self._cache is None:
+            found = await self.load_targets(db, ids)
+            return {id: found.get(id) for id in ids}
+        return await self._cache.get_many_or_load(
+            ids, lambda missing: self.load_targets(db, missing))
+
+    async def on_written(self, ids: list[int]) -> None:
+        """
+        Drops cached lookups, on every worker when the cache is shared,
+        and pins reads of `ids` to the primary.
+        """
+        if self._reads is not None:
+            self._reads.mark_written(ids)
+        if self._snapshot is not None:
+            self._snapshot.on_written(ids)
+        if self._cache is not None and ids:
+            await self._cache.invalidate(ids)
+
+    def on_codes_created(self, codes: list[str]) -> None:
+        """Registers new codes and drops their cached misses."""
+        if self._aliases is not None:
+            for code in codes:
+                self._aliases.add(code)
+        if self._code_cache is not None:
+            self._code_cache.invalidate_many(codes)
+
+    def cache_stats(self) -> Optional[dict]:
+        if self._cache is None:
+            return None
+        return self._cache.stats()
+
+    def alias_stats(self) -> Optional[dict]:
+        if self._aliases is None:
+            return None
+        return self._aliases.stats()
+
+    def flight_stats(self) -> Optional[dict[str, int]]:
+        if self._flight is None:
+            return None
+        return self._flight.stats()
+
+    def snapshot_stats(self) -> Optional[dict[str, Any]]:
+        if self._snapshot is None:
+            return None
+        return self._snapshot.stats()
 
     @staticmethod
-    def check_url(url):
-        if not url.startswith("http"):
-            url = "http://" + url
-        if url[-1] != "/":
-            url += "/"
-        return url
+    def check_url(url: str) -> tuple[str, bytes]:
+        """
+        The url as it is stored and redirected to, with http when it has
+        no scheme, and the digest of its canonical form, which only
+        identifies it. Raises ValueError for urls that cannot be parsed.
+        """
+        url = with_scheme(url.strip())
+        return url, url_digest(canonicalize_url(url))
 
-    async def create_multi(self, db: AsyncSession,
-                           objs_in: list[CreateSchemaType]) -> list[ModelType]:
+    def is_short_url_conflict(self, e: exc.IntegrityError) -> bool:
+        return f'"{self._model.__tablename__}_short_url_key"' in str(e.orig)
+
+    def build_objs(self, objs_in: list[CreateSchemaType],
+                   codes: list[tuple[Optional[int], str]]) -> list[ModelType]:
         new_objs = []
-        for obj in objs_in:
-            obj_in_data = obj.dict()
-            long_url = self.check_url(obj_in_data["original_url"])
-            short_url = type_tiny.tinyurl.short(long_url)
+        for obj, (obj_id, short_url) in zip(objs_in, codes):
+            obj_in_data = obj.dict(exclude={"alias"})
             db_obj = self._model(**obj_in_data)
+            if obj_id is not None:
+                db_obj.id = obj_id
             db_obj.short_url = short_url
-            db_obj.original_url = long_url
+            db_obj.original_url, db_obj.url_digest = self.check_url(
+                obj_in_data["original_url"])
             new_objs.append(db_obj)
-        try:
-            db.add_all(new_objs)
+        return new_objs
+
+    def validate_url(self, url: str) -> Optional[str]:
+        if len(url) > self._model.original_url.type.length:
+            return "Url is too long"
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            return "Url has no valid scheme or host"
+        if any(char.isspace() for char in url):
+            return "Url contains whitespace"
+        return None
+
+    def shared(self) -> tuple:
+        """
+        Rows a new url may be deduplicated against: live and without an
+        expiry or a click limit, which one caller must not hand to the
+        next. The predicate of the partial unique index on url_digest.
+        """
+        model = self._model
+        return (model.deleted.isnot(True), model.expires_at.is_(None),
+                model.max_clicks.is_(None))
+
+    def bulk_columns(self) -> tuple:
+        model = self._model
+        return (model.id, model.original_url, model.short_url,
+                model.created_at, model.url_digest)
+
+    async def shared_rows(self, db: AsyncSession,
+                          digests: list[bytes]) -> list:
+        """Shared rows of `digests`, shaped like `bulk_insert_statement`."""
+        statement = select(*self.bulk_columns(),
+                           literal(False).label("created")).where(
+            self._model.url_digest == any_(bindparam(
+                "digests", digests, type_=ARRAY(LargeBinary))),
+            *self.shared())
+        results = await db.execute(statement=statement)
+        rows = results.all()
+        await db.commit()
+        return rows
+
+    def bulk_insert_statement(self, items: list[BulkItem],
+                              codes: list[tuple[Optional[int], str]]):
+        """
+        One statement that inserts the new urls and returns, for every url
+        of the chunk, its row and whether it was created now. The select
+        from the table runs on the statement snapshot, so it only sees rows
+        that existed before. Only items without limits are matched with
+        existing rows.
+        """
+        now = datetime.utcnow()
+        rows = []
+        for item, (obj_id, short_url) in zip(items, codes):
+            row = {"original_url": item.url,
+                   "url_digest": item.digest,
+                   "short_url": short_url,
+                   "created_at": now, "deleted": False,
+                   "expires_at": item.expires_at,
+                   "max_clicks": item.max_clicks}
+            if obj_id is not None:
+                row["id"] = obj_id
+            rows.append(row)
+        columns = self.bulk_columns()
+        inserted = pg_insert(self._model).values(rows) \
+            .on_conflict_do_nothing().returning(*columns).cte("inserted")
+        existing = select(*columns, literal(False).label("created")).where(
+            self._model.url_digest == any_(bindparam(
+                "digests", [item.digest for item in items
+                            if not item.limited],
+                type_=ARRAY(LargeBinary))), *self.shared())
+        return select(inserted, literal(True).label("created")) \
+            .union_all(existing)
+
+    async def insert_chunk(self, db: AsyncSession, items: list[BulkItem]
+                           ) -> dict[BulkItem, dict]:
+        found: dict[BulkItem, dict] = {}
+        pending = items
+        for attempt in range(self._codes.max_attempts):
+            codes = await self._codes.allocate(
+                db, [item.url for item in pending], attempt)
+            statement = self.bulk_insert_statement(pending, codes)
+            results = await db.execute(statement=statement)
+            rows = results.all()
             await db.commit()
-            for obj in new_objs:
-                await db.refresh(obj)
-            return new_objs
-        except exc.IntegrityError:
-            await db.rollback()
-            logger.exception("Item already exists")
-            self._error.detail = "Item already exists"
-            return self._error
+            await self.on_written([row.id for row in rows if row.created])
+            self.on_codes_created(
+                [row.short_url for row in rows if row.created])
+            # new rows are told apart by their code, existing ones by
+            # their digest
+            by_code = {short_url: item
+                       for item, (_, short_url) in zip(pending, codes)}
+            by_digest = {item.digest: item for item in pending
+                         if not item.limited}
+            # a url another transaction committed while the statement ran
+            # conflicts without being returned: its row is visible now
+            returned = {row.url_digest for row in rows}
+            raced = [digest for digest in by_digest
+                     if digest not in returned]
+            if raced:
+                rows += await self.shared_rows(db, raced)
+            for row in rows:
+                item = by_code.get(row.short_url) if row.created \
+                    else by_digest.get(row.url_digest)
+                if item is None:
+                    continue
+                found[item] = {
+                    "status": "created" if row.created else "exists",
+                    "id": row.id,
+                    "original_url": row.original_url,
+                    "short_url": row.short_url,
+                    "created_at": row.created_at,
+                }
+            pending = [item for item in pending if item not in found]
+            if not pending:
+                break
+            logger.warning(f"{len(pending)} short code collisions, "
+                           f"attempt {attempt}")
+        return found
+
+    def prepare_bulk_url(self, obj: CreateSchemaType
+                         ) -> tuple[str, bytes, Optional[str]]:
+        """
+        Url and digest of a bulk item (see `check_url`) and why it is
+        invalid, if it is.
+        """
+        if getattr(obj, "alias", None):
+            return obj.original_url, b"", \
+                "Aliases are accepted for single urls only"
+        url = obj.original_url.strip()
+        if not url:
+            return url, b"", "Url is empty"
+        try:
+            url, digest = self.check_url(url)
+        except ValueError as e:
+            return url, b"", f"Invalid url: {e}"
+        return url, digest, self.validate_url(url)
+
+    async def create_multi(self, db: AsyncSession,
+                           objs_in: list[CreateSchemaType], *,
+                           chunk_size: int = 5000) -> list[dict]:
+        """
+        Bulk create. Inputs are deduplicated in memory by their canonical
+        url and every chunk is written with a single INSERT ... ON
+        CONFLICT. Returns one result per input: created, exists or
+        invalid. Inputs with an expiry or a click limit always get a row
+        of their own.
+        """
+        results: list[Optional[dict]] = [None] * len(objs_in)
+        positions: dict[BulkItem, list[int]] = {}
+        shared: dict[bytes, BulkItem] = {}
+        for index, obj in enumerate(objs_in):
+            url, digest, detail = self.prepare_bulk_url(obj)
+            if detail:
+                results[index] = {"status": "invalid",
+                                  "original_url": obj.original_url,
+                                  "detail": detail}
+                continue
+            item = BulkItem(url, digest, getattr(obj, "expires_at", None),
+                            getattr(obj, "max_clicks", None))
+            if item.limited:
+                item = item._replace(index=index)
+            else:
+                item = shared.setdefault(digest, item)
+            positions.setdefault(item, []).append(index)
+        items = list(positions)
+        for start in range(0, len(items), chunk_size):
+            chunk = items[start:start + chunk_size]
+            try:
+                found = await self.insert_chunk(db, chunk)
+            except ShortCodeError as e:
+                logger.exception(e)
+                found = {}
+                detail = str(e)
+            else:
+                detail = "Short code could not be allocated"
+            for item in chunk:
+                for index in positions[item]:
+                    results[index] = found.get(item) or {
+                        "status": "invalid", "original_url": item.url,
+                        "detail": detail}
+        return results
 
     async def get_multi(
-        self, db: AsyncSession, *, skip=0, limit=100
+        self, db: AsyncSession, *, skip=0, limit=100,
+        after_id: Optional[int] = None
     ) -> list[ModelType]:
-        statement = select(self._model).offset(skip).limit(limit)
-        results = await db.execute(statement=statement)
+        """
+        Page of rows ordered by id, either by offset or, when `after_id`
+        is given, by keyset (rows with id > after_id).
+        """
+        results = await db.execute(
+            statement=self.page_statement(select(self._model), skip=skip,
+                                          limit=limit, after_id=after_id),
+            bind_arguments=self.bind_arguments(listing=True))
         return results.scalars().all()
 
+    async def get_multi_rows(
+        self, db: AsyncSession, fields: Iterable[str], *, skip=0,
+        limit=100, after_id: Optional[int] = None
+    ) -> list[Row]:
+        """
+        The page of `get_multi` as plain rows of the named columns, for
+        callers that serialize them without building ORM instances.
+        """
+        columns = [getattr(self._model, field) for field in fields]
+        results = await db.execute(
+            statement=self.page_statement(select(*columns), skip=skip,
+                                          limit=limit, after_id=after_id),
+            bind_arguments=self.bind_arguments(listing=True))
+        return results.all()
+
+    def page_statement(self, statement: Select, *, skip: int, limit: int,
+                       after_id: Optional[int]) -> Select:
+        statement = statement.order_by(self._model.id).limit(limit)
+        if after_id is not None:
+            return statement.where(self._model.id > after_id)
+        return statement.offset(skip)
+
+    async def claim_click(self, db: AsyncSession, id: int) -> bool:
+        """
+        Counts one click on a link with a click limit, unless the limit is
+        reached. Counted here rather than by the click log, so that
+        concurrent redirects can not overshoot the limit.
+        """
+        model = self._model
+        statement = update(model).where(
+            model.id == id, model.click_count < model.max_clicks,
+        ).values(click_count=model.click_count + 1).returning(
+            model.id).execution_options(synchronize_session=False)
+        results = await db.execute(statement=statement)
+        claimed = results.first() is not None
+        await db.commit()
+        return claimed
+
+    async def get_by_digest(self, db: AsyncSession,
+                            digest: bytes) -> Optional[ModelType]:
+        """Shared row of a url digest, see `check_url` and `shared`."""
+        statement = select(self._model).where(
+            self._model.url_digest == digest, *self.shared())
+        results = await db.execute(statement=statement)
+        return results.scalar_one_or_none()
+
+    async def get_or_create(self, db: AsyncSession, *,
+                            obj_in: CreateSchemaType
+                            ) -> tuple[ModelType, bool]:
+        """
+        Returns the mapping of the canonical url, creating it when there is
+        none yet, and whether it was created. A url created concurrently by
+        another request is looked up again instead of failing. Urls with
+        an expiry or a click limit always get a new mapping.
+        """
+        try:
+            long_url, digest = self.check_url(obj_in.original_url)
+        except ValueError as e:
+            self._error.detail = f"Invalid url: {e}"
+            return self._error, False
+        alias = getattr(obj_in, "alias", None)
+        limited = BulkItem(long_url, digest,
+                           getattr(obj_in, "expires_at", None),
+                           getattr(obj_in, "max_clicks", None)).limited
+        existing = None if limited else await self.get_by_digest(db, digest)
+        if existing is None and alias:
+            detail = await self.check_alias(db, alias)
+            if detail:
+                self._error.detail = detail
+                return self._error, False
+        if existing is None:
+            existing = await self.insert_one(db, obj_in, long_url, alias)
+            if existing is not None:
+                return existing, True
+            if not limited:
+                existing = await self.get_by_digest(db, digest)
+        if existing is None:
+            return self._error, False
+        if alias and existing.short_url != alias:
+            self._error.detail = (f"Url is already shortened as "
+                                  f"{existing.short_url}")
+            return self._error, False
+        return existing, False
+
+    async def is_code_available(self, db: AsyncSession, code: str) -> bool:
+        if self._aliases is not None:
+            return await self._aliases.is_available(db, code)
+        results = await db.execute(select(exists().where(
+            self._model.short_url == code)))
+        return not results.scalar()
+
+    async def check_alias(self, db: AsyncSession,
+                          alias: str) -> Optional[str]:
+        """Why the alias cannot be reserved, None when it is free."""
+        if not await self.is_code_available(db, alias):
+            return f"Alias {alias} is taken"
+        return None
+
+    async def insert_one(self, db: AsyncSession, obj_in: CreateSchemaType,
+                         long_url: str,
+                         alias: Optional[str] = None) -> Optional[ModelType]:
+        """
+        Inserts one url, retrying short code collisions unless the code is
+        a requested alias. Returns None when the insert failed, the reason
+        is left in the error detail.
+        """
+        for attempt in range(self._codes.max_attempts):
+            try:
+                codes = await self._codes.allocate(db, [long_url], attempt)
+            except ShortCodeError as e:
+                logger.exception(e)
+                self._error.detail = str(e)
+                return None
+            if alias:
+                codes = [(obj_id, alias) for obj_id, _ in codes]
+            db_obj, = self.build_objs([obj_in], codes)
+            try:
+                db.add(db_obj)
+                await db.commit()
+                await db.refresh(db_obj)
+                await self.on_written([db_obj.id])
+                self.on_codes_created([db_obj.short_url])
+                return db_obj
+            except exc.IntegrityError as e:
+                await db.rollback()
+                self._error.detail = str(e)
+                if not self.is_short_url_conflict(e):
+                    return None
+                if alias:
+                    self._error.detail = f"Alias {alias} is taken"
+                    return None
+                logger.warning(f"Short code {db_obj.short_url} is taken, "
+                               f"attempt {attempt}")
+        return None
+
     async def create(self, db: AsyncSession, *,
                      obj_in: CreateSchemaType) -> ModelType:
-        obj_in_data = obj_in.dict()
-        long_url = self.check_url(obj_in_data["original_url"])
-        try:
-            short_url = type_tiny.tinyurl.short(long_url)
-        except pyshorteners.exceptions.BadURLException as e:
-            logger.exception(e)
-            self._error.detail = str(e)
-            return self._error
-        db_obj = self._model(**obj_in_data)
-        db_obj.short_url = short_url
-        db_obj.original_url = long_url
-        try:
-            db.add(db_obj)
+        db_obj, _ = await self.get_or_create(db, obj_in=obj_in)
+        return db_obj
+
+    async def expire_links(self, db: AsyncSession, *, now: datetime,
+                           batch_size: int = 10_000) -> list[int]:
+        """
+        Soft-deletes up to `batch_size` links whose expiry has passed and
+        returns their ids. Rows locked by a concurrent reaper are skipped.
+        """
+        model = self._model
+        ids = select(model.id).where(
+            model.expires_at <= now, model.deleted.isnot(True),
+        ).order_by(model.expires_at).limit(batch_size).with_for_update(
+            skip_locked=True).scalar_subquery()
+        statement = update(model).where(model.id.in_(ids)).values(
+            deleted=True, changed_at=now).returning(
+            model.id).execution_options(synchronize_session=False)
+        results = await db.execute(statement=statement)
+        expired = results.scalars().all()
+        await db.commit()
+        await self.on_written(expired)
+        return expired
+
+    async def set_deleted_many(self, db: AsyncSession, ids: list[int], *,
+                               deleted: bool = True,
+                               chunk_size: int = 10_000) -> list[int]:
+        """
+        Soft-deletes (or restores) urls with one
+        UPDATE ... WHERE id = ANY(...) RETURNING id per chunk. Returns the
+        ids that were updated; caches are invalidated once per chunk. A
+        url is not restored while another shared row has its digest (see
+        `shared`), only one of them may be live.
+        """
+        model = self._model
+        ids = list(dict.fromkeys(ids))
+        updated: list[int] = []
+        for start in range(0, len(ids), chunk_size):
+            chunk = bindparam("ids", ids[start:start + chunk_size],
+                              type_=ARRAY(Integer))
+            statement = update(model).where(model.id == any_(chunk))
+            if not deleted:
+                statement = statement.where(self.restorable(chunk))
+            statement = statement.values(
+                deleted=deleted, changed_at=datetime.utcnow()).returning(
+                model.id).execution_options(
+                synchronize_session=False)
+            results = await db.execute(statement=statement)
+            found = results.scalars().all()
             await db.commit()
-            await db.refresh(db_obj)
-            return db_obj
-        except exc.IntegrityError as e:
-            await db.rollback()
-            logger.warning(f"Item with url "
-                           f"{db_obj.original_url} already exists")
-            self._error.detail = str(e)
-            return self._error
+            await self.on_written(found)
+            updated.extend(found)
+        return updated
+
+    def restorable(self, ids: Any) -> Any:
+        """
+        Rows that can be restored without a second shared row per digest:
+        those with limits or already live, else the first of `ids` with a
+        digest that no live row has.
+        """
+        model = self._model
+        other = aliased(model)
+        same = (other.url_digest == model.url_digest,
+                other.expires_at.is_(None), other.max_clicks.is_(None))
+        live = exists().where(*same, other.deleted.isnot(True),
+                              other.id != model.id)
+        first = select(func.min(other.id)).where(
+            *same, other.id == any_(ids)).scalar_subquery()
+        return or_(model.expires_at.isnot(None), model.max_clicks.isnot(None),
+                   model.deleted.isnot(True),
+                   and_(~live, model.id == first))
+
+    def export_statement(self, fields: Iterable[str], *,
+                         created_from: Optional[datetime] = None,
+                         created_to: Optional[datetime] = None,
+                         deleted: Optional[bool] = None,
+                         ids: Optional[list[int]] = None) -> Select:
+        """Named columns of the matching urls, in id order."""
+        model = self._model
+        statement = select(*(getattr(model, field) for field in fields))
+        statement = self.filter_range(statement, model.created_at,
+                                      created_from, created_to)
+        if deleted is not None:
+            statement = statement.where(
+                model.deleted.is_(True) if deleted
+                else model.deleted.isnot(True))
+        if ids:
+            statement = statement.where(model.id == any_(
+                bindparam("ids", list(set(ids)), type_=ARRAY(Integer))))
+        return statement.order_by(model.id)
+
+    async def changed_since(self, db: AsyncSession,
+                            since: datetime) -> list[tuple[int, datetime]]:
+        """(id, changed_at) of urls soft-deleted or restored since."""
+        model = self._model
+        results = await db.execute(
+            select(model.id, model.changed_at).where(
+                model.changed_at >= since))
+        return [tuple(row) for row in results.all()]
+
+    def snapshot_sources(self, db: AsyncSession, *, chunk_size: int = 10_000
+                         ) -> tuple[AsyncIterator[list], AsyncIterator[list]]:
+        """
+        The inputs of `write_snapshot`: redirect columns in id order and
+        codes in bytewise order, streamed one after the other.
+        """
+        model = self._model
+        rows = select(model.id, model.original_url, model.deleted,
+                      model.expires_at, model.max_clicks).order_by(model.id)
+        codes = select(model.short_url, model.id).order_by(
+            model.short_url.collate("C"))
+        return (self.stream_rows(db, rows, chunk_size=chunk_size),
+                self.stream_rows(db, codes, chunk_size=chunk_size))
 
     async def update_deleted_field(
         self,
@@ -135,37 +788,161 @@ class RepositoryDB(Repository, Generic[ModelType, CreateSchemaType,
         *,
         url_id: int
     ) -> ModelType:
-        statement = update(self._model).where(self._model.id == url_id).values(deleted=True)
+        statement = update(self._model).where(self._model.id == url_id).values(
+            deleted=True, changed_at=datetime.utcnow())
         await db.execute(statement=statement)
         await db.commit()
+        await self.on_written([url_id])
 
 
 class RepositoryUsage(Repository, Generic[ModelType, CreateSchemaType,
                       FullSchemaType]):
-    def __init__(self, model: Type[ModelType]):
+    def __init__(self, model: Type[ModelType],
+                 counted: Optional[Type[Base]] = None,
+                 reads: Optional[ReadRouter] = None,
+                 write_lock: Optional[int] = None):
+        """
+        `counted` is the model whose `click_count` column is kept in step
+        with the rows written here, so totals never need a COUNT(*).
+        Writes hold the advisory lock `write_lock` shared until they
+        commit, so that the rollup can tell when every id handed out so
+        far is committed.
+        """
         self._model = model
+        self._counted = counted
+        self._reads = reads
+        self._write_lock = write_lock
+
+    async def lock_writes(self, db: AsyncSession) -> None:
+        if self._write_lock is not None:
+            await db.execute(select(
+                func.pg_advisory_xact_lock_shared(self._write_lock)))
+
+    def export_statement(self, fields: Iterable[str], *,
+                         used_from: Optional[datetime] = None,
+                         used_to: Optional[datetime] = None,
+                         url_ids: Optional[list[int]] = None) -> Select:
+        """Named columns of the matching usage rows, in id order."""
+        model = self._model
+        statement = select(*(getattr(model, field) for field in fields))
+        statement = self.filter_range(statement, model.used_at,
+                                      used_from, used_to)
+        if url_ids:
+            statement = statement.where(model.url_id == any_(
+                bindparam("url_ids", list(set(url_ids)),
+                          type_=ARRAY(Integer))))
+        return statement.order_by(model.id)
+
+    async def increment_counts(self, db: AsyncSession,
+                               counts: dict[int, int]) -> None:
+        if self._counted is None or not counts:
+            return
+        table = self._counted.__table__
+        # limited links are counted when the redirect is served
+        statement = update(table).where(
+            table.c.id == bindparam("counted_id"),
+            table.c.max_clicks.is_(None)).values(
+            click_count=table.c.click_count + bindparam("clicks"))
+        # sorted so that concurrent batches lock rows in the same order
+        await db.execute(statement, [
+            {"counted_id": url_id, "clicks": clicks}
+            for url_id, clicks in sorted(counts.items())
+        ])
 
     async def create(self, db: AsyncSession, *,
                      obj_in: CreateSchemaType) -> ModelType:
         obj_in_data = obj_in.dict()
         db_obj = self._model(**obj_in_data)
+        await self.lock_writes(db)
         db.add(db_obj)
+        await self.increment_counts(db, {obj_in_data["url_id"]: 1})
         await db.commit()
         await db.refresh(db_obj)
         return db_obj
 
+    async def create_many(self, db: AsyncSession, *,
+                          objs_in: list[dict]) -> int:
+        if not objs_in:
+            return 0
+        await self.lock_writes(db)
+        statement = insert(self._model).values(objs_in)
+        await db.execute(statement=statement)
+        counts: dict[int, int] = {}
+        for obj in objs_in:
+            if obj["url_id"] is not None:
+                counts[obj["url_id"]] = counts.get(obj["url_id"], 0) + 1
+        await self.increment_counts(db, counts)
+        await db.commit()
+        return len(objs_in)
+
+    async def reconcile_counts(self, db: AsyncSession, *, start_id: int,
+                               end_id: int, after_usage_id: int = 0,
+                               rolled_up: Optional[Any] = None) -> int:
+        """
+        Recomputes click_count from the usage rows for counted ids in
+        [start_id, end_id). Returns the number of corrected rows.
+
+        When raw rows up to `after_usage_id` may have been pruned,
+        `rolled_up(url_id_column)` gives the clicks already counted for them.
+        """
+        table = self._counted.__table__
+        actual = func.coalesce(
+            select(func.count()).where(
+                self._model.url_id == table.c.id,
+                self._model.id > after_usage_id,
+            ).scalar_subquery(), 0)
+        if rolled_up is not None:
+            actual = actual + rolled_up(table.c.id)
+        # the counters of limited links are authoritative, usage rows
+        # dropped by a full click log must not hand out extra clicks
+        statement = update(table).where(
+            table.c.id >= start_id, table.c.id < end_id,
+            table.c.max_clicks.is_(None),
+            table.c.click_count != actual,
+        ).values(click_count=actual)
+        results = await db.execute(statement=statement)
+        await db.commit()
+        return results.rowcount
+
+    async def id_range(self, db: AsyncSession) -> tuple[int, int]:
+        table = self._counted.__table__
+        statement = select(func.min(table.c.id), func.max(table.c.id))
+        results = await db.execute(statement=statement)
+        low, high = results.one()
+        return low or 0, high or 0
+
     async def count(self, db: AsyncSession, *, max_result=10, offset=0,
                     full_info=False,
+                    after: Optional[tuple[datetime, int]] = None,
                     obj_id: int) -> int | list[ModelType]:
         if full_info:
-            statement = select(self._model.url_id, self._model.used_at,
+            statement = select(self._model.id, self._model.url_id,
+                               self._model.used_at,
                                self._model.client_host,
-                               self._model.client_port
-                               ).where(self._model.url_id == obj_id).offset(
-                offset).limit(max_result)
+                               self._model.client_port,
+                               self._model.referrer
+                               ).where(self._model.url_id == obj_id).order_by(
+                self._model.used_at, self._model.id).limit(max_result)
+            if after is not None:
+                # the plain bound lets the planner skip older partitions,
+                # it cannot see through the row comparison
+                statement = statement.where(
+                    self._model.used_at >= after[0],
+                    tuple_(self._model.used_at, self._model.id)
+                    > tuple_(*after))
+            else:
+                statement = statement.offset(offset)
 
-            results = await db.execute(statement=statement)
+            results = await db.execute(
+                statement=statement, bind_arguments=self.bind_arguments())
             return results.all()
+        if self._counted is not None:
+            statement = select(self._counted.click_count).where(
+                self._counted.id == obj_id)
+            results = await db.execute(
+                statement=statement, bind_arguments=self.bind_arguments())
+            return results.scalar_one_or_none() or 0
         statement = select(self._model).where(self._model.url_id == obj_id).with_only_columns([func.count()])
-        results = await db.execute(statement=statement)
+        results = await db.execute(statement=statement,
+                                   bind_arguments=self.bind_arguments())
         return results.scalar_one()
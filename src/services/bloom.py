@@ -0,0 +1,36 @@
+import hashlib
+import math
+
+
+class BloomFilter:
+    """
+    Set membership with false positives but no false negatives, sized for
+    `capacity` items at `error_rate`. Positions come from double hashing
+    one 128-bit blake2b digest.
+    """
+
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.01):
+        self.size = max(8, math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str) -> list[int]:
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+    def clear(self) -> None:
+        self._bits = bytearray(len(self._bits))
+        self.count = 0
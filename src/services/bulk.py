@@ -0,0 +1,63 @@
+from typing import Any, AsyncIterator
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.schemas.shorturl import MAX_ID
+from src.services.importer import iter_lines
+
+
+class BulkStatusUpdater:
+    """
+    Soft-deletes or restores urls in bulk, from an id list or from a
+    streamed file with one id per line, `chunk_size` ids per UPDATE.
+    Reports the ids that do not exist and the lines that are not ids
+    (including numbers out of the id range).
+    """
+
+    def __init__(self, repository: Any, *, chunk_size: int = 10_000,
+                 max_line: int = 64):
+        self._repository = repository
+        self._chunk_size = chunk_size
+        self._max_line = max_line
+
+    async def _apply(self, db: AsyncSession, ids: list[int], deleted: bool,
+                     summary: dict) -> None:
+        found = set(await self._repository.set_deleted_many(
+            db, ids, deleted=deleted, chunk_size=self._chunk_size))
+        summary["requested"] += len(ids)
+        summary["updated"] += len(found)
+        summary["not_found"].extend(
+            url_id for url_id in dict.fromkeys(ids) if url_id not in found)
+
+    def new_summary(self, deleted: bool) -> dict:
+        return {"deleted": deleted, "requested": 0, "updated": 0,
+                "not_found": [], "invalid_lines": []}
+
+    async def run(self, db: AsyncSession, ids: list[int], *,
+                  deleted: bool = True) -> dict:
+        summary = self.new_summary(deleted)
+        await self._apply(db, ids, deleted, summary)
+        return summary
+
+    async def run_stream(self, db: AsyncSession,
+                         stream: AsyncIterator[bytes], *,
+                         deleted: bool = True) -> dict:
+        summary = self.new_summary(deleted)
+        chunk: list[int] = []
+        line_no = 0
+        async for line in iter_lines(stream, self._max_line):
+            line_no += 1
+            line = line.strip()
+            if not line:
+                continue
+            if not line.isdigit() or len(line) > self._max_line or \
+                    not 1 <= int(line) <= MAX_ID:
+                summary["invalid_lines"].append(line_no)
+                continue
+            chunk.append(int(line))
+            if len(chunk) >= self._chunk_size:
+                await self._apply(db, chunk, deleted, summary)
+                chunk = []
+        if chunk:
+            await self._apply(db, chunk, deleted, summary)
+        return summary
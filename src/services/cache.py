@@ -0,0 +1,454 @@
+import asyncio
+import logging.config
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Iterable, Optional
+
+import orjson
+
+from src.core.logger import LOGGING
+from src.services.singleflight import SingleFlight
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger(__name__)
+
+# returned by `get` when the key is not cached (None is a cached 404)
+MISSING = object()
+
+# rough per-entry overhead of the OrderedDict node, key and tuple
+ENTRY_OVERHEAD = 96
+
+
+class LRUCache:
+    """
+    Bounded in-process cache with LRU eviction and per-entry TTL.
+
+    A None value is a negative entry (the key is known not to exist) and
+    lives for `negative_ttl` seconds instead of `ttl`. The cache is bounded
+    both by entry count and by the approximate number of bytes stored.
+    """
+
+    def __init__(self, *, max_entries: int = 100_000,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 ttl: float = 300, negative_ttl: float = 5):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # key -> (expires_at, size, value)
+        self._data: OrderedDict[Hashable, tuple[float, int, Any]] = \
+            OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+        expires_at, size, value = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return MISSING
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any,
+            size: Optional[int] = None) -> None:
+        if size is None:
+            size = ENTRY_OVERHEAD + len(str(value))
+        if size > self.max_bytes:
+            return
+        ttl = self.negative_ttl if value is None else self.ttl
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (time.monotonic() + ttl, size, value)
+        self._bytes += size
+        while (len(self._data) > self.max_entries
+               or self._bytes > self.max_bytes):
+            _, (_, evicted_size, _) = self._data.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def _remove(self, key: Hashable) -> None:
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def invalidate(self, key: Hashable) -> None:
+        if key in self._data:
+            self._remove(key)
+            self.invalidations += 1
+
+    def invalidate_many(self, keys: Iterable[Hashable]) -> None:
+        for key in keys:
+            self.invalidate(key)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+class CacheBackend:
+    """Shared cache reachable from every worker, keys are url ids."""
+
+    async def get_many(self, keys: list[Hashable]) -> dict[Hashable, Any]:
+        """Cached values by key, keys that are not cached are left out."""
+        found, _ = await self.lookup(keys)
+        return found
+
+    async def lookup(self, keys: list[Hashable]
+                     ) -> tuple[dict[Hashable, Any], dict[Hashable, Any]]:
+        """
+        Cached values as in `get_many`, and the current version of every
+        key. Versions are handed back to `set_many`, which skips keys
+        deleted since.
+        """
+        raise NotImplementedError
+
+    async def set_many(self, items: dict[Hashable, Any],
+                       versions: Optional[dict[Hashable, Any]] = None
+                       ) -> None:
+        raise NotImplementedError
+
+    async def delete_many(self, keys: list[Hashable]) -> None:
+        """Deletes keys and tells every worker to drop them locally."""
+        raise NotImplementedError
+
+    async def listen(self, on_invalidate: Callable[[list], None]) -> None:
+        """Runs until cancelled, passing invalidated keys to the callback."""
+        raise NotImplementedError
+
+
+class MemoryCacheBackend(CacheBackend):
+    """Backend over an LRUCache, shared only by the current process."""
+
+    def __init__(self, cache: LRUCache):
+        self._cache = cache
+
+    async def lookup(self, keys: list[Hashable]
+                     ) -> tuple[dict[Hashable, Any], dict[Hashable, Any]]:
+        found = {}
+        for key in keys:
+            value = self._cache.get(key)
+            if value is not MISSING:
+                found[key] = value
+        # the caller's tombstones already cover this process
+        return found, {}
+
+    async def set_many(self, items: dict[Hashable, Any],
+                       versions: Optional[dict[Hashable, Any]] = None
+                       ) -> None:
+        for key, value in items.items():
+            self._cache.set(key, value)
+
+    async def delete_many(self, keys: list[Hashable]) -> None:
+        self._cache.invalidate_many(keys)
+
+    async def listen(self, on_invalidate: Callable[[list], None]) -> None:
+        await asyncio.Event().wait()
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Backend for any server speaking the Redis protocol. Lookups are one
+    MGET, writes and deletes are pipelined, and deletes are announced on
+    a pub/sub channel so that every worker drops its local copy.
+
+    Every delete also bumps a per-key generation, read along with the
+    value. A value loaded under an older generation is not stored, so a
+    lookup that raced a delete cannot put the old target back.
+    """
+
+    def __init__(self, client: Any, *, prefix: str = "url:",
+                 channel: str = "url-invalidate", ttl: float = 300,
+                 negative_ttl: float = 5,
+                 encode: Callable[[Any], Any] = lambda value: value,
+                 decode: Callable[[Any], Any] = lambda value: value):
+        self._client = client
+        self._prefix = prefix
+        self._channel = channel
+        self._ttl = max(1, int(ttl))
+        self._negative_ttl = max(1, int(negative_ttl))
+        self._encode = encode
+        self._decode = decode
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs: Any) -> 'RedisCacheBackend':
+        import redis.asyncio
+        return cls(redis.asyncio.from_url(url), **kwargs)
+
+    def _key(self, key: Hashable) -> str:
+        return f"{self._prefix}{key}"
+
+    def _generation(self, key: Hashable) -> str:
+        return f"{self._prefix}gen:{key}"
+
+    async def lookup(self, keys: list[Hashable]
+                     ) -> tuple[dict[Hashable, Any], dict[Hashable, Any]]:
+        if not keys:
+            return {}, {}
+        values = await self._client.mget(
+            [self._key(key) for key in keys]
+            + [self._generation(key) for key in keys])
+        found = {}
+        for key, value in zip(keys, values):
+            if value is not None:
+                value = orjson.loads(value)
+                found[key] = None if value is None else self._decode(value)
+        return found, dict(zip(keys, values[len(keys):]))
+
+    def _set(self, pipe: Any, items: dict[Hashable, Any]) -> None:
+        for key, value in items.items():
+            pipe.set(self._key(key),
+                     orjson.dumps(None if value is None
+                                  else self._encode(value)),
+                     ex=self._negative_ttl if value is None else self._ttl)
+
+    async def set_many(self, items: dict[Hashable, Any],
+                       versions: Optional[dict[Hashable, Any]] = None
+                       ) -> None:
+        if not items:
+            return
+        if versions is None:
+            async with self._client.pipeline(transaction=False) as pipe:
+                self._set(pipe, items)
+                await pipe.execute()
+            return
+        generations = [self._generation(key) for key in items]
+        async with self._client.pipeline(transaction=True) as pipe:
+            await pipe.watch(*generations)
+            current = await pipe.mget(generations)
+            items = {key: value for (key, value), generation
+                     in zip(items.items(), current)
+                     if generation == versions.get(key)}
+            if not items:
+                await pipe.reset()
+                return
+            pipe.multi()
+            self._set(pipe, items)
+            from redis.exceptions import WatchError
+            try:
+                await pipe.execute()
+            except WatchError:
+                # deleted while storing, the next lookup loads it again
+                pass
+
+    async def delete_many(self, keys: list[Hashable]) -> None:
+        if not keys:
+            return
+        async with self._client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.incr(self._generation(key))
+                pipe.expire(self._generation(key), self._ttl)
+            pipe.delete(*(self._key(key) for key in keys))
+            pipe.publish(self._channel, orjson.dumps(list(keys)))
+            await pipe.execute()
+
+    async def listen(self, on_invalidate: Callable[[list], None]) -> None:
+        pubsub = self._client.pubsub()
+        await pubsub.subscribe(self._channel)
+        try:
+            while True:
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=1.0)
+                if message and message["type"] == "message":
+                    on_invalidate(orjson.loads(message["data"]))
+        finally:
+            await pubsub.unsubscribe(self._channel)
+            await pubsub.close()
+
+
+class TieredCache:
+    """
+    In-process LRU in front of an optional shared backend.
+
+    Misses on both levels are coalesced per key through `flight`, so a hot
+    key is loaded once per worker however many requests ask for it at the
+    same time, and once per cluster when the backend is shared. Loaded
+    values that `cacheable` rejects are returned without being stored.
+
+    A key invalidated while it was being loaded is returned but not
+    stored: every invalidation bumps an epoch and leaves a tombstone
+    that loads started before it check. Tombstones are dropped once no
+    load is in flight. `on_drop` is called with every batch of dropped
+    keys, local or announced by another worker.
+    """
+
+    def __init__(self, local: Optional[LRUCache] = None,
+                 remote: Optional[CacheBackend] = None,
+                 cacheable: Callable[[Any], bool] = lambda value: True,
+                 on_drop: Optional[Callable[[list], None]] = None,
+                 flight: Optional[SingleFlight] = None):
+        self.local = local
+        self.remote = remote
+        self._cacheable = cacheable
+        self._on_drop = on_drop
+        self._flight = flight or SingleFlight()
+        self._listener: Optional[asyncio.Task] = None
+        self._epoch = 0
+        self._tombstones: dict[Hashable, int] = {}
+        self._loading = 0
+        self.remote_hits = 0
+        self.remote_misses = 0
+        self.loads = 0
+
+    async def get_or_load(self, key: Hashable,
+                          loader: Callable[[], Awaitable[Any]]) -> Any:
+        if self.local is not None:
+            value = self.local.get(key)
+            if value is not MISSING:
+                return value
+        return await self._flight.do(key, lambda: self._load(key, loader))
+
+    def _begin(self) -> int:
+        self._loading += 1
+        return self._epoch
+
+    def _end(self) -> None:
+        self._loading -= 1
+        if not self._loading:
+            self._tombstones.clear()
+
+    def _stale(self, key: Hashable, epoch: int) -> bool:
+        """Whether `key` was invalidated after a load began at `epoch`."""
+        return self._tombstones.get(key, -1) > epoch
+
+    async def _load(self, key: Hashable,
+                    loader: Callable[[], Awaitable[Any]]) -> Any:
+        epoch = self._begin()
+        try:
+            versions = None
+            if self.remote is not None:
+                found, versions = await self.remote.lookup([key])
+                if key in found:
+                    self.remote_hits += 1
+                    if not self._stale(key, epoch):
+                        self._set_local(key, found[key])
+                    return found[key]
+                self.remote_misses += 1
+            value = await loader()
+            self.loads += 1
+            await self._store({key: value}, epoch, versions)
+            return value
+        finally:
+            self._end()
+
+    async def get_many_or_load(
+            self, keys: list[Hashable],
+            loader: Callable[[list], Awaitable[dict]]) -> dict:
+        """Batch lookup: local, then one backend multi-get, then loader."""
+        found: dict[Hashable, Any] = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(key) if self.local is not None \
+                else MISSING
+            if value is MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        if not missing:
+            return found
+        epoch = self._begin()
+        try:
+            versions = None
+            if self.remote is not None:
+                remote, versions = await self.remote.lookup(missing)
+                self.remote_hits += len(remote)
+                self.remote_misses += len(missing) - len(remote)
+                for key, value in remote.items():
+                    if not self._stale(key, epoch):
+                        self._set_local(key, value)
+                found.update(remote)
+                missing = [key for key in missing if key not in remote]
+            if missing:
+                loaded = await loader(missing)
+                self.loads += len(missing)
+                loaded = {key: loaded.get(key) for key in missing}
+                found.update(loaded)
+                await self._store(loaded, epoch, versions)
+            return found
+        finally:
+            self._end()
+
+    async def _store(self, loaded: dict[Hashable, Any], epoch: int,
+                     versions: Optional[dict[Hashable, Any]]) -> None:
+        loaded = {key: value for key, value in loaded.items()
+                  if self._cacheable(value) and not self._stale(key, epoch)}
+        for key, value in loaded.items():
+            self._set_local(key, value)
+        if self.remote is not None and loaded:
+            await self.remote.set_many(loaded, versions)
+
+    def _set_local(self, key: Hashable, value: Any) -> None:
+        if self.local is not None:
+            self.local.set(key, value)
+
+    def drop_local(self, keys: list) -> None:
+        self._epoch += 1
+        if self._loading:
+            for key in keys:
+                self._tombstones[key] = self._epoch
+        if self.local is not None:
+            self.local.invalidate_many(keys)
+        if self._on_drop is not None:
+            self._on_drop(keys)
+
+    async def invalidate(self, keys: list[Hashable]) -> None:
+        self.drop_local(keys)
+        if self.remote is not None:
+            await self.remote.delete_many(keys)
+
+    async def start(self) -> None:
+        if self.remote is not None and self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                await self.remote.listen(self.drop_local)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Cache invalidation listener failed")
+                await asyncio.sleep(1)
+
+    async def stop(self) -> None:
+        if self._listener is None:
+            return
+        self._listener.cancel()
+        try:
+            await self._listener
+        except asyncio.CancelledError:
+            pass
+        self._listener = None
+
+    def stats(self) -> dict:
+        return {
+            "local": self.local.stats() if self.local is not None else None,
+            "remote": {
+                "hits": self.remote_hits,
+                "misses": self.remote_misses,
+            } if self.remote is not None else None,
+            "loads": self.loads,
+            "single_flight": self._flight.stats(),
+        }
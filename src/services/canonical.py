@@ -0,0 +1,91 @@
+import hashlib
+import re
+from urllib.parse import quote, urlsplit, urlunsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+UNRESERVED = frozenset(
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~")
+SCHEME_RE = re.compile(r"^[a-zA-Z][a-zA-Z0-9+.-]*://")
+ESCAPE_RE = re.compile(r"%([0-9A-Fa-f]{2})")
+
+# characters left as they are in each component (RFC 3986, section 3)
+PATH_SAFE = "/:@!$&'()*+,;=%"
+QUERY_SAFE = "/?:@!$'()*+,;=%"
+FRAGMENT_SAFE = "/?:@!$&'()*+,;=%"
+
+
+def normalize_escapes(value: str, safe: str) -> str:
+    """
+    Decodes percent-escapes of unreserved characters, upper-cases the hex
+    digits of the others and escapes characters that are not allowed.
+    """
+    def unescape(match: re.Match) -> str:
+        char = chr(int(match.group(1), 16))
+        return char if char in UNRESERVED else f"%{match.group(1).upper()}"
+
+    return quote(ESCAPE_RE.sub(unescape, value), safe=safe)
+
+
+def remove_dot_segments(path: str) -> str:
+    """RFC 3986, section 5.2.4."""
+    output: list[str] = []
+    for segment in path.split("/")[1:]:
+        if segment == "..":
+            if output:
+                output.pop()
+        elif segment != ".":
+            output.append(segment)
+    if path.rsplit("/", 1)[-1] in (".", ".."):
+        output.append("")
+    return "/" + "/".join(output)
+
+
+def with_scheme(url: str) -> str:
+    """The url with http as its scheme when it has none."""
+    return url if SCHEME_RE.match(url) else "http://" + url
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Canonical form of a url, used as its identity when deduplicating. It
+    is only digested, urls are stored and redirected to as submitted.
+
+    The scheme defaults to http; scheme and host are lower-cased, default
+    ports dropped, dot segments removed, percent-encoding normalized and
+    query parameters sorted by name (values of a repeated name keep their
+    order). An empty path becomes "/". The fragment is kept, an empty one
+    is dropped. Raises ValueError for urls that cannot be parsed.
+    """
+    parts = urlsplit(with_scheme(url.strip()))
+    scheme = parts.scheme.lower()
+    host = parts.hostname or ""
+    try:
+        host = host.encode("idna").decode("ascii")
+    except UnicodeError:
+        pass
+    if ":" in host:
+        host = f"[{host}]"
+    port = parts.port
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+    userinfo = parts.netloc.rpartition("@")[0]
+    if userinfo:
+        host = f"{userinfo}@{host}"
+
+    path = remove_dot_segments(normalize_escapes(parts.path or "/",
+                                                 PATH_SAFE))
+
+    params = [normalize_escapes(param, QUERY_SAFE)
+              for param in parts.query.split("&") if param]
+    params.sort(key=lambda param: param.split("=", 1)[0])
+    query = "&".join(params)
+    fragment = normalize_escapes(parts.fragment, FRAGMENT_SAFE)
+    return urlunsplit((scheme, host, path, query, fragment))
+
+
+def url_digest(url: str) -> bytes:
+    """
+    16-byte identity of a canonical url, stored in the unique index in
+    place of the url. MD5, so that Postgres computes the same value.
+    """
+    return hashlib.md5(url.encode(), usedforsecurity=False).digest()
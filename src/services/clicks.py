@@ -0,0 +1,162 @@
+import asyncio
+import logging.config
+import time
+from datetime import datetime
+from typing import Any, Callable, Optional
+
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core.logger import LOGGING
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger(__name__)
+
+# queued by `stop`, the task writes its batch and exits when it gets it
+STOP = object()
+
+
+class ClickLogger:
+    """
+    Buffers click events in a bounded queue and writes them with one
+    multi-row INSERT per batch from a background task.
+
+    A batch is flushed when it reaches `batch_size` events or when
+    `flush_interval` seconds have passed since its first event. When the
+    queue is full `record` waits up to `put_timeout` seconds for room and
+    then drops the event. While the logger is not running events are
+    written inline through the repository, as before. `on_write` is
+    called with the seconds and rows of every insert.
+    """
+
+    def __init__(self, repository: Any, session_factory: Any, *,
+                 max_queue: int = 100_000, batch_size: int = 1000,
+                 flush_interval: float = 1.0, put_timeout: float = 0,
+                 on_write: Optional[Callable[[float, int], None]] = None):
+        self._repository = repository
+        self._on_write = on_write
+        self._session_factory = session_factory
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._put_timeout = put_timeout
+        self._max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._batch: list[dict] = []
+        self.queued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self._max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stop the background task and write everything still queued. The
+        task is not cancelled, so a batch being written is never retried.
+        """
+        if self._task is None:
+            return
+        if not self._task.done():
+            await self._queue.put(STOP)
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        while not self._queue.empty():
+            event = self._queue.get_nowait()
+            if event is not STOP:
+                self._batch.append(event)
+            if len(self._batch) >= self._batch_size:
+                await self._write()
+        await self._write()
+
+    async def record(self, db: AsyncSession, obj_in: BaseModel) -> bool:
+        if not self.running:
+            started = time.perf_counter()
+            await self._repository.create(db=db, obj_in=obj_in)
+            if self._on_write is not None:
+                self._on_write(time.perf_counter() - started, 1)
+            return True
+        event = obj_in.dict()
+        event["used_at"] = datetime.utcnow()
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            if not self._put_timeout:
+                self.dropped += 1
+                return False
+            try:
+                await asyncio.wait_for(self._queue.put(event),
+                                       self._put_timeout)
+            except asyncio.TimeoutError:
+                self.dropped += 1
+                return False
+        self.queued += 1
+        return True
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            event = await self._queue.get()
+            if event is STOP:
+                break
+            self._batch.append(event)
+            deadline = loop.time() + self._flush_interval
+            while len(self._batch) < self._batch_size:
+                if self._queue.empty():
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        event = await asyncio.wait_for(self._queue.get(),
+                                                       remaining)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    event = self._queue.get_nowait()
+                if event is STOP:
+                    stopping = True
+                    break
+                self._batch.append(event)
+            await self._write()
+
+    async def _write(self) -> None:
+        if not self._batch:
+            return
+        batch = self._batch
+        try:
+            started = time.perf_counter()
+            async with self._session_factory() as db:
+                await self._repository.create_many(db=db, objs_in=batch)
+            if self._on_write is not None:
+                self._on_write(time.perf_counter() - started, len(batch))
+            self.written += len(batch)
+            self.batches += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception(f"Failed to write {len(batch)} click events")
+            self.failed += len(batch)
+        self._batch = []
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "running": self.running,
+            "pending": self._queue.qsize() if self._queue else 0,
+            "queued": self.queued,
+            "dropped": self.dropped,
+            "written": self.written,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
@@ -0,0 +1,34 @@
+import base64
+import binascii
+from typing import Any
+
+import orjson
+
+
+def encode_cursor(*values: Any) -> str:
+    """Opaque, url-safe page cursor built from the last row's sort key."""
+    return base64.urlsafe_b64encode(orjson.dumps(values)).decode().rstrip("=")
+
+
+# ints of a cursor are ids, at most a bigint
+MAX_VALUE = 2 ** 63 - 1
+
+
+def decode_cursor(cursor: str, *types: type) -> list[Any]:
+    """
+    Values of a cursor, checked against the expected `types`; ints must
+    be non-negative ids.
+    """
+    try:
+        values = orjson.loads(
+            base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, orjson.JSONDecodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {e}") from e
+    if not isinstance(values, list) or len(values) != len(types):
+        raise ValueError("Invalid cursor")
+    for value, expected in zip(values, types):
+        # bool is an int subclass
+        if type(value) is not expected or \
+                expected is int and not 0 <= value <= MAX_VALUE:
+            raise ValueError("Invalid cursor")
+    return values
@@ -0,0 +1,124 @@
+import csv
+import logging.config
+from typing import Any, AsyncIterator, Optional
+
+import orjson
+
+from src.core.logger import LOGGING
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger(__name__)
+
+
+async def iter_lines(stream: AsyncIterator[bytes],
+                     max_line: int) -> AsyncIterator[bytes]:
+    """
+    Lines of a streamed body. Lines over `max_line` are cut off: the
+    first part is yielded (to be reported as invalid) and the rest of the
+    line is dropped.
+    """
+    tail = b""
+    skipping = False
+    async for chunk in stream:
+        if skipping:
+            end = chunk.find(b"\n")
+            if end < 0:
+                continue
+            chunk = chunk[end + 1:]
+            skipping = False
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()
+        if len(tail) > max_line:
+            lines.append(tail)
+            tail = b""
+            skipping = True
+        for line in lines:
+            yield line
+    if tail:
+        yield tail
+
+
+class BulkImporter:
+    """
+    Streams an NDJSON or CSV upload into the repository in fixed-size
+    chunks and yields one NDJSON result line per input line, followed by
+    a summary line. Only one chunk is held in memory at a time.
+
+    NDJSON lines are `{"original_url": ...}` objects or bare JSON strings.
+    CSV rows take the `original_url` column when the first row is a header
+    with that name, otherwise the first column.
+    """
+
+    def __init__(self, repository: Any, schema: Any, *,
+                 chunk_size: int = 5000, max_line: int = 64 * 1024):
+        self._repository = repository
+        self._schema = schema
+        self._chunk_size = chunk_size
+        self._max_line = max_line
+
+    def parse_ndjson(self, line: bytes) -> str:
+        value = orjson.loads(line)
+        if isinstance(value, dict):
+            value = value.get("original_url")
+        if not isinstance(value, str):
+            raise ValueError("Expected a string or an object "
+                             "with original_url")
+        return value
+
+    async def iter_urls(
+            self, stream: AsyncIterator[bytes],
+            fmt: str) -> AsyncIterator[tuple[int, Optional[str], str]]:
+        """Yields (line number, url or None, error detail)."""
+        column: Optional[int] = None
+        line_no = 0
+        async for raw in iter_lines(stream, self._max_line):
+            line_no += 1
+            line = raw.rstrip(b"\r")
+            if not line.strip():
+                continue
+            if len(line) > self._max_line:
+                yield line_no, None, "Line is too long"
+                continue
+            try:
+                if fmt == "ndjson":
+                    yield line_no, self.parse_ndjson(line), ""
+                    continue
+                row = next(csv.reader([line.decode()]))
+                if column is None:
+                    column = (row.index("original_url")
+                              if "original_url" in row else 0)
+                    if "original_url" in row:
+                        continue
+                yield line_no, row[column], ""
+            except (ValueError, IndexError) as e:
+                yield line_no, None, str(e) or "Malformed line"
+
+    async def run(self, db: Any, stream: AsyncIterator[bytes],
+                  fmt: str) -> AsyncIterator[bytes]:
+        summary = {"total": 0, "created": 0, "exists": 0, "invalid": 0}
+        chunk: list[tuple[int, Any]] = []
+
+        async def flush() -> AsyncIterator[bytes]:
+            objs_in = [obj for _, obj in chunk]
+            results = await self._repository.create_multi(
+                db=db, objs_in=objs_in, chunk_size=self._chunk_size)
+            for (line_no, _), result in zip(chunk, results):
+                summary[result["status"]] += 1
+                yield orjson.dumps({"line": line_no, **result}) + b"\n"
+            chunk.clear()
+
+        async for line_no, url, detail in self.iter_urls(stream, fmt):
+            summary["total"] += 1
+            if url is None:
+                summary["invalid"] += 1
+                yield orjson.dumps({"line": line_no, "status": "invalid",
+                                    "detail": detail}) + b"\n"
+                continue
+            chunk.append((line_no, self._schema(original_url=url)))
+            if len(chunk) >= self._chunk_size:
+                async for line in flush():
+                    yield line
+        if chunk:
+            async for line in flush():
+                yield line
+        logger.info(f"Import finished: {summary}")
+        yield orjson.dumps({"summary": summary}) + b"\n"
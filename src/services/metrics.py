@@ -0,0 +1,159 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, Callable, Iterable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+POOL_COUNTERS = ("checkouts", "timeouts")
+
+# [query count, query seconds] of the request being served
+request_queries: ContextVar[Optional[list]] = ContextVar(
+    "request_queries", default=None)
+
+
+class Histogram:
+    """Cumulative-on-render histogram, `observe` is one bisect."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> Iterable[str]:
+        prefix = f"{labels}," if labels else ""
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield f'{name}_bucket{{{prefix}le="{bound}"}} {total}'
+        yield f'{name}_bucket{{{prefix}le="+Inf"}} {self.count}'
+        labels = f"{{{labels}}}" if labels else ""
+        yield f"{name}_sum{labels} {self.sum}"
+        yield f"{name}_count{labels} {self.count}"
+
+
+def format_labels(**labels: Any) -> str:
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+class RequestMetrics:
+    """
+    In-process metrics rendered in the Prometheus text format: request
+    latency per handler, database queries and query time per request
+    (from engine events), click (usage) insert time and pool gauges
+    read at scrape time.
+    """
+
+    def __init__(self, pools: Optional[dict[str, Callable[[], dict]]] = None):
+        self._pools = pools or {}
+        self._latency: dict[tuple, Histogram] = {}
+        self._responses: dict[tuple, int] = {}
+        self._request_queries: dict[tuple, Histogram] = {}
+        self._request_query_time: dict[tuple, Histogram] = {}
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.usage_inserts = Histogram(LATENCY_BUCKETS)
+        self.usage_rows = 0
+
+    def instrument(self, engine: Engine) -> None:
+        """Counts the queries of a (sync) engine, per request as well."""
+        event.listen(engine, "before_cursor_execute", self._before_query)
+        event.listen(engine, "after_cursor_execute", self._after_query)
+
+    @staticmethod
+    def _before_query(conn, cursor, statement, parameters, context,
+                      executemany) -> None:
+        context._query_started = time.perf_counter()
+
+    def _after_query(self, conn, cursor, statement, parameters, context,
+                     executemany) -> None:
+        elapsed = time.perf_counter() - context._query_started
+        self.queries += 1
+        self.query_seconds += elapsed
+        stats = request_queries.get()
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += elapsed
+
+    def observe_request(self, method: str, handler: str, status: int,
+                        seconds: float, queries: list) -> None:
+        route = (method, handler)
+        histogram = self._latency.get(route)
+        if histogram is None:
+            histogram = self._latency[route] = Histogram(LATENCY_BUCKETS)
+            self._request_queries[route] = Histogram(QUERY_COUNT_BUCKETS)
+            self._request_query_time[route] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(seconds)
+        key = (method, handler, status)
+        self._responses[key] = self._responses.get(key, 0) + 1
+        self._request_queries[route].observe(queries[0])
+        self._request_query_time[route].observe(queries[1])
+
+    def observe_usage_insert(self, seconds: float, rows: int) -> None:
+        self.usage_inserts.observe(seconds)
+        self.usage_rows += rows
+
+    def render(self) -> str:
+        lines = [
+            "# HELP http_request_duration_seconds Request latency.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, handler), histogram in self._latency.items():
+            lines.extend(histogram.render(
+                "http_request_duration_seconds",
+                format_labels(method=method, handler=handler)))
+        lines += ["# HELP http_responses_total Responses by status.",
+                  "# TYPE http_responses_total counter"]
+        for (method, handler, status), count in self._responses.items():
+            labels = format_labels(method=method, handler=handler,
+                                   status=status)
+            lines.append(f"http_responses_total{{{labels}}} {count}")
+        for name, histograms, help_text in (
+                ("db_queries_per_request", self._request_queries,
+                 "Database queries per request."),
+                ("db_query_seconds_per_request", self._request_query_time,
+                 "Database time per request.")):
+            lines += [f"# HELP {name} {help_text}",
+                      f"# TYPE {name} histogram"]
+            for (method, handler), histogram in histograms.items():
+                lines.extend(histogram.render(
+                    name, format_labels(method=method, handler=handler)))
+        lines += [
+            "# HELP db_queries_total Database queries.",
+            "# TYPE db_queries_total counter",
+            f"db_queries_total {self.queries}",
+            "# HELP db_query_seconds_total Time spent in queries.",
+            "# TYPE db_query_seconds_total counter",
+            f"db_query_seconds_total {self.query_seconds}",
+            "# HELP usage_insert_duration_seconds Click (usage) inserts.",
+            "# TYPE usage_insert_duration_seconds histogram",
+            *self.usage_inserts.render("usage_insert_duration_seconds", ""),
+            "# HELP usage_insert_rows_total Click (usage) rows inserted.",
+            "# TYPE usage_insert_rows_total counter",
+            f"usage_insert_rows_total {self.usage_rows}",
+        ]
+        pools = {name: status() for name, status in self._pools.items()}
+        gauges = sorted({key for status in pools.values()
+                         for key, value in status.items()
+                         if isinstance(value, (int, float))})
+        for gauge in gauges:
+            metric, kind = (f"db_pool_{gauge}_total", "counter") \
+                if gauge in POOL_COUNTERS else (f"db_pool_{gauge}", "gauge")
+            lines.append(f"# TYPE {metric} {kind}")
+            for name, status in pools.items():
+                if gauge in status:
+                    lines.append(f'{metric}{{engine="{name}"}} '
+                                 f'{status[gauge]}')
+        return "\n".join(lines) + "\n"
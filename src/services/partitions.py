@@ -0,0 +1,216 @@
+import asyncio
+import logging.config
+import re
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, NamedTuple, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core.logger import LOGGING
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger(__name__)
+
+BOUND_RE = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+def month_start(moment: datetime) -> datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(start: datetime) -> datetime:
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def parse_bound(value: str) -> Optional[datetime]:
+    """A partition bound as pg_get_expr prints it, None for MINVALUE."""
+    value = value.strip("'")
+    return None if value in ("MINVALUE", "MAXVALUE") \
+        else datetime.fromisoformat(value)
+
+
+class Partition(NamedTuple):
+    name: str
+    start: Optional[datetime]
+    end: Optional[datetime]
+
+
+class PartitionManager:
+    """
+    Keeps monthly range partitions of a table partitioned on a timestamp
+    column: the current month and the next `premake` months always
+    exist, and partitions that ended more than `retention_days` ago are
+    detached and dropped, an O(1) catalog change instead of a DELETE.
+    A partition is only dropped once `watermark` (the last rolled up id)
+    is past every row in it.
+
+    Attaching and detaching need short exclusive locks; they give up
+    after `lock_timeout` seconds rather than queue traffic behind a long
+    query, and are retried on the next run. Every step holds an advisory
+    lock per table, so workers running maintenance at the same time do
+    not race on the same partition: the one that finds it taken leaves
+    the rest of the run to the other.
+    """
+
+    def __init__(self, table: str, column: str, session_factory: Any, *,
+                 premake: int = 3, retention_days: float = 30,
+                 watermark: Optional[
+                     Callable[[AsyncSession], Awaitable[int]]] = None,
+                 interval: float = 3600, lock_timeout: float = 5):
+        self._table = table
+        self._column = column
+        self._default = f"{table}_default"
+        self._session_factory = session_factory
+        self._premake = premake
+        self._retention = timedelta(days=retention_days)
+        self._watermark = watermark
+        self._interval = interval
+        self._lock_timeout = lock_timeout
+        self._task: Optional[asyncio.Task] = None
+
+    def partition_name(self, start: datetime) -> str:
+        return f"{self._table}_p{start:%Y%m}"
+
+    async def partitions(self, db: AsyncSession) -> list[Partition]:
+        """Range partitions of the table, ordered by start."""
+        results = await db.execute(text(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = CAST(:table AS regclass)"),
+            {"table": self._table})
+        partitions = []
+        for name, bound in results.all():
+            match = BOUND_RE.search(bound)
+            if match is not None:
+                partitions.append(Partition(name, parse_bound(match[1]),
+                                            parse_bound(match[2])))
+        return sorted(partitions,
+                      key=lambda partition: partition.start or datetime.min)
+
+    async def claim(self, db: AsyncSession) -> Optional[list[Partition]]:
+        """
+        Takes the table's maintenance lock for this transaction and
+        returns the partitions as of then, None when another worker
+        holds the lock.
+        """
+        results = await db.execute(text(
+            "SELECT pg_try_advisory_xact_lock(hashtext(:key))"),
+            {"key": f"partitions:{self._table}"})
+        if not results.scalar_one():
+            await db.rollback()
+            return None
+        return await self.partitions(db)
+
+    async def create(self, db: AsyncSession, start: datetime) -> str:
+        """
+        Creates the partition as a plain table and attaches it, which
+        locks the parent less than CREATE TABLE ... PARTITION OF. Inserts
+        into the default partition wait while its rows are moved over.
+        """
+        end = next_month(start)
+        name = self.partition_name(start)
+        column, default = self._column, self._default
+        await self.set_lock_timeout(db)
+        await db.execute(text(
+            f"LOCK TABLE {default} IN SHARE ROW EXCLUSIVE MODE"))
+        await db.execute(text(
+            f"CREATE TABLE {name} (LIKE {self._table} "
+            f"INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        await db.execute(text(
+            f"WITH moved AS (DELETE FROM {default} "
+            f"WHERE {column} >= :start AND {column} < :end "
+            f"RETURNING *) INSERT INTO {name} SELECT * FROM moved"),
+            {"start": start, "end": end})
+        await db.execute(text(
+            f"ALTER TABLE {self._table} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{start.isoformat(' ')}') "
+            f"TO ('{end.isoformat(' ')}')"))
+        await db.commit()
+        return name
+
+    async def set_lock_timeout(self, db: AsyncSession) -> None:
+        await db.execute(text(
+            f"SET LOCAL lock_timeout = {int(self._lock_timeout * 1000)}"))
+
+    async def drop(self, db: AsyncSession, partition: Partition) -> bool:
+        """Detaches and drops a partition whose rows are all rolled up."""
+        if self._watermark is not None:
+            results = await db.execute(text(
+                f"SELECT max(id) FROM {partition.name}"))
+            high = results.scalar_one()
+            if high is not None and high > await self._watermark(db):
+                await db.rollback()
+                return False
+        await self.set_lock_timeout(db)
+        await db.execute(text(
+            f"ALTER TABLE {self._table} DETACH PARTITION {partition.name}"))
+        await db.execute(text(f"DROP TABLE {partition.name}"))
+        await db.commit()
+        return True
+
+    async def run_once(self, now: Optional[datetime] = None
+                       ) -> tuple[list[str], list[str]]:
+        """Returns the names of the partitions created and dropped."""
+        now = now or datetime.utcnow()
+        created, dropped = [], []
+        async with self._session_factory() as db:
+            start = month_start(now)
+            for _ in range(self._premake + 1):
+                existing = await self.claim(db)
+                if existing is None:
+                    return created, dropped
+                if any(self.covers(partition, start)
+                       for partition in existing):
+                    await db.rollback()
+                else:
+                    created.append(await self.create(db, start))
+                start = next_month(start)
+            existing = await self.claim(db)
+            if existing is None:
+                return created, dropped
+            await db.rollback()
+            for partition in existing:
+                if partition.end is None or \
+                        partition.end > now - self._retention:
+                    continue
+                current = await self.claim(db)
+                if current is None:
+                    break
+                if partition not in current:
+                    await db.rollback()
+                elif await self.drop(db, partition):
+                    dropped.append(partition.name)
+        return created, dropped
+
+    @staticmethod
+    def covers(partition: Partition, start: datetime) -> bool:
+        return ((partition.start is None or partition.start <= start)
+                and (partition.end is None or start < partition.end))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                created, dropped = await self.run_once()
+                if created or dropped:
+                    logger.info(f"Partitions of {self._table}: created "
+                                f"{created}, dropped {dropped}")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(f"Partition maintenance of {self._table} "
+                                 f"failed")
+            await asyncio.sleep(self._interval)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
@@ -0,0 +1,64 @@
+import asyncio
+import logging.config
+from datetime import datetime
+from typing import Any, Optional
+
+from src.core.logger import LOGGING
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger(__name__)
+
+
+class LinkReaper:
+    """
+    Background task that soft-deletes expired links in batches, so that
+    they are dropped from the redirect caches and skipped by listings
+    without waiting for a request to find them expired.
+    """
+
+    def __init__(self, repository: Any, session_factory: Any, *,
+                 interval: float = 60, batch_size: int = 10_000):
+        self._repository = repository
+        self._session_factory = session_factory
+        self._interval = interval
+        self._batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self.reaped = 0
+
+    async def run_once(self) -> int:
+        reaped = 0
+        now = datetime.utcnow()
+        async with self._session_factory() as db:
+            while True:
+                expired = await self._repository.expire_links(
+                    db, now=now, batch_size=self._batch_size)
+                reaped += len(expired)
+                if len(expired) < self._batch_size:
+                    break
+        self.reaped += reaped
+        return reaped
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                reaped = await self.run_once()
+                if reaped:
+                    logger.info(f"Soft-deleted {reaped} expired links")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Expired link reaping failed")
+            await asyncio.sleep(self._interval)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
@@ -0,0 +1,59 @@
+import time
+from typing import Any, Hashable, Iterable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+class ReadRouter:
+    """
+    Sends repository reads to the replica engine, except for a short
+    read-your-writes window after a write: keys written recently are read
+    from the primary, and so are listings right after any write.
+    """
+
+    def __init__(self, replica: Optional[AsyncEngine], *,
+                 window: float = 5, max_keys: int = 100_000):
+        self._replica = replica.sync_engine if replica else None
+        self._window = window
+        self._max_keys = max_keys
+        self._recent: dict[Hashable, float] = {}
+        self._last_write = 0.0
+        self.replica_reads = 0
+        self.primary_reads = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._replica is not None
+
+    def mark_written(self, keys: Iterable[Hashable] = ()) -> None:
+        if self._replica is None:
+            return
+        now = time.monotonic()
+        self._last_write = now
+        expires_at = now + self._window
+        for key in keys:
+            self._recent[key] = expires_at
+        if len(self._recent) > self._max_keys:
+            self._recent = {key: expiry for key, expiry
+                            in self._recent.items() if expiry > now}
+
+    def bind_arguments(self, key: Optional[Hashable] = None, *,
+                       listing: bool = False) -> dict[str, Any]:
+        """`bind_arguments` for AsyncSession.execute, {} means primary."""
+        if self._replica is None:
+            return {}
+        now = time.monotonic()
+        if ((key is not None and self._recent.get(key, 0) > now)
+                or (listing and self._last_write + self._window > now)):
+            self.primary_reads += 1
+            return {}
+        self.replica_reads += 1
+        return {"bind": self._replica}
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "enabled": self.enabled,
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+            "recent_keys": len(self._recent),
+        }
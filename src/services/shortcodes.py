@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import logging.config
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core.logger import LOGGING
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger(__name__)
+
+BASE62_ALPHABET = (
+    "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+)
+
+# (preallocated row id or None, short code)
+ShortCode = tuple[Optional[int], str]
+
+# all-digit paths are url ids, generated codes that would be all digits
+# get this prefix (it is not in the base62 alphabet)
+NUMERIC_PREFIX = "_"
+
+
+class ShortCodeError(ValueError):
+    pass
+
+
+def base62_encode(number: int) -> str:
+    if number < 0:
+        raise ValueError("Only non-negative numbers can be encoded")
+    if number == 0:
+        return BASE62_ALPHABET[0]
+    chars = []
+    while number:
+        number, rem = divmod(number, 62)
+        chars.append(BASE62_ALPHABET[rem])
+    return "".join(reversed(chars))
+
+
+def routable(code: str) -> str:
+    """`code`, kept out of the numeric namespace of url ids."""
+    return NUMERIC_PREFIX + code if code.isdigit() else code
+
+
+def code_for_id(row_id: int) -> str:
+    return routable(base62_encode(row_id))
+
+
+class CodeGenerator:
+    """
+    Base class for short code strategies.
+
+    `allocate` returns one (id, code) pair per url. Strategies that derive
+    the code from the row id preallocate that id from the table sequence,
+    the others return None and leave the id to the database.
+    """
+    # how many times create may retry after a short_url collision
+    max_attempts: int = 1
+
+    async def allocate(self, db: AsyncSession, urls: list[str],
+                       attempt: int = 0) -> list[ShortCode]:
+        raise NotImplementedError
+
+
+class Base62IdGenerator(CodeGenerator):
+    """
+    Base62 of a row id taken from the sequence, one nextval per url.
+    Aliases share the namespace, so a code an alias already took is
+    skipped by retrying with the next id.
+    """
+    max_attempts = 5
+
+    def __init__(self, sequence: str = "url_id_seq"):
+        self._sequence = sequence
+
+    async def _next_ids(self, db: AsyncSession, count: int) -> list[int]:
+        statement = select(func.nextval(self._sequence)).select_from(
+            func.generate_series(1, count))
+        results = await db.execute(statement=statement)
+        return list(results.scalars().all())
+
+    async def allocate(self, db: AsyncSession, urls: list[str],
+                       attempt: int = 0) -> list[ShortCode]:
+        if not urls:
+            return []
+        ids = await self._next_ids(db, len(urls))
+        return [(row_id, code_for_id(row_id)) for row_id in ids]
+
+
+class SequenceBlockGenerator(Base62IdGenerator):
+    """
+    Base62 of a row id, ids are reserved from the sequence in blocks so
+    that most creates don't need a round trip at all.
+    """
+
+    def __init__(self, sequence: str = "url_id_seq", block_size: int = 100):
+        super().__init__(sequence)
+        self._block_size = block_size
+        self._ids: list[int] = []
+        self._lock = asyncio.Lock()
+
+    async def allocate(self, db: AsyncSession, urls: list[str],
+                       attempt: int = 0) -> list[ShortCode]:
+        async with self._lock:
+            missing = len(urls) - len(self._ids)
+            if missing > 0:
+                self._ids.extend(await self._next_ids(
+                    db, max(missing, self._block_size)))
+            ids, self._ids = self._ids[:len(urls)], self._ids[len(urls):]
+        return [(row_id, code_for_id(row_id)) for row_id in ids]
+
+
+class HashGenerator(CodeGenerator):
+    """Seeded hash of the url, `attempt` is mixed in after a collision."""
+    max_attempts = 5
+
+    def __init__(self, seed: str = "", length: int = 7):
+        self._seed = seed.encode()
+        self._length = length
+
+    def code_for(self, url: str, attempt: int = 0) -> str:
+        digest = hashlib.blake2b(f"{attempt}:{url}".encode(), digest_size=16,
+                                 key=self._seed[:64]).digest()
+        return routable(
+            base62_encode(int.from_bytes(digest, "big"))[:self._length])
+
+    async def allocate(self, db: AsyncSession, urls: list[str],
+                       attempt: int = 0) -> list[ShortCode]:
+        return [(None, self.code_for(url, attempt)) for url in urls]
+
+
+class TinyUrlGenerator(CodeGenerator):
+    """TinyURL API, the blocking HTTP call runs in the default executor."""
+
+    def __init__(self):
+        import pyshorteners
+        self._exceptions = pyshorteners.exceptions
+        self._shortener = pyshorteners.Shortener()
+
+    def _short(self, url: str) -> str:
+        try:
+            return self._shortener.tinyurl.short(url)
+        except self._exceptions.BadURLException as e:
+            raise ShortCodeError(str(e)) from e
+
+    async def allocate(self, db: AsyncSession, urls: list[str],
+                       attempt: int = 0) -> list[ShortCode]:
+        codes = await asyncio.gather(
+            *(asyncio.to_thread(self._short, url) for url in urls))
+        return [(None, code) for code in codes]
+
+
+def get_code_generator(strategy: str, *, sequence: str = "url_id_seq",
+                       block_size: int = 100, seed: str = "",
+                       length: int = 7) -> CodeGenerator:
+    if strategy == "base62":
+        return Base62IdGenerator(sequence)
+    if strategy == "sequence":
+        return SequenceBlockGenerator(sequence, block_size)
+    if strategy == "hash":
+        return HashGenerator(seed, length)
+    if strategy == "tinyurl":
+        return TinyUrlGenerator()
+    raise ValueError(f"Unknown short code strategy {strategy!r}")
@@ -0,0 +1,59 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: the first caller runs
+    the function, everyone arriving while it is in flight awaits the same
+    task and gets its result or its exception.
+
+    Followers wait at most `timeout` seconds for the shared call and then
+    run the function themselves, so one stuck query does not hold every
+    request for the key. `shared` counts the calls that were saved.
+    """
+
+    def __init__(self, *, timeout: Optional[float] = None):
+        self._timeout = timeout
+        self._calls: dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.shared = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    async def do(self, key: Hashable,
+                 fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            # shielded, so a cancelled leader does not cancel the followers
+            return await asyncio.shield(task)
+        try:
+            shared = asyncio.wait_for(asyncio.shield(task), self._timeout)
+            self.shared += 1
+            return await shared
+        except asyncio.TimeoutError:
+            if task.done():
+                raise
+            self.shared -= 1
+            self.timeouts += 1
+            self.calls += 1
+            return await fn()
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled() and task.exception() is not None:
+            self.errors += 1
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "in_flight": len(self._calls),
+            "calls": self.calls,
+            "shared": self.shared,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+        }
@@ -0,0 +1,334 @@
+"""
+Read-only redirect snapshot: the url table compiled into one sorted
+binary file that workers memory-map, so that lookups need neither the
+database nor a private copy of the data (the pages are shared by every
+process through the page cache).
+
+Layout, little-endian, every section 8-byte aligned:
+
+    header   MAGIC, version, count, max_id, created_at and section offsets
+    ids      count x int64, sorted
+    records  count x RECORD, in id order
+    codes    count x CODE, sorted by code (bytewise)
+    urls     utf-8 original urls, referenced by RECORD
+    names    utf-8 short codes, referenced by CODE
+"""
+import asyncio
+import logging.config
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Awaitable, BinaryIO, Callable, \
+    Optional
+
+from src.core.logger import LOGGING
+from src.services.base import UrlTarget
+logging.config.dictConfig(LOGGING)
+logger = logging.getLogger(__name__)
+
+MAGIC = b"URLSNAP\0"
+VERSION = 1
+# magic, version, count, max_id, created_at, offsets of the 5 sections
+HEADER = struct.Struct("<8sIQqd5Q")
+# url offset, url length, expires_at (us since the epoch, 0: none), flags
+RECORD = struct.Struct("<QIqB3x")
+# name offset, name length, url id
+CODE = struct.Struct("<QI4xq")
+DELETED = 1
+LIMITED = 2
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_micros(moment: Optional[datetime]) -> int:
+    if moment is None:
+        return 0
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+def padding(size: int) -> bytes:
+    return b"\0" * (-size % 8)
+
+
+async def write_snapshot(path: str, rows: AsyncIterator[list],
+                         codes: AsyncIterator[list]) -> int:
+    """
+    Writes a snapshot from `rows` (id, original_url, deleted, expires_at,
+    max_clicks) in id order and `codes` (short_url, id) in bytewise code
+    order, both in chunks. Sections are spooled to temporary files and
+    the result replaces `path` atomically. Returns the number of urls.
+    """
+    created_at = time.time()
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.TemporaryFile() as ids, \
+            tempfile.TemporaryFile() as records, \
+            tempfile.TemporaryFile() as code_index, \
+            tempfile.TemporaryFile() as urls, \
+            tempfile.TemporaryFile() as names:
+        count = max_id = url_size = 0
+        async for chunk in rows:
+            for id, original_url, deleted, expires_at, max_clicks in chunk:
+                url = original_url.encode()
+                ids.write(struct.pack("<q", id))
+                records.write(RECORD.pack(
+                    url_size, len(url), to_micros(expires_at),
+                    (DELETED if deleted else 0)
+                    | (LIMITED if max_clicks is not None else 0)))
+                urls.write(url)
+                url_size += len(url)
+                count += 1
+                max_id = id
+        names_size = 0
+        async for chunk in codes:
+            for short_url, id in chunk:
+                name = short_url.encode()
+                code_index.write(CODE.pack(names_size, len(name), id))
+                names.write(name)
+                names_size += len(name)
+
+        sections: list[BinaryIO] = [ids, records, code_index, urls, names]
+        offsets = []
+        offset = HEADER.size + len(padding(HEADER.size))
+        for section in sections:
+            offsets.append(offset)
+            size = section.tell()
+            section.write(padding(size))
+            offset += size + len(padding(size))
+
+        fd, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as output:
+                output.write(HEADER.pack(MAGIC, VERSION, count, max_id,
+                                         created_at, *offsets))
+                output.write(padding(HEADER.size))
+                for section in sections:
+                    section.seek(0)
+                    shutil.copyfileobj(section, output, 1024 * 1024)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+    return count
+
+
+class SnapshotFile:
+    """One mapped snapshot file, lookups slice the mapping directly."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self.stat = os.fstat(file.fileno())
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self.max_id, self.created_at, \
+            ids, records, codes, self._urls, self._names = \
+            HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise ValueError(f"{path} is not a redirect snapshot")
+        self._view = memoryview(self._map)
+        self._ids = self._view[ids:ids + 8 * self.count].cast("q")
+        self._records = records
+        self._codes = codes
+
+    def target(self, id: int) -> Optional[UrlTarget]:
+        """None for ids that are not in the file or carry a click limit."""
+        index = bisect_left(self._ids, id)
+        if index == self.count or self._ids[index] != id:
+            return None
+        offset, length, expires_at, flags = RECORD.unpack_from(
+            self._map, self._records + index * RECORD.size)
+        if flags & LIMITED:
+            return None
+        start = self._urls + offset
+        # decoded straight from the mapped pages, no intermediate bytes
+        return UrlTarget(
+            id, str(self._view[start:start + length], "utf-8"),
+            bool(flags & DELETED),
+            EPOCH + timedelta(microseconds=expires_at)
+            if expires_at else None)
+
+    def code_id(self, code: str) -> Optional[int]:
+        name = code.encode()
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset, length, id = CODE.unpack_from(
+                self._map, self._codes + middle * CODE.size)
+            start = self._names + offset
+            found = self._map[start:start + length]
+            if found == name:
+                return id
+            if found < name:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def close(self) -> None:
+        self._ids.release()
+        self._view.release()
+        self._map.close()
+
+
+class RedirectSnapshot:
+    """
+    Serves redirect lookups from the newest snapshot at `path`.
+
+    Only hits are answered: ids and codes that are not in the file
+    (newer than it), links with a click limit and ids changed since the
+    file was compiled return None, and the caller goes on to the cache
+    and the database.
+
+    Changed ids come from `changes(db, since)` (soft-deletes and restores
+    persisted in the url table), polled every `reload_interval` seconds
+    by the background task, which also picks up a replaced file. Writes
+    seen by this worker (`on_written`, cluster-wide with the shared cache)
+    are added at once. While the last poll is older than
+    `max_staleness` nothing is answered from the file, so a deleted link
+    is served for at most that long. Without `changes` the file is
+    trusted as is and only checked for replacement on lookups.
+    """
+
+    def __init__(self, path: str, *, reload_interval: float = 30,
+                 changes: Optional[
+                     Callable[[Any, datetime],
+                              Awaitable[list[tuple[int, datetime]]]]] = None,
+                 session_factory: Any = None,
+                 max_staleness: Optional[float] = None,
+                 clock_skew: float = 60):
+        self.path = path
+        self._reload_interval = reload_interval
+        self._changes = changes
+        self._session_factory = session_factory
+        self._max_staleness = max_staleness or 3 * reload_interval
+        self._clock_skew = timedelta(seconds=clock_skew)
+        self._checked_at = 0.0
+        self._file: Optional[SnapshotFile] = None
+        # id -> time of the change (utc), until a newer file covers it
+        self._changed: dict[int, datetime] = {}
+        # file the last poll of changes covered, and when it ran
+        self._polled_file: Optional[SnapshotFile] = None
+        self._polled_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.refresh()
+
+    def refresh(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._checked_at < self._reload_interval:
+            return
+        self._checked_at = now
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        current = self._file
+        if current is not None and \
+                (stat.st_ino, stat.st_mtime_ns) == \
+                (current.stat.st_ino, current.stat.st_mtime_ns):
+            return
+        try:
+            self._file = SnapshotFile(self.path)
+        except (OSError, ValueError):
+            logger.exception(f"Could not load snapshot {self.path}")
+            return
+        self.reloads += 1
+        since = self.compiled_at() - self._clock_skew
+        self._changed = {id: at for id, at in self._changed.items()
+                         if at >= since}
+        logger.info(f"Loaded redirect snapshot with {self._file.count} "
+                    f"urls up to id {self._file.max_id}")
+        # the old mapping stays valid for lookups already holding it and
+        # is unmapped once they let go of it
+
+    def compiled_at(self) -> datetime:
+        return datetime.utcfromtimestamp(self._file.created_at)
+
+    async def poll_changes(self) -> None:
+        """Loads the ids changed since the current file was compiled."""
+        current = self._file
+        if current is None or self._changes is None:
+            return
+        async with self._session_factory() as db:
+            changed = await self._changes(
+                db, self.compiled_at() - self._clock_skew)
+        for id, at in changed:
+            self._changed[id] = at
+        self._polled_file = current
+        self._polled_at = time.monotonic()
+
+    def usable(self) -> bool:
+        if self._file is None:
+            return False
+        if self._changes is None:
+            return True
+        return (self._polled_file is self._file and time.monotonic()
+                - self._polled_at <= self._max_staleness)
+
+    def get(self, id: int) -> Optional[UrlTarget]:
+        if self._task is None:
+            self.refresh()
+        target = None
+        if self.usable() and id not in self._changed:
+            target = self._file.target(id)
+        if target is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return target
+
+    def code_id(self, code: str) -> Optional[int]:
+        if self._task is None:
+            self.refresh()
+        if not self.usable():
+            return None
+        return self._file.code_id(code)
+
+    def on_written(self, ids: list[int]) -> None:
+        now = datetime.utcnow()
+        for id in ids:
+            self._changed[id] = now
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                self.refresh(force=True)
+                await self.poll_changes()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(f"Could not refresh snapshot {self.path}")
+            await asyncio.sleep(self._reload_interval)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "path": self.path,
+            "urls": self._file.count if self._file else 0,
+            "max_id": self._file.max_id if self._file else None,
+            "created_at": self.compiled_at().isoformat()
+            if self._file else None,
+            "usable": self.usable(),
+            "changed": len(self._changed),
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+        }
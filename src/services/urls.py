@@ -1,6 +1,27 @@
+from typing import Optional
+
+from src.core.config import app_settings
+from src.db.db import async_session, engine, pool_status, read_engine
+from src.models.analytics import RollupStateModel, UsageHostRollupModel, \
+    UsageReferrerRollupModel, UsageRollupModel
 from src.models.urlmodel import UrlModel, UrlUsageModel
 from src.schemas.shorturl import ShortUrlCreate, UrlUsageCreate, UrlUsageFull, DBHealthModel, HTTPError
-from .base import RepositoryDB, RepositoryUsage
+from .aliases import AliasRegistry
+from .analytics import USAGE_WRITE_LOCK, RepositoryAnalytics, \
+    UsageAggregator
+from .base import RepositoryDB, RepositoryUsage, UrlTarget
+from .bulk import BulkStatusUpdater
+from .cache import LRUCache, RedisCacheBackend, TieredCache
+from .clicks import ClickLogger
+from .export import URL_FIELDS, USAGE_FIELDS, RowExporter
+from .importer import BulkImporter
+from .metrics import RequestMetrics
+from .partitions import PartitionManager
+from .reaper import LinkReaper
+from .routing import ReadRouter
+from .shortcodes import get_code_generator
+from .singleflight import SingleFlight
+from .snapshot import RedirectSnapshot
 
 
 class RepositoryURLs(RepositoryDB[UrlModel, ShortUrlCreate, DBHealthModel,
@@ -13,5 +34,131 @@ class RepositoryURLUsage(RepositoryUsage[UrlUsageModel, UrlUsageCreate,
     pass
 
 
-url_crud = RepositoryURLs(UrlModel, DBHealthModel, HTTPError)
-usage_crud = RepositoryURLUsage(UrlUsageModel)
+def build_redirect_cache(snapshot: Optional[RedirectSnapshot],
+                         flight: Optional[SingleFlight]
+                         ) -> Optional[TieredCache]:
+    if not app_settings.REDIRECT_CACHE_ENABLED:
+        return None
+    local = LRUCache(
+        max_entries=app_settings.REDIRECT_CACHE_MAX_ENTRIES,
+        max_bytes=app_settings.REDIRECT_CACHE_MAX_BYTES,
+        ttl=app_settings.REDIRECT_CACHE_TTL,
+        negative_ttl=app_settings.REDIRECT_CACHE_NEGATIVE_TTL,
+    )
+    remote = None
+    if app_settings.CACHE_BACKEND == "redis":
+        remote = RedisCacheBackend.from_url(
+            app_settings.REDIS_URL,
+            prefix=app_settings.REDIS_CACHE_PREFIX,
+            channel=app_settings.REDIS_INVALIDATION_CHANNEL,
+            ttl=app_settings.REDIRECT_CACHE_TTL,
+            negative_ttl=app_settings.REDIRECT_CACHE_NEGATIVE_TTL,
+            encode=UrlTarget.encode,
+            decode=UrlTarget.decode,
+        )
+    # deletes announced by other workers skip the snapshot as well
+    return TieredCache(local, remote, cacheable=UrlTarget.cacheable,
+                       on_drop=snapshot.on_written if snapshot else None,
+                       flight=flight)
+
+
+redirect_snapshot = RedirectSnapshot(
+    app_settings.REDIRECT_SNAPSHOT_PATH,
+    reload_interval=app_settings.REDIRECT_SNAPSHOT_RELOAD_INTERVAL,
+    max_staleness=app_settings.REDIRECT_SNAPSHOT_MAX_STALENESS,
+    changes=lambda db, since: url_crud.changed_since(db, since),
+    session_factory=async_session,
+) if app_settings.REDIRECT_SNAPSHOT_PATH else None
+redirect_flight = SingleFlight(
+    timeout=app_settings.SINGLE_FLIGHT_TIMEOUT,
+) if app_settings.SINGLE_FLIGHT_ENABLED else None
+redirect_cache = build_redirect_cache(redirect_snapshot, redirect_flight)
+request_metrics = RequestMetrics(pools={
+    "primary": lambda: pool_status(engine.pool),
+    **({"replica": lambda: pool_status(read_engine.pool)}
+       if read_engine is not None else {}),
+})
+request_metrics.instrument(engine.sync_engine)
+if read_engine is not None:
+    request_metrics.instrument(read_engine.sync_engine)
+alias_registry = AliasRegistry(
+    UrlModel.short_url, async_session,
+    created_at=UrlModel.created_at,
+    capacity=app_settings.ALIAS_FILTER_CAPACITY,
+    error_rate=app_settings.ALIAS_FILTER_ERROR_RATE,
+    batch_size=app_settings.ALIAS_FILTER_BATCH_SIZE,
+    refresh_interval=app_settings.ALIAS_FILTER_REFRESH_INTERVAL,
+) if app_settings.ALIAS_FILTER_ENABLED else None
+read_router = ReadRouter(read_engine,
+                         window=app_settings.READ_YOUR_WRITES_WINDOW)
+url_crud = RepositoryURLs(
+    UrlModel, DBHealthModel, HTTPError,
+    codes=get_code_generator(
+        app_settings.SHORT_CODE_STRATEGY,
+        sequence=f"{UrlModel.__tablename__}_id_seq",
+        block_size=app_settings.SHORT_CODE_BLOCK_SIZE,
+        seed=app_settings.SHORT_CODE_SEED,
+        length=app_settings.SHORT_CODE_LENGTH,
+    ),
+    cache=redirect_cache,
+    reads=read_router,
+    flight=redirect_flight,
+    aliases=alias_registry,
+    code_cache=LRUCache(
+        max_entries=app_settings.REDIRECT_CACHE_MAX_ENTRIES,
+        max_bytes=app_settings.REDIRECT_CACHE_MAX_BYTES,
+        ttl=app_settings.REDIRECT_CACHE_TTL,
+        negative_ttl=app_settings.REDIRECT_CACHE_NEGATIVE_TTL,
+    ) if app_settings.REDIRECT_CACHE_ENABLED else None,
+    snapshot=redirect_snapshot,
+)
+usage_crud = RepositoryURLUsage(UrlUsageModel, counted=UrlModel,
+                                reads=read_router,
+                                write_lock=USAGE_WRITE_LOCK)
+click_logger = ClickLogger(
+    usage_crud, async_session,
+    max_queue=app_settings.CLICK_LOG_QUEUE_SIZE,
+    batch_size=app_settings.CLICK_LOG_BATCH_SIZE,
+    flush_interval=app_settings.CLICK_LOG_FLUSH_INTERVAL,
+    put_timeout=app_settings.CLICK_LOG_PUT_TIMEOUT,
+    on_write=request_metrics.observe_usage_insert,
+)
+url_importer = BulkImporter(
+    url_crud, ShortUrlCreate,
+    chunk_size=app_settings.IMPORT_CHUNK_SIZE,
+)
+url_exporter = RowExporter(url_crud, URL_FIELDS,
+                           chunk_size=app_settings.EXPORT_CHUNK_SIZE)
+usage_exporter = RowExporter(usage_crud, USAGE_FIELDS,
+                             chunk_size=app_settings.EXPORT_CHUNK_SIZE)
+bulk_status = BulkStatusUpdater(
+    url_crud, chunk_size=app_settings.BULK_STATUS_CHUNK_SIZE,
+)
+analytics_crud = RepositoryAnalytics(
+    UrlUsageModel, UsageRollupModel, UsageHostRollupModel,
+    UsageReferrerRollupModel, RollupStateModel,
+    write_lock=USAGE_WRITE_LOCK,
+)
+usage_aggregator = UsageAggregator(
+    analytics_crud, async_session,
+    interval=app_settings.ANALYTICS_INTERVAL,
+    batch_size=app_settings.ANALYTICS_BATCH_SIZE,
+    lag=app_settings.ANALYTICS_LAG,
+    # whole partitions are dropped instead of deleting raw rows
+    raw_days=None if app_settings.USAGE_PARTITIONS_ENABLED
+    else app_settings.ANALYTICS_RAW_RETENTION_DAYS,
+    minute_days=app_settings.ANALYTICS_MINUTE_RETENTION_DAYS,
+    hour_days=app_settings.ANALYTICS_HOUR_RETENTION_DAYS,
+)
+usage_partitions = PartitionManager(
+    UrlUsageModel.__tablename__, "used_at", async_session,
+    premake=app_settings.USAGE_PARTITIONS_PREMAKE,
+    retention_days=app_settings.ANALYTICS_RAW_RETENTION_DAYS,
+    watermark=analytics_crud.watermark,
+    interval=app_settings.USAGE_PARTITIONS_INTERVAL,
+)
+link_reaper = LinkReaper(
+    url_crud, async_session,
+    interval=app_settings.REAPER_INTERVAL,
+    batch_size=app_settings.REAPER_BATCH_SIZE,
+)
@@ -1,11 +1,45 @@
+import asyncio
+import json
+from datetime import datetime
 import random
 import string
 
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
 from fastapi import status
 from httpx import AsyncClient
 from http import HTTPStatus
+from sqlalchemy import false, insert, text, update
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from src.benchmarks.http import KeySampler, compare_runs, percentile
+from src.benchmarks.redirect import build_apps
+from src.core.config import app_settings
 from src.main import app
+from src.middleware.black_list import BlackListMiddleware
+from src.models.analytics import RollupStateModel, UsageHostRollupModel, \
+    UsageReferrerRollupModel, UsageRollupModel
+from src.models.urlmodel import UrlModel, UrlUsageModel
+from src.schemas.shorturl import DBHealthModel, HTTPError, ShortUrlCreate, \
+    UrlUsageCreate
+from src.services.aliases import AliasRegistry
+from src.services.analytics import USAGE_WRITE_LOCK, RepositoryAnalytics
+from src.services.canonical import canonicalize_url
+from src.services.base import UrlTarget
+from src.services.cache import MISSING, LRUCache, RedisCacheBackend, \
+    TieredCache
+from src.services.clicks import ClickLogger
+from src.services.cursors import encode_cursor
+from src.services.importer import iter_lines
+from src.services.singleflight import SingleFlight
+from src.services.snapshot import RedirectSnapshot, write_snapshot
+from src.services.shortcodes import Base62IdGenerator, HashGenerator, \
+    base62_encode, code_for_id
+from src.services.partitions import PartitionManager, next_month
+from src.services.reaper import LinkReaper
+from src.services.routing import ReadRouter
+from src.services.urls import RepositoryURLs, analytics_crud, \
+    click_logger, request_metrics, url_crud, usage_crud
 
 
 async def test_create_short_url(client: AsyncClient,
@@ -48,8 +82,54 @@ async def test_create_duplicate(client: AsyncClient,
         app.url_path_for("create_short_url"),
         json={'original_url': url}
     )
-    assert response.status_code == HTTPStatus.BAD_REQUEST
-    assert "duplicate key" in response.text
+    assert response.status_code == HTTPStatus.OK
+    existing = response.json()
+    assert existing['original_url'] == url
+
+    variant = url.replace('http://', 'HTTP://').replace('/info', '/./info')
+    response = await client.post(
+        app.url_path_for("create_short_url"),
+        json={'original_url': f'{variant}#'}
+    )
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()['id'] == existing['id']
+
+
+def test_canonicalize_url() -> None:
+    assert canonicalize_url('HTTP://Example.com') == 'http://example.com/'
+    assert canonicalize_url('example.com/?b=2&a=1&b=1') == \
+        canonicalize_url('http://example.com:80/?a=1&b=2&b=1') == \
+        'http://example.com/?a=1&b=2&b=1'
+    assert canonicalize_url('https://a.com:443/x/../%7euser/p%2f?q=%c3') == \
+        'https://a.com/~user/p%2F?q=%C3'
+    assert canonicalize_url('http://a.com/p#Top') == 'http://a.com/p#Top'
+    assert canonicalize_url('http://a.com/p') != \
+        canonicalize_url('http://a.com/p/')
+
+
+async def test_redirect_to_submitted_url(client: AsyncClient,
+                                         async_session: AsyncSession) -> None:
+    host = ''.join(random.choices(string.ascii_lowercase, k=8))
+    ids = []
+    for url in (f'https://{host}.com/item?id=5&a=1',
+                f'http://{host}.com/file.pdf',
+                f'http://{host}.com/file.pdf/'):
+        response = await client.post(app.url_path_for("create_short_url"),
+                                     json={'original_url': url})
+        assert response.status_code == HTTPStatus.CREATED
+        assert response.json()['original_url'] == url
+        ids.append(response.json()['id'])
+        response = await client.get(app.url_path_for(
+            "get_url", url_id=ids[-1]))
+        assert response.headers['Location'] == url
+    assert len(set(ids)) == 3
+    response = await client.post(
+        app.url_path_for("create_short_url"),
+        json={'original_url': f'HTTPS://{host}.com:443/item?a=1&id=5'})
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()['id'] == ids[0]
+    assert response.json()['original_url'] == \
+        f'https://{host}.com/item?id=5&a=1'
 
 
 async def test_get_all(client: AsyncClient,
@@ -95,3 +175,916 @@ async def test_get_status(client: AsyncClient,
         assert result.get("used_at")
         assert result.get("client_host")
         assert result.get("client_port")
+
+
+async def test_short_code_is_local(client: AsyncClient,
+                                   async_session: AsyncSession) -> None:
+    url = ''.join(random.choices(string.ascii_lowercase, k=8))
+    response = await client.post(
+        app.url_path_for("create_short_url"),
+        json={'original_url': f'{url}.org'}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    result = response.json()
+    assert result['short_url'] == code_for_id(result['id'])
+    # all-digit paths are ids, so generated codes never are all digits
+    assert base62_encode(62) == '10'
+    assert code_for_id(62) == '_10'
+    assert code_for_id(10) == 'a'
+    response = await client.get(app.url_path_for(
+        "get_url", url_id=code_for_id(result['id'])))
+    assert response.status_code == HTTPStatus.TEMPORARY_REDIRECT
+    assert response.headers['Location'] == result['original_url']
+
+    generator = HashGenerator(seed="test", length=7)
+    assert generator.code_for(url) == generator.code_for(url)
+    assert generator.code_for(url) != generator.code_for(url, attempt=1)
+
+
+async def test_alias_takes_future_code(client: AsyncClient,
+                                       async_session: AsyncSession,
+                                       monkeypatch) -> None:
+    monkeypatch.setattr(url_crud, "_codes", Base62IdGenerator())
+    name = ''.join(random.choices(string.ascii_lowercase, k=8))
+    # ids with codes long enough to pass as aliases
+    await async_session.execute(text(
+        "SELECT setval('url_id_seq', greatest(last_value, 10000)) "
+        "FROM url_id_seq"))
+    last = (await async_session.execute(
+        text("SELECT nextval('url_id_seq')"))).scalar_one()
+    await async_session.commit()
+    alias = code_for_id(last + 2)
+    response = await client.post(
+        app.url_path_for("create_short_url"),
+        json={'original_url': f'http://{name}.io/alias', 'alias': alias})
+    assert response.status_code == HTTPStatus.CREATED
+    assert response.json()['short_url'] == alias
+    response = await client.post(
+        app.url_path_for("create_short_url"),
+        json={'original_url': f'http://{name}.io/generated'})
+    assert response.status_code == HTTPStatus.CREATED
+    assert response.json()['short_url'] == code_for_id(last + 3)
+
+
+async def test_redirect_cache(client: AsyncClient,
+                              async_session: AsyncSession) -> None:
+    response = await client.get(app.url_path_for("get_url", url_id=3))
+    assert response.status_code == HTTPStatus.TEMPORARY_REDIRECT
+    before = (await client.get(app.url_path_for("cache_stats"))).json()
+    response = await client.get(app.url_path_for("get_url", url_id=3))
+    assert response.status_code == HTTPStatus.TEMPORARY_REDIRECT
+    after = (await client.get(app.url_path_for("cache_stats"))).json()
+    assert after['redirect']['local']['hits'] == \
+        before['redirect']['local']['hits'] + 1
+
+    await client.delete(app.url_path_for("delete_url"), params={"url_id": 3})
+    response = await client.get(app.url_path_for("get_url", url_id=3))
+    assert response.status_code == HTTPStatus.GONE
+
+
+async def test_redirect_fast_path(client: AsyncClient,
+                                  async_session: AsyncSession) -> None:
+    response = await client.post(app.url_path_for("create_short_url"),
+                                 json={"original_url": "fast.example.com/ü"})
+    url_id = response.json()['id']
+    await client.delete(app.url_path_for("delete_url"), params={"url_id": 4})
+    baseline, fast = build_apps(app.dependency_overrides)
+    paths = [app.url_path_for("get_url", url_id=url_id),
+             app.url_path_for("get_url", url_id=4),
+             app.url_path_for("get_url", url_id=10 ** 6),
+             app.url_path_for("get_url", url_id="no-such-alias"),
+             app.url_path_for("get_url_usage_status", short_url_id=url_id)]
+    async with AsyncClient(app=baseline, base_url="http://test") as slow_client, \
+            AsyncClient(app=fast, base_url="http://test") as fast_client:
+        for path in paths:
+            expected = await slow_client.get(path)
+            response = await fast_client.get(path)
+            assert response.status_code == expected.status_code
+            assert response.headers == expected.headers
+            assert response.content == expected.content
+    assert [response.status_code for response in
+            [await client.get(path) for path in paths[:4]]] == \
+        [HTTPStatus.TEMPORARY_REDIRECT, HTTPStatus.GONE,
+         HTTPStatus.NOT_FOUND, HTTPStatus.NOT_FOUND]
+
+
+async def test_custom_alias(client: AsyncClient,
+                            async_session: AsyncSession) -> None:
+    alias = 'go-' + ''.join(random.choices(string.ascii_lowercase, k=8))
+    url = f'http://{alias}.org/'
+    response = await client.get(app.url_path_for("check_alias", alias=alias))
+    assert response.json() == {'alias': alias, 'available': True}
+    response = await client.post(app.url_path_for("create_short_url"),
+                                 json={'original_url': url, 'alias': alias})
+    assert response.status_code == HTTPStatus.CREATED
+    assert response.json()['short_url'] == alias
+
+    response = await client.get(app.url_path_for("get_url", url_id=alias))
+    assert response.status_code == HTTPStatus.TEMPORARY_REDIRECT
+    assert response.headers['Location'] == url
+    response = await client.get(app.url_path_for("check_alias", alias=alias))
+    assert response.json()['available'] is False
+    response = await client.post(
+        app.url_path_for("create_short_url"),
+        json={'original_url': f'{url}other', 'alias': alias})
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    response = await client.post(app.url_path_for("create_short_url"),
+                                 json={'original_url': url, 'alias': '123'})
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+    factory = sessionmaker(async_session.bind, class_=AsyncSession)
+    registry = AliasRegistry(UrlModel.short_url, factory,
+                             created_at=UrlModel.created_at, capacity=1)
+    rows = await registry.warm()
+    assert rows > 0
+    assert registry.stats()['capacity'] == 2 * rows
+    assert not await registry.is_available(async_session, alias)
+    assert await registry.is_available(async_session, alias + '-free')
+    assert registry.stats()['queried'] == 1
+
+    # taken through another worker after the filter was built
+    stale = AliasRegistry(UrlModel.short_url, factory,
+                          created_at=UrlModel.created_at, max_staleness=0)
+    await stale.warm()
+    response = await client.post(
+        app.url_path_for("create_short_url"),
+        json={'original_url': f'{url}late', 'alias': f'{alias}-late'})
+    assert response.status_code == HTTPStatus.CREATED
+    assert not await stale.is_available(async_session, f'{alias}-late')
+    await registry.refresh()
+    assert not await registry.is_available(async_session, f'{alias}-late')
+    # the filter had it, so it was checked in the database
+    assert registry.stats()['queried'] == 2
+    response = await client.get(app.url_path_for(
+        "check_alias", alias=f'{alias}-late'))
+    assert response.json()['available'] is False
+
+
+async def test_link_limits(client: AsyncClient,
+                           async_session: AsyncSession, monkeypatch) -> None:
+    name = ''.join(random.choices(string.ascii_lowercase, k=8))
+    response = await client.post(
+        app.url_path_for("create_short_url"),
+        json={'original_url': f'http://{name}.io/once', 'max_clicks': 1})
+    once = response.json()['id']
+    response = await client.post(
+        app.url_path_for("create_short_url"),
+        json={'original_url': f'http://{name}.io/twice', 'max_clicks': 2})
+    twice = response.json()['id']
+    response = await client.post(
+        app.url_path_for("create_short_urls"),
+        json=[{'original_url': f'http://{name}.io/old',
+               'expires_at': '2999-01-01T00:00:00+03:00'}])
+    expired = response.json()[0]['id']
+    row = await async_session.get(UrlModel, expired)
+    assert row.expires_at.hour == 21
+    await async_session.execute(update(UrlModel).where(
+        UrlModel.id == expired).values(expires_at=datetime(2020, 1, 1)))
+    await async_session.commit()
+    response = await client.post(
+        app.url_path_for("create_short_url"),
+        json={'original_url': f'http://{name}.io/past',
+              'expires_at': '2020-01-01T00:00:00Z'})
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+    response = await client.get(app.url_path_for("get_url", url_id=once))
+    assert response.status_code == HTTPStatus.TEMPORARY_REDIRECT
+    response = await client.get(app.url_path_for("get_url", url_id=once))
+    assert response.status_code == HTTPStatus.GONE
+    assert "click limit" in response.json()['detail']
+    response = await client.get(app.url_path_for("get_url", url_id=expired))
+    assert response.status_code == HTTPStatus.GONE
+    assert "expired" in response.json()['detail']
+
+    # with the click log batching, the limit still holds
+    monkeypatch.setattr(click_logger, "_session_factory", sessionmaker(
+        async_session.bind, class_=AsyncSession))
+    await click_logger.start()
+    try:
+        # the requests share the test session, so one at a time; all of
+        # them land inside one flush interval
+        responses = [await client.get(app.url_path_for("get_url",
+                                                       url_id=twice))
+                     for _ in range(5)]
+    finally:
+        await click_logger.stop()
+    assert [response.status_code for response in responses] == \
+        [HTTPStatus.TEMPORARY_REDIRECT] * 2 + [HTTPStatus.GONE] * 3
+    row = await async_session.get(UrlModel, twice)
+    await async_session.refresh(row)
+    assert row.click_count == 2
+    response = await client.get(app.url_path_for("get_url_usage_status",
+                                                 short_url_id=twice))
+    assert response.json() == 2
+
+    reaper = LinkReaper(url_crud, sessionmaker(async_session.bind,
+                                                class_=AsyncSession))
+    assert await reaper.run_once() >= 1
+    row = await async_session.get(UrlModel, expired)
+    await async_session.refresh(row)
+    assert row.deleted
+
+
+async def test_limited_links_not_shared(client: AsyncClient,
+                                        async_session: AsyncSession) -> None:
+    url = f'http://{"".join(random.choices(string.ascii_lowercase, k=8))}.io/'
+    response = await client.post(app.url_path_for("create_short_url"),
+                                 json={'original_url': url, 'max_clicks': 1})
+    limited = response.json()['id']
+    response = await client.post(app.url_path_for("create_short_url"),
+                                 json={'original_url': url})
+    assert response.status_code == HTTPStatus.CREATED
+    shared = response.json()['id']
+    assert shared != limited
+    response = await client.post(app.url_path_for("create_short_urls"),
+                                 json=[{'original_url': url},
+                                       {'original_url': url, 'max_clicks': 1},
+                                       {'original_url': url, 'max_clicks': 1}])
+    results = response.json()
+    assert results[0] == {**results[0], 'status': 'exists', 'id': shared}
+    assert [result['status'] for result in results[1:]] == ['created'] * 2
+    assert len({limited, shared, results[1]['id'], results[2]['id']}) == 4
+
+    await client.delete(app.url_path_for("delete_url"),
+                        params={"url_id": shared})
+    response = await client.post(app.url_path_for("create_short_url"),
+                                 json={'original_url': url})
+    assert response.status_code == HTTPStatus.CREATED
+    replacement = response.json()['id']
+    response = await client.post(app.url_path_for("bulk_set_deleted"),
+                                 json={'ids': [shared, limited],
+                                       'deleted': False})
+    assert response.json()['not_found'] == [shared]
+    response = await client.post(app.url_path_for("create_short_url"),
+                                 json={'original_url': url})
+    assert response.json()['id'] == replacement
+
+
+async def test_bulk_status(client: AsyncClient,
+                           async_session: AsyncSession) -> None:
+    name = ''.join(random.choices(string.ascii_lowercase, k=8))
+    response = await client.post(app.url_path_for("create_short_url"),
+                                 json={'original_url': f'{name}.com'})
+    url_id = response.json()['id']
+    response = await client.post(app.url_path_for("bulk_set_deleted"),
+                                 json={'ids': [url_id, url_id, 10 ** 6]})
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {'deleted': True, 'requested': 3,
+                               'updated': 1, 'not_found': [10 ** 6],
+                               'invalid_lines': []}
+    response = await client.get(app.url_path_for("get_url", url_id=url_id))
+    assert response.status_code == HTTPStatus.GONE
+    response = await client.post(app.url_path_for("bulk_set_deleted"),
+                                 json={'ids': [url_id, 99999999999]})
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+    response = await client.post(
+        app.url_path_for("bulk_set_deleted_file"), params={'deleted': False},
+        content=f'{url_id}\n\nabc\n999999\n99999999999\n0\n'.encode())
+    result = response.json()
+    assert result['updated'] == 1
+    assert result['not_found'] == [999999]
+    assert result['invalid_lines'] == [3, 5, 6]
+    response = await client.get(app.url_path_for("get_url", url_id=url_id))
+    assert response.status_code == HTTPStatus.TEMPORARY_REDIRECT
+
+
+def test_benchmark_helpers() -> None:
+    sample = KeySampler(list(range(1, 101)), "zipf", zipf_s=1.2)
+    draws = [sample() for _ in range(2000)]
+    assert draws.count(1) > draws.count(50) * 5
+    assert percentile([0.1, 0.2, 0.3, 0.4], 0.5) == 0.2
+    assert percentile([0.1, 0.2, 0.3, 0.4], 0.99) == 0.4
+
+    run = {"scenarios": {"redirect": {"rps": 100, "p50_ms": 2,
+                                      "p95_ms": 4, "p99_ms": 8}}}
+    faster = {"scenarios": {"redirect": {"rps": 150, "p50_ms": 1,
+                                         "p95_ms": 4, "p99_ms": 6}}}
+    result = compare_runs(run, faster)["redirect"]
+    assert result["rps"]["change_pct"] == 50.0
+    assert result["p50_ms"]["change_pct"] == -50.0
+
+
+def test_lru_cache_eviction() -> None:
+    cache = LRUCache(max_entries=2, ttl=60, negative_ttl=60)
+    cache.set(1, 'a')
+    cache.set(2, None)
+    assert cache.get(1) == 'a'
+    cache.set(3, 'c')
+    assert cache.get(2) is MISSING
+    assert cache.get(1) == 'a'
+    assert cache.stats()['evictions'] == 1
+
+
+async def test_shared_cache_invalidation() -> None:
+    server = FakeServer()
+    workers = [TieredCache(LRUCache(), RedisCacheBackend(
+        FakeRedis(server=server), encode=list, decode=tuple))
+        for _ in range(2)]
+    for worker in workers:
+        await worker.start()
+    loads = []
+
+    async def load():
+        loads.append(1)
+        await asyncio.sleep(0.05)
+        return (7, 'http://a.com', False)
+
+    results = await asyncio.gather(
+        *(workers[0].get_or_load(7, load) for _ in range(10)))
+    assert set(results) == {(7, 'http://a.com', False)}
+    assert len(loads) == 1
+    assert await workers[1].get_or_load(7, load) == results[0]
+    assert workers[1].stats()['remote']['hits'] == 1
+
+    async def load_many(keys):
+        return {}
+
+    assert await workers[1].get_many_or_load([7, 8], load_many) == \
+        {7: results[0], 8: None}
+
+    await workers[0].invalidate([7])
+    await asyncio.sleep(0.2)
+    assert workers[1].local.get(7) is MISSING
+    assert await workers[1].remote.get_many([7, 8]) == {8: None}
+    for worker in workers:
+        await worker.stop()
+
+
+async def test_cache_invalidated_during_load() -> None:
+    server = FakeServer()
+    workers = [TieredCache(LRUCache(), RedisCacheBackend(
+        FakeRedis(server=server), encode=list, decode=tuple))
+        for _ in range(2)]
+    started = asyncio.Event()
+
+    async def load():
+        started.set()
+        await asyncio.sleep(0.05)
+        return (7, 'http://a.com', False)
+
+    # a delete lands while the old row is being loaded, locally ...
+    lookup = asyncio.create_task(workers[0].get_or_load(7, load))
+    await started.wait()
+    await workers[0].invalidate([7])
+    assert (await lookup)[2] is False
+    assert workers[0].local.get(7) is MISSING
+    assert await workers[0].remote.get_many([7]) == {}
+
+    # ... and on another worker
+    started.clear()
+    lookup = asyncio.create_task(workers[0].get_or_load(7, load))
+    await started.wait()
+    await workers[1].invalidate([7])
+    await lookup
+    assert await workers[0].remote.get_many([7]) == {}
+    assert await workers[1].get_or_load(7, load) == (7, 'http://a.com', False)
+    assert await workers[0].remote.get_many([7]) == \
+        {7: (7, 'http://a.com', False)}
+
+
+async def test_single_flight() -> None:
+    flight = SingleFlight(timeout=0.5)
+    calls = []
+
+    async def query(delay=0.05):
+        calls.append(1)
+        await asyncio.sleep(delay)
+        if len(calls) == 1:
+            raise ValueError("boom")
+        return len(calls)
+
+    results = await asyncio.gather(
+        *(flight.do(1, query) for _ in range(5)), return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flight.stats()['shared'] == 4
+    assert flight.stats()['errors'] == 1
+
+    results = await asyncio.gather(*(flight.do(1, query) for _ in range(5)))
+    assert results == [2] * 5
+    assert flight.stats()['shared'] == 8
+
+    slow = asyncio.ensure_future(flight.do(2, lambda: query(1)))
+    await asyncio.sleep(0)
+    assert await flight.do(2, query) == 4
+    assert flight.stats()['timeouts'] == 1
+    assert await slow == 4
+
+
+async def test_cached_single_flight_timeout() -> None:
+    flight = SingleFlight(timeout=0.05)
+    repository = RepositoryURLs(
+        UrlModel, DBHealthModel, HTTPError,
+        cache=TieredCache(LRUCache(), flight=flight), flight=flight)
+    delays = [1, 0]
+
+    async def load_targets(db, ids):
+        await asyncio.sleep(delays.pop(0))
+        return {7: UrlTarget(7, 'http://a.com', False)}
+
+    repository.load_targets = load_targets
+    slow = asyncio.ensure_future(repository.get_target(None, 7))
+    await asyncio.sleep(0)
+    waiter = await asyncio.wait_for(repository.get_target(None, 7), 0.5)
+    assert waiter.original_url == 'http://a.com'
+    assert repository.flight_stats()['timeouts'] == 1
+    assert await slow == waiter
+
+
+async def test_click_logger_batches(client: AsyncClient,
+                                    async_session: AsyncSession) -> None:
+    session_factory = sessionmaker(async_session.bind, class_=AsyncSession,
+                                   expire_on_commit=False)
+    click_logger = ClickLogger(usage_crud, session_factory, max_queue=2,
+                               batch_size=10, flush_interval=60)
+    await click_logger.start()
+    for _ in range(3):
+        await click_logger.record(
+            async_session,
+            UrlUsageCreate(url_id=1, client_host='test', client_port=1)
+        )
+    await click_logger.stop()
+    stats = click_logger.stats()
+    assert stats['written'] == 2
+    assert stats['dropped'] == 1
+    response = await client.get(app.url_path_for("get_url_usage_status",
+                                                 short_url_id=1))
+    assert response.json() == 2
+
+
+async def test_click_logger_stop_during_write() -> None:
+    class SlowRepository:
+        def __init__(self):
+            self.batches = []
+            self.started = asyncio.Event()
+
+        async def create_many(self, db, objs_in):
+            self.started.set()
+            await asyncio.sleep(0.05)
+            self.batches.append(len(objs_in))
+
+    class Session:
+        async def __aenter__(self):
+            return None
+
+        async def __aexit__(self, *args):
+            return None
+
+    repository = SlowRepository()
+    click_logger = ClickLogger(repository, Session, batch_size=1)
+    await click_logger.start()
+    await click_logger.record(
+        None, UrlUsageCreate(url_id=1, client_host='test', client_port=1))
+    await repository.started.wait()
+    await click_logger.record(
+        None, UrlUsageCreate(url_id=1, client_host='test', client_port=2))
+    await click_logger.stop()
+    assert repository.batches == [1, 1]
+    assert click_logger.stats()['written'] == 2
+
+
+async def test_create_multi_partial(client: AsyncClient,
+                                    async_session: AsyncSession) -> None:
+    existing = f'{client.base_url}{app.url_path_for("info_handler")}'
+    new = ''.join(random.choices(string.ascii_lowercase, k=8))
+    response = await client.post(
+        app.url_path_for("create_short_urls"),
+        json=[
+            {'original_url': existing},
+            {'original_url': f'{new}.net'},
+            {'original_url': f'http://{new}.net/'},
+            {'original_url': 'http:// bad url'},
+        ]
+    )
+    assert response.status_code == HTTPStatus.CREATED
+    results = response.json()
+    # url 2 was marked as deleted, it is not handed out again
+    assert [r['status'] for r in results] == [
+        'created', 'created', 'created', 'invalid']
+    assert results[0]['id'] != 2
+    assert results[1]['short_url'] == results[2]['short_url']
+
+
+async def test_create_multi_raced(client: AsyncClient,
+                                  async_session: AsyncSession,
+                                  monkeypatch) -> None:
+    url = f'http://{"".join(random.choices(string.ascii_lowercase, k=8))}.org'
+    response = await client.post(app.url_path_for("create_short_url"),
+                                 json={'original_url': url})
+    created = response.json()
+    build = url_crud.bulk_insert_statement
+
+    def committed_meanwhile(items, codes):
+        # the row is not in the statement snapshot, as if another
+        # transaction committed it while the insert ran
+        monkeypatch.setattr(url_crud, "shared", lambda: (false(),))
+        try:
+            return build(items, codes)
+        finally:
+            monkeypatch.delattr(url_crud, "shared")
+
+    monkeypatch.setattr(url_crud, "bulk_insert_statement",
+                        committed_meanwhile)
+    response = await client.post(app.url_path_for("create_short_urls"),
+                                 json=[{'original_url': url}])
+    [result] = response.json()
+    assert result['status'] == 'exists'
+    assert result['short_url'] == created['short_url']
+
+
+async def test_import_csv(client: AsyncClient,
+                          async_session: AsyncSession) -> None:
+    name = ''.join(random.choices(string.ascii_lowercase, k=8))
+    body = (f'original_url,comment\n{name}.io,first\n'
+            f'http://{name}.io/,again\n"",empty\n')
+    response = await client.post(app.url_path_for("import_urls"),
+                                 content=body.encode(),
+                                 headers={'content-type': 'text/csv'})
+    assert response.status_code == HTTPStatus.OK
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line.get('line') for line in lines[:-1]] == [2, 3, 4]
+    assert lines[0]['status'] == 'created'
+    assert lines[-1]['summary'] == {
+        'total': 3, 'created': 2, 'exists': 0, 'invalid': 1}
+
+
+async def test_iter_lines_oversized() -> None:
+    async def stream():
+        for chunk in (b"1\n" + b"9" * 70, b"9" * 10 + b"42\n7\n",
+                      b"8" * 80, b"\n5"):
+            yield chunk
+
+    lines = [line async for line in iter_lines(stream(), 64)]
+    assert lines == [b"1", b"9" * 70, b"7", b"8" * 80, b"5"]
+
+
+async def test_keyset_pagination(client: AsyncClient,
+                                 async_session: AsyncSession) -> None:
+    ids, cursor = [], None
+    while True:
+        params = {'max-size': 2}
+        if cursor:
+            params['cursor'] = cursor
+        response = await client.get(app.url_path_for("read_entities"),
+                                    params=params)
+        assert response.status_code == HTTPStatus.OK
+        ids += [item['id'] for item in response.json()]
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+    response = await client.get(app.url_path_for("read_entities"))
+    assert ids == [item['id'] for item in response.json()]
+
+    response = await client.get(app.url_path_for("get_url_usage_status",
+                                                 short_url_id=1),
+                                params={'full-info': True, 'max-size': 1})
+    first = response.json()
+    response = await client.get(
+        app.url_path_for("get_url_usage_status", short_url_id=1),
+        params={'full-info': True, 'max-size': 1,
+                'cursor': response.headers['X-Next-Cursor']})
+    assert response.json()[0]['used_at'] > first[0]['used_at']
+
+    response = await client.get(app.url_path_for("read_entities"),
+                                params={'cursor': 'garbage'})
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    for path, cursor in (
+            (app.url_path_for("read_entities"), encode_cursor("abc")),
+            (app.url_path_for("read_entities"), encode_cursor(True)),
+            (app.url_path_for("get_url_usage_status", short_url_id=1),
+             encode_cursor(1, 2))):
+        response = await client.get(path, params={'full-info': True,
+                                                  'cursor': cursor})
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+    response = await client.get(app.url_path_for("read_entities"),
+                                params={'cursor': encode_cursor(2 ** 40)})
+    assert response.json() == []
+
+
+async def test_raw_listings(client: AsyncClient,
+                            async_session: AsyncSession,
+                            monkeypatch) -> None:
+    requests = [(app.url_path_for("read_entities"), {"max-size": 3}),
+                (app.url_path_for("get_url_usage_status", short_url_id=1),
+                 {"full-info": True, "max-size": 2}),
+                (app.url_path_for("get_url_usage_status", short_url_id=1),
+                 {})]
+    expected = [await client.get(path, params=params)
+                for path, params in requests]
+    monkeypatch.setattr(app_settings, "RAW_LISTINGS_ENABLED", True)
+    for (path, params), before in zip(requests, expected):
+        response = await client.get(path, params=params)
+        assert response.status_code == before.status_code
+        assert response.json() == before.json()
+        assert response.headers.get('X-Next-Cursor') == \
+            before.headers.get('X-Next-Cursor')
+    assert expected[0].headers['X-Next-Cursor']
+    assert len(expected[1].json()) == 2
+
+
+async def test_export(client: AsyncClient,
+                      async_session: AsyncSession) -> None:
+    response = await client.get(app.url_path_for("export_urls"),
+                                params={"id": [1, 2, 10 ** 6]})
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row['id'] for row in rows] == [1, 2]
+    assert {'original_url', 'created_at', 'deleted'} <= set(rows[0])
+
+    response = await client.get(app.url_path_for("export_urls"),
+                                params={"deleted": True, "format": "csv"})
+    assert response.headers['content-type'].startswith('text/csv')
+    lines = response.text.splitlines()
+    assert lines[0].startswith('id,original_url,short_url,created_at')
+    assert len(lines) > 1
+    assert all(line.split(',')[4] == 'True' for line in lines[1:])
+
+    response = await client.get(
+        app.url_path_for("export_clicks"),
+        params={"url-id": 1, "used-from": "2000-01-01T00:00:00"})
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert rows and {row['url_id'] for row in rows} == {1}
+    response = await client.get(app.url_path_for("export_clicks"),
+                                params={"used-to": "2000-01-01T00:00:00"})
+    assert response.text == ''
+
+    response = await client.get(
+        app.url_path_for("export_urls"),
+        params={"id": 1, "created-from": "2000-01-01T03:00:00+03:00",
+                "format": "csv"})
+    assert response.status_code == HTTPStatus.OK
+    assert len(response.text.splitlines()) == 2
+    for name, params in (("export_urls", {"id": 2 ** 31}),
+                         ("export_clicks", {"url-id": 0})):
+        response = await client.get(app.url_path_for(name), params=params)
+        assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+async def test_usage_partitions(client: AsyncClient,
+                                async_session: AsyncSession) -> None:
+    async def watermark(db: AsyncSession) -> int:
+        return 0
+
+    await async_session.commit()
+    factory = sessionmaker(async_session.bind, class_=AsyncSession)
+    manager = PartitionManager("usage", "used_at", factory, premake=1,
+                               watermark=watermark)
+    now = datetime.utcnow()
+    total = (await async_session.execute(
+        text("SELECT count(*) FROM usage"))).scalar_one()
+    await async_session.commit()
+    created, dropped = await manager.run_once(now)
+    assert created == [f"usage_p{now:%Y%m}",
+                       f"usage_p{next_month(now):%Y%m}"]
+    assert dropped == []
+    # this month's rows moved out of the default partition
+    results = await async_session.execute(text(
+        "SELECT tableoid::regclass::text, count(*) FROM usage "
+        "GROUP BY 1"))
+    assert dict(results.all()) == {f"usage_p{now:%Y%m}": total}
+    await async_session.commit()
+    assert await manager.run_once(now) == ([], [])
+    async with factory() as db:
+        assert await manager.claim(db) is not None
+        assert await manager.run_once(next_month(next_month(now))) == (
+            [], [])
+
+    response = await client.get(app.url_path_for("get_url", url_id=1))
+    assert response.status_code == HTTPStatus.TEMPORARY_REDIRECT
+    partitions = {partition.name: partition
+                  for partition in await manager.partitions(async_session)}
+    await async_session.commit()
+    async with factory() as db:
+        assert not await manager.drop(db, partitions[f"usage_p{now:%Y%m}"])
+        assert await manager.drop(
+            db, partitions[f"usage_p{next_month(now):%Y%m}"])
+    assert len(await manager.partitions(async_session)) == 1
+
+
+async def test_redirect_snapshot(client: AsyncClient,
+                                 async_session: AsyncSession,
+                                 tmp_path) -> None:
+    name = ''.join(random.choices(string.ascii_lowercase, k=8))
+    response = await client.post(
+        app.url_path_for("create_short_url"),
+        json={'original_url': f'http://{name}.io/plain'})
+    plain = response.json()
+    response = await client.post(
+        app.url_path_for("create_short_url"),
+        json={'original_url': f'http://{name}.io/limited', 'max_clicks': 5})
+    limited = response.json()['id']
+    path = str(tmp_path / 'urls.snapshot')
+    rows, codes = url_crud.snapshot_sources(async_session, chunk_size=7)
+    assert await write_snapshot(path, rows, codes) >= 2
+    await async_session.commit()
+
+    snapshot = RedirectSnapshot(path)
+    repository = RepositoryURLs(UrlModel, DBHealthModel, HTTPError,
+                                snapshot=snapshot)
+    id = plain['id']
+    expected = (await url_crud.load_targets(async_session, [id]))[id]
+    assert snapshot.get(id) == expected
+    assert snapshot.code_id(plain['short_url']) == id
+    assert snapshot.code_id(plain['short_url'] + '~') is None
+    assert snapshot.get(10 ** 9) is None
+    # click limits need the live counter
+    assert snapshot.get(limited) is None
+    assert (await repository.get_target(async_session, limited)).max_clicks
+
+    response = await client.post(
+        app.url_path_for("create_short_url"),
+        json={'original_url': f'http://{name}.io/newer'})
+    newer = response.json()
+    assert snapshot.get(newer['id']) is None
+    found = await repository.get_target_by_code(async_session,
+                                                newer['short_url'])
+    assert found.original_url == newer['original_url']
+    await repository.on_written([id])
+    assert snapshot.get(id) is None
+    assert snapshot.stats()['hits'] == 1
+
+    # deletes through other workers are polled from url.changed_at
+    factory = sessionmaker(async_session.bind, class_=AsyncSession)
+    polled = RedirectSnapshot(path, changes=url_crud.changed_since,
+                              session_factory=factory)
+    assert polled.get(id) is None
+    await polled.poll_changes()
+    assert polled.get(id) == expected
+    assert await url_crud.set_deleted_many(async_session, [id]) == [id]
+    await polled.poll_changes()
+    assert polled.get(id) is None
+    await url_crud.set_deleted_many(async_session, [id], deleted=False)
+    # and announced ones skip it at once
+    other = RedirectSnapshot(path)
+    cache = TieredCache(LRUCache(), on_drop=other.on_written)
+    assert other.get(id) is not None
+    await cache.invalidate([id])
+    assert other.get(id) is None
+
+
+async def test_click_counter(client: AsyncClient,
+                             async_session: AsyncSession) -> None:
+    url = ''.join(random.choices(string.ascii_lowercase, k=8))
+    response = await client.post(app.url_path_for("create_short_url"),
+                                 json={'original_url': f'{url}.dev'})
+    url_id = response.json()['id']
+    for _ in range(3):
+        await client.get(app.url_path_for("get_url", url_id=url_id))
+    response = await client.get(app.url_path_for("get_url_usage_status",
+                                                 short_url_id=url_id))
+    assert response.json() == 3
+
+    await async_session.execute(
+        update(UrlModel).where(UrlModel.id == url_id).values(click_count=0))
+    await async_session.commit()
+    fixed = await usage_crud.reconcile_counts(
+        async_session, start_id=url_id, end_id=url_id + 1)
+    assert fixed == 1
+    response = await client.get(app.url_path_for("get_url_usage_status",
+                                                 short_url_id=url_id))
+    assert response.json() == 3
+
+
+async def test_usage_stats(client: AsyncClient,
+                           async_session: AsyncSession) -> None:
+    url = ''.join(random.choices(string.ascii_lowercase, k=8))
+    response = await client.post(app.url_path_for("create_short_url"),
+                                 json={'original_url': f'{url}.app'})
+    url_id = response.json()['id']
+    for referrer in ('http://a.example/', 'http://a.example/', None):
+        headers = {'referer': referrer} if referrer else {}
+        await client.get(app.url_path_for("get_url", url_id=url_id),
+                         headers=headers)
+    assert await analytics_crud.rollup(async_session, lag=0) > 0
+
+    response = await client.get(app.url_path_for("get_url_usage_stats",
+                                                 short_url_id=url_id),
+                                params={'granularity': 'day'})
+    assert response.status_code == HTTPStatus.OK
+    stats = response.json()
+    assert stats['total'] == 3
+    assert stats['unique_hosts'] == 1
+    assert stats['top_referrers'] == [
+        {'referrer': 'http://a.example/', 'clicks': 2}]
+    response = await client.get(app.url_path_for("get_url_usage_stats",
+                                                 short_url_id=url_id),
+                                params={'granularity': 'day',
+                                        'from': '2000-01-01T00:00:00Z'})
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()['total'] == 3
+
+    await analytics_crud.prune(async_session, raw_days=-1, minute_days=7,
+                               hour_days=180)
+    await async_session.execute(
+        update(UrlModel).where(UrlModel.id == url_id).values(click_count=0))
+    await async_session.commit()
+    await usage_crud.reconcile_counts(
+        async_session, start_id=url_id, end_id=url_id + 1,
+        after_usage_id=await analytics_crud.watermark(async_session),
+        rolled_up=analytics_crud.rolled_up_clicks)
+    response = await client.get(app.url_path_for("get_url_usage_status",
+                                                 short_url_id=url_id))
+    assert response.json() == 3
+
+
+async def test_rollup_waits_for_writers(async_session: AsyncSession) -> None:
+    await analytics_crud.rollup(async_session, lag=0)
+    low = await analytics_crud.watermark(async_session)
+    session_factory = sessionmaker(async_session.bind, class_=AsyncSession,
+                                   expire_on_commit=False)
+    row = {'url_id': None, 'client_host': 'test', 'client_port': 1}
+    async with session_factory() as slow, session_factory() as fast:
+        await usage_crud.lock_writes(slow)
+        await slow.execute(insert(UrlUsageModel).values(row))
+        await usage_crud.create_many(fast, objs_in=[row])
+        analytics = RepositoryAnalytics(
+            UrlUsageModel, UsageRollupModel, UsageHostRollupModel,
+            UsageReferrerRollupModel, RollupStateModel,
+            write_lock=USAGE_WRITE_LOCK, lock_timeout=0.2)
+        assert await analytics.rollup(async_session, lag=0) == 0
+        assert await analytics_crud.watermark(async_session) == low
+        await slow.commit()
+    assert await analytics.rollup(async_session, lag=0) == 2
+
+
+async def test_black_list(client: AsyncClient, tmp_path) -> None:
+    response = await client.get(app.url_path_for("info_handler"),
+                                headers={'host': 'localhost'})
+    assert response.status_code == HTTPStatus.FORBIDDEN
+
+    black_list = tmp_path / 'blacklist.txt'
+    black_list.write_text('10.1.0.0/16\n2001:db8::/32  # docs\n')
+    middleware = BlackListMiddleware(app, path=str(black_list),
+                                     trusted_proxies=['127.0.0.1/32'])
+
+    def scope(peer: str, forwarded: str = '') -> dict:
+        headers = [(b'x-forwarded-for', forwarded.encode())] \
+            if forwarded else []
+        return {'type': 'http', 'client': (peer, 1), 'headers': headers}
+
+    assert middleware.blocked(scope('10.1.2.3'))
+    assert middleware.blocked(scope('2001:db8::1'))
+    assert not middleware.blocked(scope('10.2.0.1'))
+    assert middleware.blocked(scope('127.0.0.1', '1.2.3.4, 10.1.9.9'))
+    assert not middleware.blocked(scope('127.0.0.1', '10.1.9.9, 1.2.3.4'))
+    assert not middleware.blocked(scope('8.8.8.8', '10.1.9.9'))
+
+
+async def test_pool_stats(client: AsyncClient) -> None:
+    response = await client.get(app.url_path_for("pool_stats"))
+    assert response.status_code == HTTPStatus.OK
+    result = response.json()['primary']
+    assert {'size', 'checked_out', 'waiters', 'wait_seconds'} <= set(result)
+
+
+async def test_request_metrics(client: AsyncClient,
+                               async_session: AsyncSession) -> None:
+    def sample(lines: list[str], series: str) -> float:
+        return next((float(line.split()[-1]) for line in lines
+                     if line.startswith(series + ' ')), 0)
+
+    redirects = 'http_responses_total{method="GET",handler="get_url",' \
+        'status="307"}'
+    before = (await client.get(app.url_path_for("metrics"))).text
+    request_metrics.instrument(async_session.bind.sync_engine)
+    response = await client.post(app.url_path_for("create_short_url"),
+                                 json={"original_url": "metrics.example.com"})
+    url_id = response.json()['id']
+    response = await client.get(app.url_path_for("get_url", url_id=url_id))
+    assert response.status_code == HTTPStatus.TEMPORARY_REDIRECT
+
+    response = await client.get(app.url_path_for("metrics"))
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers['content-type'].startswith('text/plain')
+    lines = response.text.splitlines()
+    assert sample(lines, redirects) == \
+        sample(before.splitlines(), redirects) + 1
+    assert sample(lines, 'db_queries_per_request_sum{method="POST",'
+                  'handler="create_short_url"}') >= 1
+    # a new method on the same handler starts its own series
+    redirect_queries = 'db_queries_per_request_count{method="GET",' \
+        'handler="get_url"}'
+    assert sample(lines, redirect_queries) >= 1
+    await client.head(app.url_path_for("get_url", url_id=url_id))
+    after = (await client.get(app.url_path_for("metrics"))).text
+    assert sample(after.splitlines(), redirect_queries) == \
+        sample(lines, redirect_queries)
+    assert any(line.startswith('db_pool_checked_out{engine="primary"}')
+               for line in lines)
+
+
+async def test_read_router(client: AsyncClient,
+                           async_session: AsyncSession) -> None:
+    router = ReadRouter(async_session.bind, window=60)
+    repository = RepositoryURLs(UrlModel, DBHealthModel, HTTPError,
+                                reads=router)
+    assert (await repository.get(async_session, 1)).id == 1
+    assert await repository.get(async_session, 10 ** 6) is None
+    assert router.replica_reads == 2
+    assert router.primary_reads == 0
+
+    await repository.on_written([1])
+    assert (await repository.get(async_session, 1)).id == 1
+    assert router.primary_reads == 1
+    assert router.bind_arguments(listing=True) == {}
+    assert router.bind_arguments(2)